@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray
+    answer: str
+    created: float
+
+
+class AnswerCache:
+    """Semantic cache of final answers for repeated questions.
+
+    An entry is reused when a new question's embedding is within
+    `threshold` cosine similarity of a cached question *and* retrieval
+    returned exactly the same chunk ids. Chunk ids are content hashes, so a
+    re-ingested document yields new ids and stops matching on its own;
+    `invalidate` drops entries eagerly when the live store changes.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400.0, max_entries: int = 512):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[FrozenSet[str], List[_Entry]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def lookup(self, vector: Sequence[float], doc_ids: Iterable[str]) -> Optional[str]:
+        key = frozenset(doc_ids)
+        q = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            entries = [e for e in self._entries.get(key, []) if now - e.created < self.ttl]
+            if entries:
+                self._entries[key] = entries
+                sims = np.stack([e.vector for e in entries]) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self.hits += 1
+                    return entries[best].answer
+            self.misses += 1
+        return None
+
+    def store(self, vector: Sequence[float], doc_ids: Iterable[str], answer: str) -> None:
+        if self.max_entries <= 0 or not answer.strip():
+            return
+        key = frozenset(doc_ids)
+        with self._lock:
+            self._entries.setdefault(key, []).append(
+                _Entry(self._normalize(vector), answer, time.time())
+            )
+            self._size += 1
+            if self._size > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        oldest_key = min(self._entries, key=lambda k: self._entries[k][0].created)
+        bucket = self._entries[oldest_key]
+        bucket.pop(0)
+        if not bucket:
+            del self._entries[oldest_key]
+        self._size -= 1
+
+    def invalidate(self, doc_ids: Iterable[str]) -> int:
+        changed = set(doc_ids)
+        with self._lock:
+            stale = [k for k in self._entries if k & changed]
+            dropped = sum(len(self._entries.pop(k)) for k in stale)
+            self._size -= dropped
+        return dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import aiohttp
+import numpy as np
+
+from .bm25 import BM25Index
+from .tokens import count_tokens, truncate_tokens
+
+
+logger = logging.getLogger("reachy-mini.attachments")
+
+TEXT_SUFFIXES = (".txt", ".log", ".md")
+# Lines that open a window worth keeping in a log
+_SIGNAL_RE = re.compile(
+    r"\b(error|err|warn(?:ing)?|fatal|critical|exception|traceback|failed|failure|"
+    r"panic|timed? ?out|refused|denied|not found)\b",
+    re.I,
+)
+# Timestamps, hex ids and numbers: repeats that differ only in these collapse
+_VOLATILE_RE = re.compile(r"\d{4}-\d\d-\d\d[T ][\d:.,]+|0x[0-9a-f]+|\d+", re.I)
+# Log-ish line prefixes: a timestamp or a level
+_LOG_LINE_RE = re.compile(
+    r"^\s*(\[?\d{4}-\d\d-\d\d|\[?\d\d:\d\d:\d\d|\[?(DEBUG|INFO|WARN|WARNING|ERROR|CRITICAL|FATAL)\b)"
+)
+# Most slices scored per attachment; the rest of a huge log is not embedded
+MAX_SLICES = 64
+
+Embed = Callable[[List[str]], Awaitable[Sequence[Sequence[float]]]]
+# Runs a module-level function off the event loop: fn, *args -> result
+Offload = Callable[..., Awaitable[Any]]
+
+
+def is_text_attachment(filename: Optional[str], content_type: Optional[str]) -> bool:
+    name = (filename or "").lower()
+    return name.endswith(TEXT_SUFFIXES) or bool(content_type and content_type.startswith("text/"))
+
+
+class ByteBudget:
+    """Bytes that the concurrent downloads of one request may read in total."""
+
+    def __init__(self, total: int):
+        self.left = total
+
+    def take(self, n: int) -> int:
+        granted = max(0, min(n, self.left))
+        self.left -= granted
+        return granted
+
+
+async def read_capped(
+    session: aiohttp.ClientSession,
+    url: str,
+    cap: int,
+    budget: ByteBudget,
+    chunk_size: int = 64 * 1024,
+) -> Tuple[bytes, bool]:
+    """Stream `url`, stopping at `cap` bytes or when `budget` runs out.
+    Returns (data, truncated)."""
+    buf = bytearray()
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            got = budget.take(min(len(chunk), cap - len(buf)))
+            buf += chunk[:got]
+            if got < len(chunk):
+                # Drop the partial last line
+                cut = buf.rfind(b"\n")
+                return bytes(buf[: cut + 1] if cut > 0 else buf), True
+    return bytes(buf), False
+
+
+def looks_like_log(name: str, text: str) -> bool:
+    if name.lower().endswith(".log"):
+        return True
+    sample = [l for l in text.splitlines()[:50] if l.strip()]
+    return bool(sample) and sum(bool(_LOG_LINE_RE.match(l)) for l in sample) * 2 >= len(sample)
+
+
+def _gap(n: int) -> str:
+    return f"… ({n} lines omitted)"
+
+
+def condense_log(text: str, head: int = 20, tail: int = 40, context: int = 3) -> str:
+    """Collapse repeated lines, then keep the head, the tail and a window of
+    `context` lines around every error/warning line."""
+    lines = text.splitlines()
+    counts: Counter = Counter()
+    first: List[Tuple[str, str]] = []
+    for line in lines:
+        key = _VOLATILE_RE.sub("#", line.strip())
+        if not key:
+            continue
+        if key not in counts:
+            first.append((key, line.rstrip()))
+        counts[key] += 1
+    kept = [
+        f"{line}  [×{counts[key]}]" if counts[key] > 1 else line for key, line in first
+    ]
+    if len(kept) <= head + tail:
+        return "\n".join(kept)
+    keep = set(range(head)) | set(range(len(kept) - tail, len(kept)))
+    for i, line in enumerate(kept):
+        if _SIGNAL_RE.search(line):
+            keep.update(range(max(0, i - context), min(len(kept), i + context + 1)))
+    out: List[str] = []
+    last = -1
+    for i in sorted(keep):
+        if i > last + 1:
+            out.append(_gap(i - last - 1))
+        out.append(kept[i])
+        last = i
+    return "\n".join(out)
+
+
+def split_slices(text: str, max_tokens: int = 200) -> List[str]:
+    # Whole lines packed into slices of at most ~max_tokens
+    slices: List[str] = []
+    cur: List[str] = []
+    used = 0
+    for line in text.splitlines():
+        n = count_tokens(line) + 1
+        if n > max_tokens:
+            line = truncate_tokens(line, max_tokens)
+            n = max_tokens
+        if cur and used + n > max_tokens:
+            slices.append("\n".join(cur))
+            cur, used = [], 0
+        cur.append(line)
+        used += n
+    if cur:
+        slices.append("\n".join(cur))
+    return slices
+
+
+def _lexical_scores(question: str, slices: List[str]) -> np.ndarray:
+    index = BM25Index()
+    ids = [str(i) for i in range(len(slices))]
+    index.add(ids, slices)
+    scores = np.zeros(len(slices), dtype=np.float32)
+    for doc_id, score in index.search(question, k=len(slices)):
+        scores[int(doc_id)] = score
+    return scores
+
+
+def _prepare(name: str, text: str, max_tokens: int) -> Tuple[str, List[str]]:
+    if looks_like_log(name, text):
+        text = condense_log(text)
+    if count_tokens(text) <= max_tokens:
+        return text, []
+    return text, split_slices(text)
+
+
+@dataclass
+class TextAttachment:
+    name: str
+    text: str
+    truncated: bool = False
+
+    def render(self) -> str:
+        note = " (truncated: download size cap)" if self.truncated else ""
+        return f"[{self.name}{note}]\n{self.text}"
+
+
+class AttachmentProcessor:
+    """Downloads text attachments concurrently and trims them for the prompt.
+
+    Reads are streamed and stop at `max_file_bytes` per file and
+    `max_bytes` per request, shared by all downloads as data arrives. Logs
+    are condensed (`condense_log`). Text still over the token budget is cut
+    into slices: the first and last are kept, plus the slices most similar
+    to the question. Similarity is by embedding, or BM25 if embedding
+    fails, or error density if there is no question. `offload` runs the
+    condensing elsewhere, e.g. on the query worker processes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 4_000_000,
+        max_file_bytes: int = 2_000_000,
+        max_tokens: int = 2000,
+        embed: Optional[Embed] = None,
+        timeout: float = 20.0,
+        offload: Optional[Offload] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_tokens = max_tokens
+        self.embed = embed
+        self.timeout = timeout
+        self.offload = offload
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def collect(self, attachments: Sequence, question: str) -> List[str]:
+        """`attachments` are discord.Attachment-like (filename, content_type,
+        size, url). Returns prompt-ready texts in attachment order."""
+        wanted = [
+            a
+            for a in attachments
+            if is_text_attachment(a.filename, a.content_type) and (a.size or 0) > 0
+        ]
+        if not wanted:
+            return []
+        budget = ByteBudget(self.max_bytes)
+        per_file = max(1, self.max_tokens // len(wanted))
+        results: List[Optional[str]] = [None] * len(wanted)
+
+        async def one(i: int) -> None:
+            a = wanted[i]
+            try:
+                data, truncated = await read_capped(
+                    self._http(), a.url, self.max_file_bytes, budget
+                )
+            except Exception as e:
+                logger.warning("Could not read attachment %s: %s", a.filename, e)
+                return
+            if not data:
+                return
+            text = data.decode("utf-8", errors="replace")
+            text = await self.trim(a.filename or "attachment", text, question, per_file)
+            results[i] = TextAttachment(a.filename or "attachment", text, truncated).render()
+
+        await asyncio.gather(*(one(i) for i in range(len(wanted))))
+        return [r for r in results if r]
+
+    async def trim(self, name: str, text: str, question: str, max_tokens: int) -> str:
+        # Condensing and tokenizing a multi-MB log is CPU work: off the loop
+        if self.offload is not None:
+            text, slices = await self.offload(_prepare, name, text, max_tokens)
+        else:
+            loop = asyncio.get_running_loop()
+            text, slices = await loop.run_in_executor(None, _prepare, name, text, max_tokens)
+        if not slices:
+            return text
+        # First and last slices always stay; the middle competes for the rest
+        ends = {0, len(slices) - 1}
+        middle = [i for i in range(len(slices)) if i not in ends]
+        if len(middle) > MAX_SLICES:
+            # Too many to embed: pre-filter on error density
+            middle.sort(key=lambda i: -len(_SIGNAL_RE.findall(slices[i])))
+            middle = sorted(middle[:MAX_SLICES])
+        scores = await self._score(question, [slices[i] for i in middle])
+        room = max_tokens - sum(count_tokens(slices[i]) for i in ends)
+        keep = set(ends)
+        for j in np.argsort(-scores, kind="stable"):
+            n = count_tokens(slices[middle[j]])
+            if n <= room:
+                keep.add(middle[j])
+                room -= n
+        out: List[str] = []
+        last = -1
+        for i in sorted(keep):
+            if i > last + 1:
+                out.append("…")
+            out.append(slices[i])
+            last = i
+        return "\n".join(out)
+
+    async def _score(self, question: str, slices: List[str]) -> np.ndarray:
+        if not slices:
+            return np.zeros(0, dtype=np.float32)
+        if not question.strip():
+            # Nothing to compare with: favour the slices with the most errors
+            return np.array([len(_SIGNAL_RE.findall(s)) for s in slices], dtype=np.float32)
+        if self.embed is not None:
+            try:
+                vectors = np.asarray(await self.embed([question] + slices), dtype=np.float32)
+                vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+                return vectors[1:] @ vectors[0]
+            except Exception as e:
+                logger.warning("Embedding attachment slices failed (%s); using BM25", e)
+        return _lexical_scores(question, slices)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+(?:[.\-][a-z0-9_]+)*")
+_SPLIT_RE = re.compile(r"[._\-]+")
+
+
+def tokenize(text: str) -> List[str]:
+    # Markdown-escaped underscores (set\_target) are normalized so headings and
+    # code spell identifiers the same way
+    text = text.lower().replace("\\_", "_")
+    out: List[str] = []
+    for m in _TOKEN_RE.finditer(text):
+        tok = m.group(0)
+        out.append(tok)
+        # Compound identifiers (reachy_mini.set_target, error-codes) also match by part
+        if any(c in tok for c in "._-"):
+            out.extend(p for p in _SPLIT_RE.split(tok) if p)
+    return out
+
+
+class BM25Index:
+    """In-process BM25 inverted index over the RAG chunks.
+
+    Chunk text and metadata are kept alongside the postings so lexical search
+    can answer without touching Chroma or the embedding service. Only the
+    documents are persisted; postings are rebuilt on load.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, Tuple[str, dict]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, ids: List[str], texts: List[str], metadatas: Optional[List[dict]] = None) -> None:
+        with self._lock:
+            self._remove(ids)
+            for i, (doc_id, text) in enumerate(zip(ids, texts)):
+                meta = (metadatas[i] if metadatas else None) or {}
+                terms = tokenize(text)
+                self.docs[doc_id] = (text, meta)
+                self._lengths[doc_id] = len(terms)
+                self._total_len += len(terms)
+                for term, tf in Counter(terms).items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+            self.dirty = True
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]) -> None:
+        with self._lock:
+            for doc_id, meta in zip(ids, metadatas):
+                if doc_id in self.docs:
+                    self.docs[doc_id] = (self.docs[doc_id][0], meta)
+            self.dirty = True
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._remove(ids)
+
+    def source_ids(self, source: str) -> List[str]:
+        with self._lock:
+            return [i for i, (_, m) in self.docs.items() if m.get("source") == source]
+
+    def _remove(self, ids: Iterable[str]) -> None:
+        for doc_id in ids:
+            entry = self.docs.pop(doc_id, None)
+            if entry is None:
+                continue
+            self._total_len -= self._lengths.pop(doc_id, 0)
+            for term in set(tokenize(entry[0])):
+                posting = self._postings.get(term)
+                if posting is not None:
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self._postings[term]
+            self.dirty = True
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avgdl = self._total_len / n or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = {
+                "version": 1,
+                "docs": {i: {"text": t, "meta": m} for i, (t, m) in self.docs.items()},
+            }
+            self.dirty = False
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Rebuilt from the vector store by the caller
+            return None
+        index = cls()
+        docs = data.get("docs", {})
+        ids = list(docs)
+        index.add(ids, [docs[i]["text"] for i in ids], [docs[i].get("meta") or {} for i in ids])
+        index.dirty = False
+        return index
@@ -13,7 +13,114 @@ class Settings:
     rag_collection: str = "reachy_mini"
     openai_model: str = "gpt-4o-mini"
     openai_embedding_model: str = "text-embedding-3-small"
+    # Alternative OpenAI-compatible endpoint (e.g. a proxy or the load-test fake)
+    openai_base_url: str = ""
+    # Chat resilience: cheaper/faster model used when the main one keeps
+    # failing, read timeout, retries, hedge delay (0 disables hedging),
+    # circuit breaker and connection pool size
+    openai_fallback_model: str = ""
+    openai_timeout: float = 60.0
+    openai_max_retries: int = 3
+    openai_hedge_after: float = 0.0
+    openai_breaker_threshold: int = 5
+    openai_breaker_cooldown: float = 30.0
+    openai_max_connections: int = 20
     thread_history_limit: int = 25
+    # Per-stage concurrency limits for the request pipeline
+    rag_workers: int = 4
+    rag_concurrency: int = 3
+    llm_concurrency: int = 3
+    # Request scheduler: mentions handled at once, queue bound, per-user and
+    # per-channel token buckets (requests per minute, burst) and the window
+    # in which repeated mentions in a thread are merged
+    request_concurrency: int = 4
+    request_queue_size: int = 50
+    user_rate_per_min: float = 6.0
+    user_burst: int = 3
+    channel_rate_per_min: float = 30.0
+    channel_burst: int = 10
+    coalesce_window: float = 10.0
+    # Stream replies into Discord, editing the message as tokens arrive
+    stream_replies: bool = True
+    stream_edit_interval: float = 1.0
+    # Outbound Discord calls: at most send_channel_limit sends and edits per
+    # channel in any send_channel_window seconds (Discord's bucket), and
+    # answers longer than reply_file_chars sent as an attached .md file
+    send_channel_limit: int = 5
+    send_channel_window: float = 5.0
+    reply_file_chars: int = 6000
+    # Max entries in the on-disk embedding cache (0 disables it)
+    embedding_cache_size: int = 200_000
+    # "openai", "onnx" (local sentence-embedding model on CPU) or "hash"
+    # (offline feature hashing, for tests and benchmarks)
+    embedding_backend: str = "openai"
+    local_embedding_model_path: str = ""
+    embedding_threads: int = 0
+    embedding_batch_size: int = 32
+    # Retrieval: "hybrid" (BM25 + vector, fused), "vector" or "lexical"
+    rag_search_mode: str = "hybrid"
+    rag_vector_timeout: float = 5.0
+    # Vector index: "chroma" or "mmap" (memory-mapped int8/float16 matrix,
+    # brute-force top-k, optional exact float32 rescoring of the candidates)
+    vector_store: str = "chroma"
+    vector_dtype: str = "int8"
+    vector_rescore: bool = True
+    # Rerank: over-fetch candidates, pick a diverse set with MMR (diversity
+    # 0-1), merge neighbouring chunks, optionally rescore with a local ONNX
+    # cross-encoder, and cap the retrieved context at rag_context_tokens
+    rag_rerank: bool = True
+    rerank_fetch: int = 30
+    rerank_diversity: float = 0.3
+    rerank_model_path: str = ""
+    rag_context_tokens: int = 3000
+    # Poll rag_documents_path every N seconds and ingest changed files into
+    # the live store (0 disables the watcher; /add_rag ingests regardless)
+    rag_watch_interval: float = 0.0
+    # Semantic answer cache for repeated thread-opening questions (size 0 disables)
+    answer_cache_size: int = 512
+    answer_cache_threshold: float = 0.95
+    answer_cache_ttl: float = 86400.0
+    # In-memory thread history fed by gateway events
+    history_cache_threads: int = 256
+    history_cache_messages: int = 500
+    # Text attachments: bytes downloaded per request and per file (streamed,
+    # cut at the cap) and tokens kept after log condensing and slicing
+    attachment_max_bytes: int = 4_000_000
+    attachment_file_bytes: int = 2_000_000
+    attachment_max_tokens: int = 2000
+    # Token budget for the assembled prompt (system + query + attachments +
+    # history + retrieved context)
+    prompt_max_tokens: int = 6000
+    # Prometheus endpoint at http://metrics_host:metrics_port/metrics (0 disables it)
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
+    # Run the event loop on uvloop when it is installed
+    use_uvloop: bool = True
+    # Gateway shards (0: Discord's recommendation) and worker processes for
+    # retrieval and attachment parsing (0: run them in the gateway process)
+    shard_count: int = 0
+    query_workers: int = 0
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)).strip())
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)).strip())
+    except Exception:
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or not raw.strip():
+        return default
+    return raw.strip().lower() in ("1", "true", "yes", "on")
 
 
 def load_settings() -> Settings:
@@ -28,11 +135,72 @@ def load_settings() -> Settings:
     openai_embedding_model = os.getenv(
         "OPENAI_EMBEDDING_MODEL", "text-embedding-3-small"
     ).strip()
+    openai_base_url = os.getenv("OPENAI_BASE_URL", "").strip()
+    openai_fallback_model = os.getenv("OPENAI_FALLBACK_MODEL", "").strip()
+    openai_timeout = max(1.0, _env_float("OPENAI_TIMEOUT", 60.0))
+    openai_max_retries = max(0, _env_int("OPENAI_MAX_RETRIES", 3))
+    openai_hedge_after = max(0.0, _env_float("OPENAI_HEDGE_AFTER", 0.0))
+    openai_breaker_threshold = max(1, _env_int("OPENAI_BREAKER_THRESHOLD", 5))
+    openai_breaker_cooldown = max(1.0, _env_float("OPENAI_BREAKER_COOLDOWN", 30.0))
+    openai_max_connections = max(1, _env_int("OPENAI_MAX_CONNECTIONS", 20))
     # Optional: number of prior messages from the current thread to include
-    try:
-        thread_history_limit = int(os.getenv("THREAD_HISTORY_LIMIT", "25").strip())
-    except Exception:
-        thread_history_limit = 25
+    thread_history_limit = _env_int("THREAD_HISTORY_LIMIT", 25)
+    # Threads used for blocking Chroma/embedding calls, and how many requests
+    # may be in each stage at once
+    rag_workers = max(1, _env_int("RAG_WORKERS", 4))
+    rag_concurrency = max(1, _env_int("RAG_CONCURRENCY", 3))
+    llm_concurrency = max(1, _env_int("LLM_CONCURRENCY", 3))
+    request_concurrency = max(1, _env_int("REQUEST_CONCURRENCY", 4))
+    request_queue_size = max(0, _env_int("REQUEST_QUEUE_SIZE", 50))
+    user_rate_per_min = max(0.0, _env_float("USER_RATE_PER_MIN", 6.0))
+    user_burst = max(1, _env_int("USER_BURST", 3))
+    channel_rate_per_min = max(0.0, _env_float("CHANNEL_RATE_PER_MIN", 30.0))
+    channel_burst = max(1, _env_int("CHANNEL_BURST", 10))
+    coalesce_window = max(0.0, _env_float("COALESCE_WINDOW", 10.0))
+    # Discord allows ~5 edits per 5s per channel; keep the cadence at or above 1s
+    stream_replies = _env_bool("STREAM_REPLIES", True)
+    stream_edit_interval = max(1.0, _env_float("STREAM_EDIT_INTERVAL", 1.0))
+    send_channel_limit = max(1, _env_int("SEND_CHANNEL_LIMIT", 5))
+    send_channel_window = max(0.0, _env_float("SEND_CHANNEL_WINDOW", 5.0))
+    reply_file_chars = max(0, _env_int("REPLY_FILE_CHARS", 6000))
+    embedding_cache_size = max(0, _env_int("EMBEDDING_CACHE_SIZE", 200_000))
+    embedding_backend = os.getenv("EMBEDDING_BACKEND", "openai").strip().lower()
+    if embedding_backend not in ("openai", "onnx", "hash"):
+        raise RuntimeError("EMBEDDING_BACKEND must be 'openai', 'onnx' or 'hash'.")
+    local_embedding_model_path = os.getenv("LOCAL_EMBEDDING_MODEL_PATH", "").strip()
+    embedding_threads = max(0, _env_int("EMBEDDING_THREADS", 0))
+    embedding_batch_size = max(1, _env_int("EMBEDDING_BATCH_SIZE", 32))
+    rag_search_mode = os.getenv("RAG_SEARCH_MODE", "hybrid").strip().lower()
+    # Past this, hybrid search answers from the lexical index alone
+    rag_vector_timeout = _env_float("RAG_VECTOR_TIMEOUT", 5.0)
+    vector_store = os.getenv("VECTOR_STORE", "chroma").strip().lower()
+    if vector_store not in ("chroma", "mmap"):
+        raise RuntimeError("VECTOR_STORE must be 'chroma' or 'mmap'.")
+    vector_dtype = os.getenv("VECTOR_DTYPE", "int8").strip().lower()
+    if vector_dtype not in ("int8", "float16"):
+        raise RuntimeError("VECTOR_DTYPE must be 'int8' or 'float16'.")
+    vector_rescore = _env_bool("VECTOR_RESCORE", True)
+    rag_rerank = _env_bool("RAG_RERANK", True)
+    rerank_fetch = max(1, _env_int("RERANK_FETCH", 30))
+    rerank_diversity = min(1.0, max(0.0, _env_float("RERANK_DIVERSITY", 0.3)))
+    rerank_model_path = os.getenv("RERANK_MODEL_PATH", "").strip()
+    rag_context_tokens = max(256, _env_int("RAG_CONTEXT_TOKENS", 3000))
+    rag_watch_interval = _env_float("RAG_WATCH_INTERVAL", 0.0)
+    rag_watch_interval = max(1.0, rag_watch_interval) if rag_watch_interval > 0 else 0.0
+    answer_cache_size = max(0, _env_int("ANSWER_CACHE_SIZE", 512))
+    answer_cache_threshold = _env_float("ANSWER_CACHE_THRESHOLD", 0.95)
+    answer_cache_ttl = _env_float("ANSWER_CACHE_TTL", 86400.0)
+    history_cache_threads = max(1, _env_int("HISTORY_CACHE_THREADS", 256))
+    history_cache_messages = max(1, _env_int("HISTORY_CACHE_MESSAGES", 500))
+    attachment_max_bytes = max(0, _env_int("ATTACHMENT_MAX_BYTES", 4_000_000))
+    attachment_file_bytes = max(0, _env_int("ATTACHMENT_FILE_BYTES", 2_000_000))
+    attachment_max_tokens = max(100, _env_int("ATTACHMENT_MAX_TOKENS", 2000))
+    prompt_max_tokens = max(1000, _env_int("PROMPT_MAX_TOKENS", 6000))
+    metrics_port = max(0, _env_int("METRICS_PORT", 0))
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1").strip() or "127.0.0.1"
+    use_uvloop = _env_bool("UVLOOP", True)
+    shard_count = max(0, _env_int("SHARD_COUNT", 0))
+    query_workers = max(0, _env_int("QUERY_WORKERS", 0))
 
     if not discord_token:
         raise RuntimeError("discord_token is required. Set it in .env or env vars.")
@@ -47,5 +215,58 @@ def load_settings() -> Settings:
         rag_collection=rag_collection,
         openai_model=openai_model,
         openai_embedding_model=openai_embedding_model,
+        openai_base_url=openai_base_url,
+        openai_fallback_model=openai_fallback_model,
+        openai_timeout=openai_timeout,
+        openai_max_retries=openai_max_retries,
+        openai_hedge_after=openai_hedge_after,
+        openai_breaker_threshold=openai_breaker_threshold,
+        openai_breaker_cooldown=openai_breaker_cooldown,
+        openai_max_connections=openai_max_connections,
         thread_history_limit=thread_history_limit,
+        rag_workers=rag_workers,
+        rag_concurrency=rag_concurrency,
+        llm_concurrency=llm_concurrency,
+        request_concurrency=request_concurrency,
+        request_queue_size=request_queue_size,
+        user_rate_per_min=user_rate_per_min,
+        user_burst=user_burst,
+        channel_rate_per_min=channel_rate_per_min,
+        channel_burst=channel_burst,
+        coalesce_window=coalesce_window,
+        stream_replies=stream_replies,
+        stream_edit_interval=stream_edit_interval,
+        send_channel_limit=send_channel_limit,
+        send_channel_window=send_channel_window,
+        reply_file_chars=reply_file_chars,
+        embedding_cache_size=embedding_cache_size,
+        embedding_backend=embedding_backend,
+        local_embedding_model_path=local_embedding_model_path,
+        embedding_threads=embedding_threads,
+        embedding_batch_size=embedding_batch_size,
+        rag_search_mode=rag_search_mode,
+        rag_vector_timeout=rag_vector_timeout,
+        vector_store=vector_store,
+        vector_dtype=vector_dtype,
+        vector_rescore=vector_rescore,
+        rag_rerank=rag_rerank,
+        rerank_fetch=rerank_fetch,
+        rerank_diversity=rerank_diversity,
+        rerank_model_path=rerank_model_path,
+        rag_context_tokens=rag_context_tokens,
+        rag_watch_interval=rag_watch_interval,
+        answer_cache_size=answer_cache_size,
+        answer_cache_threshold=answer_cache_threshold,
+        answer_cache_ttl=answer_cache_ttl,
+        history_cache_threads=history_cache_threads,
+        history_cache_messages=history_cache_messages,
+        attachment_max_bytes=attachment_max_bytes,
+        attachment_file_bytes=attachment_file_bytes,
+        attachment_max_tokens=attachment_max_tokens,
+        prompt_max_tokens=prompt_max_tokens,
+        metrics_port=metrics_port,
+        metrics_host=metrics_host,
+        use_uvloop=use_uvloop,
+        shard_count=shard_count,
+        query_workers=query_workers,
     )
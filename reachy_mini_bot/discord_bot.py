@@ -2,40 +2,318 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import math
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Sequence, Set
 
 import discord
+from aiohttp import web
 from discord import app_commands
 
+from .answer_cache import AnswerCache
+from .attachments import AttachmentProcessor
 from .config import load_settings
+from .history import CachedMessage, ThreadHistoryCache
+from .metrics import MetricsRegistry, RequestTrace, start_metrics_server
+from .prompt import BuiltPrompt, HistorySummarizer, PromptBuilder
 from .openai_client import OpenAIClient
-from .rag import RAGStore
+from .outbound import OutboundQueue
+from .scheduler import RequestScheduler
+from .stages import StageRunner
+from .tokens import truncate_tokens
+from .workers import QueryWorkerPool
 
+if TYPE_CHECKING:
+    # Chroma is most of the import time; it is loaded by `warm_up`, after
+    # the gateway connection has started
+    from .ingest_worker import IngestWorker
+    from .rag import RAGStore, RetrievedDoc
 
 logger = logging.getLogger("reachy-mini")
 
+BUSY_REPLY = "I'm busy right now, please retry in about {}s."
+QUEUED_REPLY = "Queued, position {}. I'll answer as soon as I can."
 
-class ReachyMiniClient(discord.Client):
-    def __init__(self, *args, **kwargs):
+
+class ReachyMiniClient(discord.AutoShardedClient):
+    def __init__(self, *args, started_at: Optional[float] = None, **kwargs):
+        # `started_at`: perf_counter() when the entry point began, before imports
+        t_init = time.perf_counter()
+        settings = load_settings()
         intents = discord.Intents.default()
         intents.message_content = True
         intents.messages = True
         intents.guilds = True
+        # One process holds every shard; without SHARD_COUNT Discord picks
+        kwargs.setdefault("shard_count", settings.shard_count or None)
         super().__init__(*args, intents=intents, **kwargs)
 
-        self.settings = load_settings()
-        self.ai = OpenAIClient(self.settings.openai_api_key, self.settings.openai_model)
-        self.rag = RAGStore(
-            path=self.settings.rag_db_path,
-            collection=self.settings.rag_collection,
-            openai_api_key=self.settings.openai_api_key,
-            embedding_model=self.settings.openai_embedding_model,
+        # Startup phases in seconds, logged once the bot can answer
+        self.startup: Dict[str, float] = {}
+        self._started_at = t_init if started_at is None else started_at
+        if started_at is not None:
+            self.startup["imports"] = t_init - started_at
+        self._startup_logged = False
+        self.settings = settings
+        self.ai = OpenAIClient(
+            self.settings.openai_api_key,
+            self.settings.openai_model,
+            base_url=self.settings.openai_base_url,
+            fallback_model=self.settings.openai_fallback_model,
+            timeout=self.settings.openai_timeout,
+            max_retries=self.settings.openai_max_retries,
+            hedge_after=self.settings.openai_hedge_after,
+            breaker_threshold=self.settings.openai_breaker_threshold,
+            breaker_cooldown=self.settings.openai_breaker_cooldown,
+            max_connections=self.settings.openai_max_connections,
         )
+        # Opened in the background by `warm_up`; mentions that need it wait
+        # on `rag_ready` instead of being dropped
+        self.rag: Optional[RAGStore] = None
+        self.rag_ready = asyncio.Event()
         self.rag_documents_path = Path(self.settings.rag_documents_path)
-        self._sema = asyncio.Semaphore(3)
+        # /add_rag and the optional folder watcher embed into the live store
+        self.ingest: Optional[IngestWorker] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        # With QUERY_WORKERS, retrieval and attachment parsing run there
+        self.workers: Optional[QueryWorkerPool] = None
+        if self.settings.query_workers > 0:
+            self.workers = QueryWorkerPool(self.settings, self.settings.query_workers)
+        # Chroma and the embedding function are blocking; run them on a bounded
+        # pool so the gateway loop keeps serving heartbeats and other mentions
+        self._rag_pool = ThreadPoolExecutor(
+            max_workers=self.settings.rag_workers, thread_name_prefix="rag"
+        )
+        # Each query worker can take one retrieval at a time
+        self._rag_sema = asyncio.Semaphore(
+            max(self.settings.rag_concurrency, self.settings.query_workers)
+        )
+        self._llm_sema = asyncio.Semaphore(self.settings.llm_concurrency)
         self.thread_history_limit = self.settings.thread_history_limit
+        self.attachments = AttachmentProcessor(
+            max_bytes=self.settings.attachment_max_bytes,
+            max_file_bytes=self.settings.attachment_file_bytes,
+            max_tokens=self.settings.attachment_max_tokens,
+            embed=self._embed_texts,
+            offload=self.workers.run if self.workers else None,
+        )
+        # Gateway events keep per-thread history warm, so building a prompt
+        # for an active thread needs no REST round trips
+        self.history = ThreadHistoryCache(
+            max_threads=self.settings.history_cache_threads,
+            max_messages=max(self.settings.history_cache_messages, self.thread_history_limit + 1),
+        )
+        self.prompt_builder = PromptBuilder(
+            max_tokens=self.settings.prompt_max_tokens,
+            summarizer=HistorySummarizer(self._summarize),
+        )
+        self.answer_cache: Optional[AnswerCache] = None
+        if self.settings.answer_cache_size > 0:
+            self.answer_cache = AnswerCache(
+                threshold=self.settings.answer_cache_threshold,
+                ttl=self.settings.answer_cache_ttl,
+                max_entries=self.settings.answer_cache_size,
+            )
+        # Fair admission and ordering of mentions ahead of the per-stage limits
+        self.scheduler = RequestScheduler(
+            concurrency=self.settings.request_concurrency,
+            max_queue=self.settings.request_queue_size,
+            user_rate=self.settings.user_rate_per_min / 60.0,
+            user_burst=self.settings.user_burst,
+            channel_rate=self.settings.channel_rate_per_min / 60.0,
+            channel_burst=self.settings.channel_burst,
+            coalesce_window=self.settings.coalesce_window,
+        )
+        # Retrievals started before their request was enqueued; they count
+        # against the free slots so a burst cannot start more than fit
+        self._prefetches: Set["asyncio.Task[List[RetrievedDoc]]"] = set()
+        # Per-stage latency histograms, cache/error counters and in-flight
+        # gauges; served at /metrics when METRICS_PORT is set and via /stats
+        self.metrics = MetricsRegistry()
+        self._in_flight = self.metrics.gauge("reachy_in_flight", "Requests currently in each stage")
+        self._errors = self.metrics.counter("reachy_errors_total", "Failed requests by stage")
+        self._scheduled = self.metrics.counter(
+            "reachy_scheduler_total", "Scheduler decisions for incoming mentions"
+        )
+        self.metrics.callback(
+            "reachy_scheduler_queued", "Mentions waiting for a request slot", lambda: self.scheduler.queued
+        )
+        # Everything the bot posts goes through per-channel queues paced under
+        # Discord's rate limits; handlers hand replies over without waiting
+        self.outbound = OutboundQueue(
+            limit=self.settings.send_channel_limit,
+            window=self.settings.send_channel_window,
+            edit_interval=self.settings.stream_edit_interval,
+            file_chars=self.settings.reply_file_chars,
+        )
+        self._register_metrics()
+        self._metrics_runner: Optional[web.AppRunner] = None
+        self._t_started = time.perf_counter()
+        self.startup["init"] = self._t_started - t_init
+
+    def _register_metrics(self) -> None:
+        def caches(field: str):
+            def read():
+                out = [({"cache": "history"}, getattr(self.history, field))]
+                if self.rag is not None and self.rag.embedding_cache is not None:
+                    out.append(({"cache": "embedding"}, self.rag.embedding_cache.stats()[field]))
+                if self.answer_cache is not None:
+                    out.append(({"cache": "answer"}, self.answer_cache.stats()[field]))
+                return out
+
+            return read
+
+        self.metrics.callback("reachy_cache_hits_total", "Cache hits", caches("hits"), "counter")
+        self.metrics.callback("reachy_cache_misses_total", "Cache misses", caches("misses"), "counter")
+        self.metrics.callback(
+            "reachy_openai_calls_total",
+            "OpenAI chat calls by outcome (ok, retry, hedge, hedge_won, fallback, circuit_open, error)",
+            lambda: [({"outcome": k}, v) for k, v in sorted(self.ai.outcomes.items())],
+            "counter",
+        )
+        self.metrics.callback(
+            "reachy_openai_circuit_open",
+            "1 while the circuit breaker for a model is open",
+            lambda: [({"model": m}, float(st != "closed")) for m, st in self.ai.breaker_states().items()],
+        )
+        self.metrics.callback(
+            "reachy_openai_responses_total",
+            "OpenAI HTTP responses by status, including retried ones",
+            lambda: [({"status": str(k)}, v) for k, v in sorted(self.ai.responses.items())],
+            "counter",
+        )
+        self.metrics.callback(
+            "reachy_ingest_queued",
+            "Document ingestion jobs waiting",
+            lambda: self.ingest.queued if self.ingest else 0,
+        )
+        self.metrics.callback(
+            "reachy_ingest_chunks_total",
+            "Chunks written or removed by background ingestion",
+            lambda: [
+                ({"op": "upserted"}, self.ingest.totals.chunks_upserted),
+                ({"op": "deleted"}, self.ingest.totals.chunks_deleted),
+            ]
+            if self.ingest
+            else [],
+            "counter",
+        )
+        self.metrics.callback(
+            "reachy_query_worker_restarts_total",
+            "Times the query worker pool was replaced after a worker died",
+            lambda: self.workers.restarts if self.workers else 0,
+            "counter",
+        )
+        discord_hist = self.metrics.histogram(
+            "reachy_discord_seconds",
+            "Outbound Discord calls (send, edit, file), pacing waits and reply delivery after hand-off",
+        )
+        self.outbound.timing_listeners.append(lambda op, seconds: discord_hist.observe(seconds, op=op))
+        self.metrics.callback(
+            "reachy_outbound_queued", "Replies waiting to be posted", lambda: self.outbound.queued
+        )
+        self.metrics.callback(
+            "reachy_outbound_rate_limited_total",
+            "Discord calls that got a 429 and were retried",
+            lambda: self.outbound.rate_limited,
+            "counter",
+        )
+        self.metrics.callback(
+            "reachy_ready", "1 once the RAG store is open and warm", lambda: float(self.rag_ready.is_set())
+        )
+
+    async def warm_up(self) -> None:
+        """Open the RAG store off the event loop and warm what the first
+        request would otherwise pay for. Idempotent; `setup_hook` runs it in
+        the background while the gateway connects."""
+        if self.rag_ready.is_set():
+            return
+        loop = asyncio.get_running_loop()
+
+        def open_rag() -> RAGStore:
+            from .rag import RAGStore
+
+            t = time.perf_counter()
+            store = RAGStore.from_settings(self.settings)
+            self.startup["rag_open"] = time.perf_counter() - t
+            t = time.perf_counter()
+            store.warm()
+            self.startup["rag_warm"] = time.perf_counter() - t
+            return store
+
+        async def warm_http() -> None:
+            t = time.perf_counter()
+            await self.ai.warm(min(self.settings.llm_concurrency, self.settings.openai_max_connections))
+            self.startup["http_warm"] = time.perf_counter() - t
+
+        async def start_workers() -> None:
+            t = time.perf_counter()
+            await self.workers.start()
+            self.startup["workers"] = time.perf_counter() - t
+
+        # Run alongside the store opening; HTTP warm-up failures are only logged
+        side = [asyncio.ensure_future(warm_http())]
+        retrieval_workers = self.workers is not None and self.workers.retrieval
+        if self.workers is not None and not retrieval_workers:
+            side.append(asyncio.ensure_future(start_workers()))
+        try:
+            store = await loop.run_in_executor(None, open_rag)
+            if retrieval_workers:
+                # After the store: workers open it read-only, so whatever
+                # opening writes (BM25 index, requantized vectors) comes first
+                await start_workers()
+        except BaseException:
+            for task in side:
+                task.cancel()
+            raise
+        from .ingest_worker import IngestWorker
+
+        rag_hist = self.metrics.histogram(
+            "reachy_rag_seconds",
+            "Retrieval operations: query embedding, vector and BM25 search, whole searches by path",
+        )
+        store.timing_listeners.append(lambda op, seconds: rag_hist.observe(seconds, op=op))
+        if self.answer_cache is not None:
+            store.change_listeners.append(self.answer_cache.invalidate)
+        if retrieval_workers:
+            store.persist_listeners.append(self.workers.invalidate)
+        self.rag = store
+        self.ingest = IngestWorker(store)
+        self.ingest.start()
+        if self.settings.rag_watch_interval:
+            self.ingest.watch(self.rag_documents_path, self.settings.rag_watch_interval)
+        await asyncio.gather(*side)
+        self.rag_ready.set()
+        self._log_startup()
+
+    async def _warm_up_or_exit(self) -> None:
+        try:
+            await self.warm_up()
+        except Exception:
+            # Same outcome as a failing store used to have at construction
+            logger.exception("Could not open the RAG store; shutting down")
+            await self.close()
+
+    async def _wait_ready(self, trace: Optional[RequestTrace] = None) -> RAGStore:
+        if not self.rag_ready.is_set():
+            with trace.stage("warmup_wait") if trace else nullcontext():
+                await self.rag_ready.wait()
+        assert self.rag is not None
+        return self.rag
+
+    def _log_startup(self) -> None:
+        # Once both the gateway session and the RAG store are ready
+        if self._startup_logged or not self.rag_ready.is_set() or "gateway" not in self.startup:
+            return
+        self._startup_logged = True
+        parts = " ".join(f"{k}={1000 * v:.0f}ms" for k, v in self.startup.items())
+        logger.info(
+            "Startup: ready after %.0fms (%s)", 1000 * (time.perf_counter() - self._started_at), parts
+        )
 
     async def setup_hook(self) -> None:
         logger.info("Reachy Mini bot is initializing...")
@@ -54,15 +332,65 @@ class ReachyMiniClient(discord.Client):
             self.tree.add_command(add_rag)
         except Exception:
             pass
+        try:
+            self.tree.add_command(stats)
+        except Exception:
+            pass
+        self._warmup_task = asyncio.create_task(self._warm_up_or_exit(), name="warm-up")
+        if self.settings.metrics_port:
+            try:
+                self._metrics_runner = await start_metrics_server(
+                    self.metrics, self.settings.metrics_host, self.settings.metrics_port
+                )
+            except OSError as e:
+                logger.warning("Could not start the metrics endpoint: %s", e)
         try:
             await self.tree.sync()
         except Exception as e:
             logger.warning("Could not sync app commands: %s", e)
 
+    async def close(self) -> None:
+        # Give queued replies a moment to go out while the session is up
+        try:
+            await asyncio.wait_for(self.outbound.join(), 5.0)
+        except asyncio.TimeoutError:
+            logger.warning("Closing with %d replies not posted", self.outbound.queued)
+        await super().close()
+        await self.close_services()
+
+    async def close_services(self) -> None:
+        """Stop everything `close` stops except the Discord connection: for
+        clients driven without one (load tests, tests)."""
+        if self._warmup_task is not None and self._warmup_task is not asyncio.current_task():
+            self._warmup_task.cancel()
+        if self.ingest is not None:
+            await self.ingest.stop()
+        if self.workers is not None:
+            await self.workers.stop()
+        await self.outbound.stop()
+        await self.attachments.close()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+        try:
+            await self.ai.close()
+        except Exception:
+            pass
+        self._rag_pool.shutdown(wait=False)
+
+    async def on_shard_ready(self, shard_id: int):
+        logger.info("Shard %d/%d ready", shard_id + 1, self.shard_count or 1)
+
     async def on_ready(self):
         logger.info("Logged in as %s (%s)", self.user, getattr(self.user, "id", "?"))
+        # Login and gateway handshake; on_ready fires again after reconnects
+        self.startup.setdefault("gateway", time.perf_counter() - self._t_started)
+        self._log_startup()
 
     async def on_message(self, message: discord.Message):
+        # Record every thread message (ours included) for the history cache
+        if isinstance(message.channel, discord.Thread):
+            self.history.add(message.channel.id, _to_cached(message))
+
         # Ignore our own messages and other bots
         if message.author.bot:
             return
@@ -76,35 +404,133 @@ class ReachyMiniClient(discord.Client):
         if not mentioned:
             return
 
-        # Ensure we are in a thread; if not, create one from this message
-        thread: Optional[discord.Thread]
-        if isinstance(message.channel, discord.Thread):
-            thread = message.channel
-        else:
-            thread_name = self._make_thread_name(message)
-            try:
-                thread = await message.create_thread(
-                    name=thread_name, auto_archive_duration=60
+        trace = RequestTrace(self.metrics, message.id)
+        # Per-user/per-channel rate limits before any work (or thread) is made
+        channel_id = getattr(message.channel, "parent_id", None) or message.channel.id
+        retry_after = self.scheduler.admit(message.author.id, channel_id)
+        if retry_after:
+            self._scheduled.inc(result="rate_limited")
+            self._reply_quietly(message, BUSY_REPLY.format(max(1, math.ceil(retry_after))))
+            trace.finish("rate_limited")
+            return
+
+        # Retrieval only needs the message text: if a request slot is free,
+        # start it now so it overlaps thread creation. Requests that will
+        # queue retrieve once they start, behind the ones already running.
+        prefetch: Optional["asyncio.Task[List[RetrievedDoc]]"] = None
+        if (
+            not self.scheduler.queued
+            and self.scheduler.running + len(self._prefetches) < self.scheduler.concurrency
+        ):
+            prefetch = self._prefetch_retrieval(message, trace)
+        try:
+            outcome = "ok"
+            with self._in_flight.track(stage="request"):
+                # Ensure we are in a thread; if not, create one from this message
+                thread: Optional[discord.Thread]
+                if isinstance(message.channel, discord.Thread):
+                    thread = message.channel
+                else:
+                    thread_name = self._make_thread_name(message)
+                    try:
+                        with trace.stage("create_thread"):
+                            thread = await message.create_thread(
+                                name=thread_name, auto_archive_duration=60
+                            )
+                        self.history.mark_new(thread.id)
+                    except discord.Forbidden:
+                        self._reply_quietly(message, "I don't have permission to create threads here.")
+                        trace.finish("forbidden")
+                        return
+                    except discord.HTTPException:
+                        # Fallback: reply inline if thread cannot be created
+                        thread = None
+
+                status, ticket, position = self.scheduler.enqueue(
+                    thread.id if thread else message.channel.id,
+                    message.author.id,
+                    self._strip_mention(message),
+                    message,
                 )
-            except discord.Forbidden:
-                await message.reply("I don't have permission to create threads here.")
-                return
-            except discord.HTTPException:
-                # Fallback: reply inline if thread cannot be created
-                thread = None
+                self._scheduled.inc(result=status)
+                if prefetch is not None:
+                    # Counted as a running request from here on
+                    self._prefetches.discard(prefetch)
+                    if status != "started":
+                        prefetch.cancel()
+                        prefetch = None
+                if status == "full":
+                    self._reply_quietly(message, BUSY_REPLY.format(30))
+                    trace.finish("busy")
+                    return
+                if status in ("merged", "duplicate"):
+                    # Answered by the request it was folded into
+                    await asyncio.shield(ticket.done)
+                    trace.finish(status)
+                    return
+                if status == "queued":
+                    self.outbound.send(thread or message.channel, QUEUED_REPLY.format(position))
 
-        async with self._sema:
-            try:
-                await self._handle_query(message, thread)
-            except Exception as e:
-                logger.exception("Error handling message: %s", e)
+                t = time.perf_counter()
+                await self.scheduler.wait(ticket)
+                trace.add("schedule_queue", time.perf_counter() - t)
                 try:
-                    if thread:
-                        await thread.send("Sorry, I hit an error processing that.")
-                    else:
-                        await message.reply("Sorry, I hit an error processing that.")
-                except Exception:
-                    pass
+                    await self._handle_query(
+                        ticket.messages[0],
+                        thread,
+                        trace,
+                        ticket.messages[1:],
+                        # Only valid if this request is still just `message`
+                        prefetched=prefetch if ticket.messages[0] is message and len(ticket.messages) == 1 else None,
+                    )
+                except Exception as e:
+                    outcome = "error"
+                    self._errors.inc(stage=trace.failed_stage or "other")
+                    logger.exception("Error handling message: %s", e)
+                    self.outbound.send(
+                        thread or message.channel,
+                        "Sorry, I hit an error processing that.",
+                        reference=None if thread else message,
+                    )
+                finally:
+                    self.scheduler.release(ticket)
+                    trace.finish(outcome)
+        finally:
+            if prefetch is not None:
+                self._prefetches.discard(prefetch)
+                prefetch.cancel()
+
+    def _prefetch_retrieval(
+        self, message: discord.Message, trace: RequestTrace
+    ) -> Optional["asyncio.Task[List[RetrievedDoc]]"]:
+        question = self._strip_mention(message).strip()
+        if not question:
+            return None
+        task = asyncio.ensure_future(
+            self._retrieve(truncate_tokens(question, 2000), trace, k=5)
+        )
+        # Unused or cancelled prefetches must not log "exception never retrieved"
+        task.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._prefetches.add(task)
+        return task
+
+    def _reply_quietly(self, message: discord.Message, text: str) -> None:
+        # Failures are logged by the outbound queue; nobody waits for these
+        self.outbound.send(message.channel, text, reference=message)
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        content = payload.data.get("content")
+        if content is not None:
+            self.history.edit(payload.channel_id, payload.message_id, content)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.history.delete(payload.channel_id, [payload.message_id])
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        self.history.delete(payload.channel_id, payload.message_ids)
+
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        self.history.drop_thread(payload.thread_id)
 
     def _is_mentioning_me(self, message: discord.Message) -> bool:
         if not self.user:
@@ -145,133 +571,377 @@ class ReachyMiniClient(discord.Client):
             content = content.replace(f"<@!{self.user.id}>", " ")
         return content
 
+    async def _thread_messages(
+        self,
+        thread: Optional[discord.Thread],
+        limit: Optional[int],
+        exclude_message_id: Optional[int] = None,
+    ) -> List[CachedMessage]:
+        if not thread:
+            return []
+        log = self.history.get(thread.id)
+        if log is None or not log.warm or (limit is None and not log.complete):
+            self.history.misses += 1
+            fetched = await self._fetch_thread_history(thread, limit)
+        else:
+            self.history.hits += 1
+            fetched = log.ordered()
+        # Oldest first to preserve conversation flow
+        msgs = [m for m in fetched if m.id != exclude_message_id]
+        if limit is not None:
+            msgs = msgs[-limit:] if limit > 0 else []
+        return msgs
+
     async def _gather_thread_history(
         self,
         thread: Optional[discord.Thread],
         limit: Optional[int],
         exclude_message_id: Optional[int] = None,
     ) -> str:
-        if not thread:
-            return ""
+        msgs = await self._thread_messages(thread, limit, exclude_message_id)
         snippets: List[str] = []
+        for m in msgs:
+            role = "assistant" if m.author_bot else "user"
+            if m.content:
+                snippets.append(f"{role}: {m.content}")
+        return "\n".join(snippets)
+
+    async def _fetch_thread_history(
+        self, thread: discord.Thread, limit: Optional[int]
+    ) -> List[CachedMessage]:
+        # Cold start: one REST pass for the most recent messages. Events that
+        # arrive meanwhile are buffered by `track` and merged by `seed`.
+        log = self.history.track(thread.id)
+        fetch_limit = None if limit is None else limit + 1
+        fetched: List[CachedMessage] = []
         try:
-            # Oldest first to preserve conversation flow
-            msgs = []
-            async for m in thread.history(limit=limit, oldest_first=True):
-                if (
-                    exclude_message_id is not None
-                    and getattr(m, "id", None) == exclude_message_id
-                ):
-                    continue
-                msgs.append(m)
-            for m in msgs:
-                role = "assistant" if m.author.bot else "user"
-                content = m.content
-                if content:
-                    snippets.append(f"{role}: {content}")
+            async for m in thread.history(limit=fetch_limit):
+                fetched.append(_to_cached(m))
         except Exception:
-            pass
-        return "\n".join(snippets)
+            return log.ordered()
+        complete = fetch_limit is None or len(fetched) < fetch_limit
+        # Everything fetched goes back to the caller (all of it for
+        # /add_rag); only the cached copy is trimmed to HISTORY_CACHE_MESSAGES
+        merged = {m.id: m for m in fetched}
+        merged.update(log.messages)
+        self.history.seed(thread.id, fetched, complete)
+        return [merged[i] for i in sorted(merged)]
 
-    async def _collect_text_attachments(
-        self, message: discord.Message, limit_bytes: int = 1_000_000
+    async def _collect_attachments(
+        self, messages: Sequence[discord.Message], question: str, trace: RequestTrace
     ) -> List[str]:
-        texts: List[str] = []
-        for a in message.attachments:
-            name = (a.filename or "").lower()
-            if any(name.endswith(ext) for ext in (".txt", ".log", ".md")) or (
-                a.content_type and a.content_type.startswith("text/")
-            ):
-                if a.size and a.size > limit_bytes:
-                    continue
+        attachments = [a for m in messages for a in m.attachments]
+        if not attachments:
+            return []
+        with trace.stage("attachments"), self._in_flight.track(stage="attachments"):
+            return await self.attachments.collect(attachments, question)
+
+    async def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        rag = await self._wait_ready()
+        # Attachment slices are throwaway: past the cache, so they do not
+        # evict corpus vectors from it
+        embed = getattr(rag.embedding, "inner", rag.embedding)
+        async with self._rag_sema:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._rag_pool, embed, texts)
+
+    async def _retrieve(self, text: str, trace: RequestTrace, k: int = 5) -> List[RetrievedDoc]:
+        rag = await self._wait_ready(trace)
+        t = time.perf_counter()
+        async with self._rag_sema:
+            trace.add("retrieval_queue", time.perf_counter() - t)
+            with trace.stage("retrieval"), self._in_flight.track(stage="retrieval"):
+                if self.workers is not None and self.workers.retrieval:
+                    return await self.workers.query(text, k)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._rag_pool, rag.query, text, k)
+
+    async def _embed_query(self, text: str) -> Optional[List[float]]:
+        # Goes through the embedding cache, so this reuses the vector computed
+        # for retrieval rather than making a second API call
+        try:
+            rag = await self._wait_ready()
+            async with self._rag_sema:
+                loop = asyncio.get_running_loop()
+                vectors = await loop.run_in_executor(self._rag_pool, rag.embed, [text])
+            return vectors[0]
+        except Exception as e:
+            logger.warning("Could not embed query for the answer cache: %s", e)
+            return None
+
+    async def _complete(
+        self, messages: List[dict], trace: RequestTrace, temperature: float = 0.2
+    ) -> str:
+        t = time.perf_counter()
+        async with self._llm_sema:
+            trace.add("llm_queue", time.perf_counter() - t)
+            with trace.stage("llm"), self._in_flight.track(stage="llm"):
+                return await self.ai.chat(messages, temperature=temperature)
+
+    async def _summarize(self, messages: List[dict]) -> str:
+        async with self._llm_sema:
+            return await self.ai.chat(messages, temperature=0.0, max_tokens=300)
+
+    async def _complete_stream(
+        self, messages: List[dict], trace: RequestTrace, temperature: float = 0.2
+    ) -> AsyncIterator[str]:
+        # The LLM slot is held until the stream is exhausted or closed. Only
+        # time spent waiting on the API counts as "llm"; time the consumer
+        # spends between deltas (Discord edits) is traced as "send".
+        t = time.perf_counter()
+        async with self._llm_sema:
+            trace.add("llm_queue", time.perf_counter() - t)
+            with self._in_flight.track(stage="llm"):
+                t = time.perf_counter()
+                first = True
                 try:
-                    data = await a.read()
-                    if data and len(data) <= limit_bytes:
-                        texts.append(data.decode("utf-8", errors="replace"))
+                    async for delta in self.ai.chat_stream(messages, temperature=temperature):
+                        now = time.perf_counter()
+                        if first:
+                            trace.add("llm_first_token", now - t)
+                            first = False
+                        trace.add("llm", now - t)
+                        yield delta
+                        t = time.perf_counter()
                 except Exception:
-                    continue
-        return texts
+                    trace.failed_stage = trace.failed_stage or "llm"
+                    raise
+                trace.add("llm", time.perf_counter() - t)
 
     async def _handle_query(
-        self, message: discord.Message, thread: Optional[discord.Thread]
+        self,
+        message: discord.Message,
+        thread: Optional[discord.Thread],
+        trace: RequestTrace,
+        followups: Sequence[discord.Message] = (),
+        prefetched: Optional["asyncio.Future[List[RetrievedDoc]]"] = None,
     ):
-        # Show typing indicator while we think/retrieve/respond
+        # `followups` are later mentions merged into this request by the
+        # scheduler; they are answered together in one reply. `prefetched`
+        # is retrieval for `message` alone, started before the thread existed.
         target_channel: discord.abc.Messageable = thread or message.channel
         async with target_channel.typing():
             # Prepare user query text
-            user_text = self._strip_mention(message).strip()
-            attach_texts = await self._collect_text_attachments(message)
-            if attach_texts:
-                user_text += "\n\n[Attachments]\n" + "\n\n".join(attach_texts)
-
-            # Retrieve top-k docs
-            retrieved = self.rag.query(user_text, k=5)
-
-            # Build prompt
-            system_prompt = (
-                "You are Reachy Mini, a helpful assistant for troubleshooting robots in a Discord server. "
-                "Always respond in English. Be concise and actionable, ask for clarification when needed, and avoid fabricating facts. "
-                "Prefer bulleted steps. If you use retrieved context, cite the source filenames or titles in parentheses."
-                "In the first message of a new thread, briefly introduce yourself as Reachy Mini, you're here to help. Also that you will only respond if explicitly tagged with @reachy_mini."
-                "If the user's question is not clear, or if just saying 'hello', respond with a friendly message asking for more details about their robot issue. Don't make up any context."
+            question = "\n\n".join(
+                q for q in (self._strip_mention(m).strip() for m in (message, *followups)) if q
             )
-
-            ctx_parts: List[str] = []
-            for d in retrieved:
-                src = d.source or d.doc_id
-                ctx_parts.append(f"[Source: {src}]\n{d.text}")
-            ctx_text = "\n\n".join(ctx_parts) if ctx_parts else "(no context found)"
-
-            # Optionally include a brief thread history (most recent 8 messages)
-            # Gather current thread history if available (either existing thread or newly created one)
             current_thread: Optional[discord.Thread] = None
             if thread is not None:
                 current_thread = thread
             elif isinstance(message.channel, discord.Thread):
                 current_thread = message.channel
-            history_text = await self._gather_thread_history(
-                current_thread,
-                self.thread_history_limit,
-                exclude_message_id=getattr(message, "id", None),
-            )
 
-            user_prompt = (
-                f"User message:\n{user_text}\n\n"
-                + (f"Thread history:\n{history_text}\n\n" if history_text else "")
-                + f"Retrieved context:\n{ctx_text}\n\n"
-                + "Answer as Reachy Mini."
+            async def retrieval() -> List[RetrievedDoc]:
+                # Started speculatively by on_message for a single mention
+                if prefetched is not None and not followups:
+                    return await prefetched
+                if not question.strip():
+                    return []
+                # Capped to stay within the embedding model's input limit
+                return await self._retrieve(truncate_tokens(question, 2000), trace, k=5)
+
+            async def context(found: List[RetrievedDoc], attach_texts: List[str]) -> List[RetrievedDoc]:
+                # A bare mention with a log retrieves on the log instead
+                if question.strip() or not attach_texts:
+                    return found
+                return await self._retrieve(
+                    truncate_tokens("\n\n".join(attach_texts), 2000), trace, k=5
+                )
+
+            async def history() -> List[CachedMessage]:
+                with trace.stage("history"):
+                    msgs = await self._thread_messages(
+                        current_thread,
+                        self.thread_history_limit,
+                        exclude_message_id=getattr(message, "id", None),
+                    )
+                if followups:
+                    merged = {m.id for m in followups}
+                    msgs = [m for m in msgs if m.id not in merged]
+                return msgs
+
+            async def prompt(
+                attach_texts: List[str], msgs: List[CachedMessage], docs: List[RetrievedDoc]
+            ) -> BuiltPrompt:
+                with trace.stage("prompt"):
+                    return await self.prompt_builder.build(
+                        question,
+                        attach_texts,
+                        msgs,
+                        docs,
+                        thread_id=current_thread.id if current_thread else None,
+                    )
+
+            async def query_vector(
+                attach_texts: List[str], msgs: List[CachedMessage], _docs: List[RetrievedDoc]
+            ) -> Optional[List[float]]:
+                # Thread openers without attachments are the repeat questions;
+                # follow-ups depend on the conversation so they are never cached.
+                # Runs after retrieval so the embedding cache already has it.
+                if self.answer_cache is None or not question or attach_texts or msgs:
+                    return None
+                with trace.stage("answer_cache"):
+                    return await self._embed_query(question)
+
+            # Independent stages overlap; each starts once its inputs are ready
+            results = await (
+                StageRunner()
+                .add(
+                    "attachments",
+                    lambda: self._collect_attachments((message, *followups), question, trace),
+                )
+                .add("retrieval", retrieval)
+                .add("history", history)
+                .add("context", context, after=("retrieval", "attachments"))
+                .add("query_vector", query_vector, after=("attachments", "history", "context"))
+                .add("prompt", prompt, after=("attachments", "history", "context"))
+                .run()
             )
+            built: BuiltPrompt = results["prompt"]
+            messages = built.messages
+            retrieved: List[RetrievedDoc] = results["context"]
+            doc_ids = [i for d in retrieved for i in (d.doc_id, *d.merged_ids)]
+            query_vec: Optional[List[float]] = results["query_vector"]
+            reply: Optional[str] = None
+            if query_vec is not None:
+                reply = self.answer_cache.lookup(query_vec, doc_ids)
+                logger.debug(
+                    "Answer cache %s: %s",
+                    "hit" if reply is not None else "miss",
+                    self.answer_cache.stats(),
+                )
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
+            t0 = time.perf_counter()
+            if reply is None and self.settings.stream_replies:
+                reply = await self._send_streaming(
+                    thread or message.channel,
+                    self._complete_stream(messages, trace, temperature=0.2),
+                    reference=None if thread else message,
+                )
+                self._log_prompt(built, time.perf_counter() - t0)
+                if query_vec is not None:
+                    self.answer_cache.store(query_vec, doc_ids, reply)
+                self._refresh_summary(current_thread)
+                return
 
-            reply = self.ai.chat(messages, temperature=0.2)
+            if reply is None:
+                reply = await self._complete(messages, trace, temperature=0.2)
+                self._log_prompt(built, time.perf_counter() - t0)
+                if query_vec is not None:
+                    self.answer_cache.store(query_vec, doc_ids, reply)
 
-        if thread:
-            await self._send_long(thread, reply)
-        else:
-            await self._send_long(message.channel, reply, reference=message)
+        # Posted by the outbound queue; the request slot is free right away
+        self.outbound.send(thread or message.channel, reply, reference=None if thread else message)
+        self._refresh_summary(current_thread)
+
+    def _refresh_summary(self, thread: Optional[discord.Thread]) -> None:
+        # After the reply, so the summary call never delays an answer
+        if thread is not None and self.prompt_builder.summarizer is not None:
+            self.prompt_builder.summarizer.schedule(thread.id)
+
+    def _stats_text(self) -> str:
+        requests = self.metrics.counter("reachy_requests_total")
+        stages = self.metrics.histogram("reachy_stage_seconds")
+        lines = [
+            "Requests: {:.0f} ok, {:.0f} failed, {:.0f} in flight".format(
+                requests.value(outcome="ok"),
+                requests.value(outcome="error"),
+                self._in_flight.value(stage="request"),
+            ),
+            "```",
+            f"{'stage':<16}{'n':>6}{'p50':>9}{'p95':>9}",
+        ]
+        for labels in sorted(stages.label_sets(), key=lambda l: l["stage"]):
+            p50 = stages.percentile(0.50, **labels) or 0.0
+            p95 = stages.percentile(0.95, **labels) or 0.0
+            lines.append(
+                f"{labels['stage']:<16}{stages.count(**labels):>6}"
+                f"{1000 * p50:>7.0f}ms{1000 * p95:>7.0f}ms"
+            )
+        lines.append("```")
+        rag_hist = self.metrics.histogram("reachy_rag_seconds")
+        paths = []
+        for mode in ("hybrid", "vector", "lexical"):
+            op = f"search_{mode}"
+            n = rag_hist.count(op=op)
+            if n:
+                p50 = rag_hist.percentile(0.50, op=op) or 0.0
+                p95 = rag_hist.percentile(0.95, op=op) or 0.0
+                paths.append(f"{mode} {n}× p50 {1000 * p50:.0f}ms p95 {1000 * p95:.0f}ms")
+        if paths:
+            # Lexical here means BM25 alone, including fallbacks while vector search is down
+            lines.append("Retrieval paths: " + ", ".join(paths))
+        caches = [("history", self.history.hits, self.history.misses)]
+        if self.rag is not None and self.rag.embedding_cache is not None:
+            st = self.rag.embedding_cache.stats()
+            caches.append(("embedding", st["hits"], st["misses"]))
+        if self.answer_cache is not None:
+            st = self.answer_cache.stats()
+            caches.append(("answer", st["hits"], st["misses"]))
+        lines.append(
+            "Caches: "
+            + ", ".join(
+                f"{name} {hits}/{hits + misses} hits" for name, hits, misses in caches
+            )
+        )
+        if self.ai.responses:
+            lines.append(
+                "OpenAI responses: "
+                + ", ".join(f"{k}×{v}" for k, v in sorted(self.ai.responses.items()))
+            )
+        if self.ai.outcomes:
+            lines.append(
+                "OpenAI calls: "
+                + ", ".join(f"{k} {v}" for k, v in sorted(self.ai.outcomes.items()))
+            )
+        calls = self.outbound.calls
+        if any(calls.values()):
+            delivery = self.metrics.histogram("reachy_discord_seconds").percentile(0.95, op="delivery")
+            lines.append(
+                f"Discord: {calls['send']} sends, {calls['edit']} edits, {calls['file']} files, "
+                f"{self.outbound.rate_limited} rate-limited, {self.outbound.queued} queued, "
+                f"delivery p95 {1000 * (delivery or 0.0):.0f}ms"
+            )
+        if not self.rag_ready.is_set():
+            lines.append("Warming up: the RAG store is still opening; mentions wait for it.")
+        if self.workers is not None:
+            lines.append(
+                f"Query workers: {self.workers.workers} processes, {self.workers.restarts} restarts"
+            )
+        if self.ingest is not None and (self.ingest.jobs_done or self.ingest.queued):
+            lines.append(
+                f"Ingestion: {self.ingest.jobs_done} jobs done, {self.ingest.queued} queued, "
+                f"{self.ingest.totals.chunks_upserted} chunks embedded"
+            )
+        return "\n".join(lines)
+
+    def _log_prompt(self, prompt: BuiltPrompt, llm_seconds: float) -> None:
+        parts = " ".join(f"{k}={v}" for k, v in prompt.tokens.items())
+        logger.info(
+            "prompt_tokens=%d (%s) llm_latency=%.2fs", prompt.total_tokens, parts, llm_seconds
+        )
 
-    async def _send_long(
+    async def _send_streaming(
         self,
         channel: discord.abc.Messageable,
-        text: str,
+        deltas: AsyncIterator[str],
         reference: Optional[discord.Message] = None,
-    ):
-        # Discord hard limit ~2000 chars per message
-        limit = 1900
-        chunks: List[str] = []
-        t = text or "(no content)"
-        while t:
-            chunks.append(t[:limit])
-            t = t[limit:]
-        for i, chunk in enumerate(chunks):
-            if i == 0 and reference is not None:
-                await channel.send(chunk, reference=reference)
-            else:
-                await channel.send(chunk)
+    ) -> str:
+        # The outbound queue posts the growing text and edits it at its own
+        # pace, so Discord latency and rate limits never hold up the stream.
+        # Returns the full reply text.
+        reply = self.outbound.reply(channel, reference=reference)
+        full = ""
+        try:
+            async for delta in deltas:
+                full += delta
+                reply.update(full)
+        except BaseException:
+            # Whatever was streamed stays; the error reply follows it
+            reply.abort()
+            raise
+        reply.finish(full)
+        return full
 
     def _sanitize_filename(self, name: str) -> str:
         cleaned = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("._-")
@@ -300,20 +970,48 @@ class ReachyMiniClient(discord.Client):
         return path
 
 
-def run_bot():
+def _to_cached(message: discord.Message) -> CachedMessage:
+    return CachedMessage(
+        id=message.id, author_bot=message.author.bot, content=message.content or ""
+    )
+
+
+def run_bot(started_at: Optional[float] = None):
     logging.basicConfig(
         level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
     )
-    client = ReachyMiniClient()
+    client = ReachyMiniClient(started_at=started_at)
+    if client.settings.use_uvloop:
+        _install_uvloop()
     client.run(client.settings.discord_token)
 
 
+def _install_uvloop() -> None:
+    # Faster loop for the gateway, HTTP and executor hand-offs; optional
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("uvloop is not installed; using the default asyncio event loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("Using uvloop %s", uvloop.__version__)
+
+
 @app_commands.command(name="ping", description="Check bot latency")
 async def ping(interaction: discord.Interaction):
     # Respond quickly; ephemeral keeps channels clean
     await interaction.response.send_message("Pong!", ephemeral=True)
 
 
+@app_commands.command(name="stats", description="Show request latency and cache statistics")
+async def stats(interaction: discord.Interaction):
+    client = interaction.client
+    if not isinstance(client, ReachyMiniClient):
+        await interaction.response.send_message("Bot is not ready.", ephemeral=True)
+        return
+    await interaction.response.send_message(client._stats_text(), ephemeral=True)
+
+
 @app_commands.command(
     name="add_rag", description="Save this thread's content for RAG ingestion"
 )
@@ -339,7 +1037,20 @@ async def add_rag(interaction: discord.Interaction):
         return
 
     path = client._write_thread_document(thread, history)
+    # Embedded in the background; queries keep being answered meanwhile
+    try:
+        await client._wait_ready()
+        result = await client.ingest.submit([path])
+    except Exception as e:
+        logger.warning("Ingesting %s failed: %s", path, e)
+        await interaction.followup.send(
+            f"Saved thread content to `{path}`, but indexing it failed. "
+            "Re-run ingestion on that folder to update the RAG DB.",
+            ephemeral=True,
+        )
+        return
     await interaction.followup.send(
-        f"Saved thread content to `{path}`. Re-run ingestion on that folder to update the RAG DB.",
+        f"Saved thread content to `{path}` and added it to the RAG DB "
+        f"({result.chunks_upserted} chunks embedded, {result.chunks_deleted} removed).",
         ephemeral=True,
     )
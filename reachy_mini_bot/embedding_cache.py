@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import hashlib
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+
+# Cache hits refresh `last_used` in batches: at most one write per this many
+# hits or seconds, instead of one per lookup
+_TOUCH_BATCH = 1000
+_TOUCH_INTERVAL = 60.0
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model name, sha256 of text).
+
+    Vectors are stored as float32 blobs in a small SQLite file. Entries carry a
+    last-used timestamp and the least recently used ones are evicted once the
+    cache grows past `max_entries`. Timestamps of hits are kept in memory and
+    written in batches, so lookups do not commit. A `read_only` cache only
+    looks vectors up: it neither inserts nor updates timestamps.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200_000, read_only: bool = False):
+        self.path = path
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._touch_flushed = time.monotonic()
+        if read_only:
+            uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " vec BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        if not hashes:
+            return found
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite caps bound parameters; query in slices
+            for i in range(0, len(unique), 500):
+                part = unique[i : i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            if found and not self.read_only:
+                now = time.time()
+                for h in found:
+                    self._touched[(model, h)] = now
+                if (
+                    len(self._touched) >= _TOUCH_BATCH
+                    or time.monotonic() - self._touch_flushed >= _TOUCH_INTERVAL
+                ):
+                    self._flush_touches()
+                    self._conn.commit()
+        return found
+
+    def _flush_touches(self) -> None:
+        # Caller holds the lock and commits
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                [(t, m, h) for (m, h), t in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touch_flushed = time.monotonic()
+
+    def put_many(self, model: str, hashes: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        if not hashes or self.max_entries <= 0 or self.read_only:
+            return
+        now = time.time()
+        rows = [
+            (model, h, np.asarray(v, dtype=np.float32).tobytes(), now)
+            for h, v in zip(hashes, vectors)
+        ]
+        with self._lock:
+            # A (model, hash) pair always maps to the same vector, so an existing
+            # row only needs its timestamp refreshed
+            cur = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vec, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._count += max(0, cur.rowcount)
+            for h in hashes:
+                self._touched[(model, h)] = now
+            # Eviction goes by last_used, so pending touches land first
+            self._flush_touches()
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    " SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._count -= overflow
+            self._conn.commit()
+
+    def record(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if not self.read_only:
+                self._flush_touches()
+                self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Wraps a Chroma embedding function and serves repeated texts from cache."""
+
+    def __init__(self, inner: EmbeddingFunction, model_name: str, cache: EmbeddingCache):
+        self.inner = inner
+        self.model_name = model_name
+        self.cache = cache
+        # Number of texts actually sent to the wrapped function
+        self.calls = 0
+
+    def __call__(self, input: Documents) -> Embeddings:
+        hashes = [text_hash(t) for t in input]
+        cached = self.cache.get_many(self.model_name, hashes)
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, input):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        n_miss = sum(1 for h in hashes if h not in cached)
+        self.cache.record(len(hashes) - n_miss, n_miss)
+        if missing:
+            miss_hashes = list(missing)
+            vectors = self.inner(list(missing.values()))
+            self.calls += len(miss_hashes)
+            self.cache.put_many(self.model_name, miss_hashes, vectors)
+            for h, v in zip(miss_hashes, vectors):
+                cached[h] = np.asarray(v, dtype=np.float32)
+        return [cached[h] for h in hashes]
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from typing import List, Tuple
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+from .config import Settings
+
+
+EMBEDDING_BACKENDS = ("openai", "onnx", "hash")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Where Chroma's own ONNXMiniLM_L6_V2 function unpacks all-MiniLM-L6-v2
+DEFAULT_ONNX_MODEL_PATH = os.path.join(
+    "~", ".cache", "chroma", "onnx_models", "all-MiniLM-L6-v2", "onnx"
+)
+
+
+class OnnxEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Sentence embeddings from a local ONNX model on CPU.
+
+    `model_dir` must hold `model.onnx` and a Hugging Face `tokenizer.json`
+    (e.g. all-MiniLM-L6-v2). Texts are embedded in batches of `batch_size`
+    with mean pooling and L2 normalization; `threads` caps onnxruntime's
+    intra-op thread pool (0 lets onnxruntime decide).
+    """
+
+    def __init__(self, model_dir: str, batch_size: int = 32, threads: int = 0, max_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = os.path.expanduser(model_dir)
+        model_path = os.path.join(model_dir, "model.onnx")
+        tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        if not (os.path.exists(model_path) and os.path.exists(tokenizer_path)):
+            raise RuntimeError(
+                f"Local embedding model not found in {model_dir} "
+                "(expected model.onnx and tokenizer.json)"
+            )
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            model_path, sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = max(1, batch_size)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(None, feeds)[0]
+        m = mask[..., None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        out: List[np.ndarray] = []
+        for i in range(0, len(input), self.batch_size):
+            out.extend(self._embed_batch(list(input[i : i + self.batch_size])))
+        return out
+
+
+class HashingEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Deterministic bag-of-words vectors via feature hashing.
+
+    No model and no network: meant for offline benchmarks and development,
+    not for answering real questions.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, input: Documents) -> Embeddings:
+        out: List[np.ndarray] = []
+        for text in input:
+            v = np.zeros(self.dim, dtype=np.float32)
+            for word in _WORD_RE.findall(text.lower()):
+                h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+                v[h % self.dim] += 1.0 if (h >> 63) else -1.0
+            n = np.linalg.norm(v)
+            out.append(v / n if n else v)
+        return out
+
+
+def embedding_key(backend: str, model: str) -> str:
+    # Cache key for embeddings; OpenAI keeps the bare model name used so far
+    return model if backend == "openai" else f"{backend}:{model}"
+
+
+def collection_name(base: str, backend: str, model: str) -> str:
+    # Chroma names: 3-63 chars of [A-Za-z0-9_-], alphanumeric at both ends.
+    # Different backends/models must never share a collection.
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", f"{base}-{backend}-{model}").strip("-_")
+    return slug[:63].strip("-_")
+
+
+def make_embedding_function(settings: Settings) -> Tuple[EmbeddingFunction, str]:
+    """Build the configured embedding function and its model name."""
+    if settings.embedding_backend == "hash":
+        fn = HashingEmbeddingFunction()
+        return fn, f"hashing-{fn.dim}"
+    if settings.embedding_backend == "onnx":
+        path = settings.local_embedding_model_path or DEFAULT_ONNX_MODEL_PATH
+        fn = OnnxEmbeddingFunction(
+            path,
+            batch_size=settings.embedding_batch_size,
+            threads=settings.embedding_threads,
+        )
+        model = os.path.basename(os.path.normpath(os.path.expanduser(path)))
+        if model == "onnx":
+            model = os.path.basename(os.path.dirname(os.path.normpath(os.path.expanduser(path))))
+        return fn, model
+    fn = OpenAIEmbeddingFunction(
+        api_key=settings.openai_api_key,
+        model_name=settings.openai_embedding_model,
+        api_base=settings.openai_base_url or None,
+    )
+    return fn, settings.openai_embedding_model
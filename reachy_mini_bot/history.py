@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+
+@dataclass
+class CachedMessage:
+    id: int
+    author_bot: bool
+    content: str
+
+
+@dataclass
+class ThreadLog:
+    messages: Dict[int, CachedMessage] = field(default_factory=dict)
+    # `warm`: seeded from REST (or created by us), so events alone keep it current.
+    # `complete`: holds every message since the thread started.
+    warm: bool = False
+    complete: bool = False
+
+    def ordered(self) -> List[CachedMessage]:
+        # Snowflake ids sort chronologically
+        return [self.messages[i] for i in sorted(self.messages)]
+
+
+class ThreadHistoryCache:
+    """Bounded, LRU-by-thread message history populated from gateway events.
+
+    Threads are tracked once they are seeded from a REST fetch or created by
+    the bot; after that, message/edit/delete events keep them up to date and
+    assembling history needs no HTTP calls. Events for a thread that is being
+    fetched are buffered and merged with the fetched page.
+    """
+
+    def __init__(self, max_threads: int = 256, max_messages: int = 500):
+        self.max_threads = max_threads
+        self.max_messages = max_messages
+        self._threads: "OrderedDict[int, ThreadLog]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, thread_id: int) -> bool:
+        return thread_id in self._threads
+
+    def get(self, thread_id: int) -> Optional[ThreadLog]:
+        log = self._threads.get(thread_id)
+        if log is not None:
+            self._threads.move_to_end(thread_id)
+        return log
+
+    def track(self, thread_id: int) -> ThreadLog:
+        log = self.get(thread_id)
+        if log is None:
+            log = ThreadLog()
+            self._threads[thread_id] = log
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        return log
+
+    def mark_new(self, thread_id: int) -> None:
+        # A thread we just created has no history to fetch
+        log = self.track(thread_id)
+        log.warm = True
+        log.complete = True
+
+    def seed(self, thread_id: int, messages: Iterable[CachedMessage], complete: bool) -> ThreadLog:
+        log = self.track(thread_id)
+        for m in messages:
+            log.messages.setdefault(m.id, m)
+        log.warm = True
+        log.complete = log.complete or complete
+        self._trim(log)
+        return log
+
+    def add(self, thread_id: int, message: CachedMessage) -> None:
+        log = self._threads.get(thread_id)
+        if log is None:
+            return
+        log.messages[message.id] = message
+        self._trim(log)
+
+    def edit(self, thread_id: int, message_id: int, content: str) -> None:
+        log = self._threads.get(thread_id)
+        if log is not None and message_id in log.messages:
+            log.messages[message_id].content = content
+
+    def delete(self, thread_id: int, message_ids: Iterable[int]) -> None:
+        log = self._threads.get(thread_id)
+        if log is not None:
+            for mid in message_ids:
+                log.messages.pop(mid, None)
+
+    def drop_thread(self, thread_id: int) -> None:
+        self._threads.pop(thread_id, None)
+
+    def _trim(self, log: ThreadLog) -> None:
+        overflow = len(log.messages) - self.max_messages
+        if overflow > 0:
+            for mid in sorted(log.messages)[:overflow]:
+                del log.messages[mid]
+            log.complete = False
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Set
+
+from .rag import RAGStore
+from .scripts.ingest import (
+    IngestStats,
+    _under,
+    default_manifest_path,
+    ingest_paths,
+    list_files,
+    load_manifest,
+)
+
+
+logger = logging.getLogger("reachy-mini.ingest")
+
+
+@dataclass
+class _Job:
+    paths: List[Path]
+    done: "asyncio.Future[IngestStats]" = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+def _merge(total: IngestStats, part: IngestStats) -> None:
+    for name in total.__dataclass_fields__:
+        setattr(total, name, getattr(total, name) + getattr(part, name))
+
+
+class IngestWorker:
+    """Incremental ingestion into the live `RAGStore`, inside the bot.
+
+    Jobs run one at a time on a dedicated thread, so Chroma writes never
+    contend with each other and never take a retrieval worker; queries keep
+    being served while documents are embedded. Jobs queued while another
+    runs are ingested together. `watch` polls a folder and queues files
+    that were added, changed or removed.
+    """
+
+    def __init__(
+        self,
+        store: RAGStore,
+        chunk_tokens: int = 512,
+        batch_size: int = 64,
+        embed_concurrency: int = 1,
+    ):
+        self.store = store
+        self.chunk_tokens = chunk_tokens
+        self.batch_size = batch_size
+        self.embed_concurrency = embed_concurrency
+        self.manifest_path = default_manifest_path(store)
+        self.totals = IngestStats()
+        self.jobs_done = 0
+        self._queue: "asyncio.Queue[_Job]" = asyncio.Queue()
+        # Sources queued or being ingested, so the watcher does not repeat them
+        self._pending: Set[str] = set()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-ingest")
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks.append(asyncio.create_task(self._run(), name="rag-ingest"))
+
+    def watch(self, folder: Path, interval: float) -> None:
+        self._tasks.append(asyncio.create_task(self._watch(folder, interval), name="rag-watch"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # A running job still finishes and saves the manifest before exit
+        self._pool.shutdown(wait=False)
+
+    def submit(self, paths: List[Path]) -> "asyncio.Future[IngestStats]":
+        """Queue `paths` for ingestion; the future resolves with the stats of
+        the run that included them."""
+        job = _Job(list(paths))
+        self._pending.update(str(p) for p in job.paths)
+        self._queue.put_nowait(job)
+        return job.done
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self._queue.get()]
+            while not self._queue.empty():
+                jobs.append(self._queue.get_nowait())
+            paths = list(dict.fromkeys(p for job in jobs for p in job.paths))
+            try:
+                stats = await loop.run_in_executor(self._pool, self._ingest, paths)
+            except Exception as e:
+                self._pending.difference_update(str(p) for p in paths)
+                logger.exception("Background ingestion of %d file(s) failed", len(paths))
+                for job in jobs:
+                    if not job.done.done():
+                        job.done.set_exception(e)
+                continue
+            self._pending.difference_update(str(p) for p in paths)
+            _merge(self.totals, stats)
+            self.jobs_done += len(jobs)
+            logger.info("Ingested %d file(s): %s", len(paths), stats.summary())
+            for job in jobs:
+                if not job.done.done():
+                    job.done.set_result(stats)
+
+    def _ingest(self, paths: List[Path]) -> IngestStats:
+        return ingest_paths(
+            paths,
+            self.store,
+            manifest_path=self.manifest_path,
+            batch_size=self.batch_size,
+            embed_concurrency=self.embed_concurrency,
+            chunk_tokens=self.chunk_tokens,
+        )
+
+    def _scan(self, folder: Path) -> List[str]:
+        # Same test as a CLI run: mtime and size against the manifest. What
+        # is left of the manifest afterwards was deleted.
+        manifest = {
+            source: entry
+            for source, entry in load_manifest(self.manifest_path).items()
+            if _under(source, folder)
+        }
+        changed: List[str] = []
+        for p in list_files(folder):
+            source = str(p)
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entry = manifest.pop(source, None)
+            if entry is None or (entry.get("mtime"), entry.get("size")) != (st.st_mtime, st.st_size):
+                changed.append(source)
+        return changed + list(manifest)
+
+    async def _watch(self, folder: Path, interval: float) -> None:
+        # Polling keeps this dependency-free; a scan is a stat per file plus
+        # a manifest read. The first scan also picks up files changed while
+        # the bot was down.
+        loop = asyncio.get_running_loop()
+        logger.info("Watching %s for document changes every %.0fs", folder, interval)
+        while True:
+            try:
+                changed = await loop.run_in_executor(None, self._scan, folder)
+            except Exception:
+                logger.exception("Scanning %s failed", folder)
+                changed = []
+            changed = [s for s in changed if s not in self._pending]
+            if changed:
+                logger.info("Detected %d changed document(s) in %s", len(changed), folder)
+                # Failures are logged by the worker; nobody awaits this one
+                self.submit([Path(s) for s in changed]).add_done_callback(
+                    lambda f: f.cancelled() or f.exception()
+                )
+            await asyncio.sleep(interval)
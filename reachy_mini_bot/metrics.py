@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+from aiohttp import web
+
+
+logger = logging.getLogger("reachy-mini.metrics")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+# Seconds; covers cache hits through slow LLM completions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        # In-flight count for the duration of the block
+        self.inc(1.0, **labels)
+        try:
+            yield
+        finally:
+            self.dec(1.0, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+        # Recent raw samples, for percentiles in /stats
+        self._recent: Dict[LabelKey, Deque[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+                self._recent[key] = deque(maxlen=1024)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] += value
+            self._recent[key].append(value)
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        with self._lock:
+            return [dict(k) for k in self._counts]
+
+    def count(self, **labels) -> int:
+        counts = self._counts.get(_key(labels))
+        return sum(counts) if counts else 0
+
+    def percentile(self, q: float, **labels) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._recent.get(_key(labels), ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def lines(self) -> List[str]:
+        out: List[str] = []
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                out.append(
+                    f"{self.name}_bucket{_fmt_labels(key, ('le', _fmt_value(bound)))} {cumulative}"
+                )
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {cumulative}")
+        return out
+
+
+CallbackValue = Union[float, List[Tuple[Dict[str, str], float]]]
+
+
+class CallbackMetric(_Metric):
+    """Value read at scrape time from state kept elsewhere (cache stats etc.)."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], CallbackValue], kind: str = "gauge"):
+        super().__init__(name, help)
+        self.kind = kind
+        self.fn = fn
+
+    def lines(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            logger.exception("Metric callback %s failed", self.name)
+            return []
+        if isinstance(value, (int, float)):
+            return [f"{self.name} {_fmt_value(value)}"]
+        return [f"{self.name}{_fmt_labels(_key(labels))} {_fmt_value(v)}" for labels, v in value]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, factory: Callable[[], _Metric]) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(name, lambda: Counter(name, help))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self._get(name, lambda: Gauge(name, help))  # type: ignore[return-value]
+
+    def histogram(
+        self, name: str, help: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get(name, lambda: Histogram(name, help, buckets))  # type: ignore[return-value]
+
+    def callback(
+        self, name: str, help: str, fn: Callable[[], CallbackValue], kind: str = "gauge"
+    ) -> None:
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help, fn, kind)
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        with self._lock:
+            metrics = list(self._metrics.values())
+        out: List[str] = []
+        for m in metrics:
+            lines = m.lines()
+            if not lines:
+                continue
+            if m.help:
+                out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+class RequestTrace:
+    """Stage timings for one request.
+
+    Stages may be entered several times (e.g. one Discord send per message);
+    their durations add up. On `finish` every stage is observed once into
+    `reachy_stage_seconds` and the breakdown goes to the debug log, with
+    the offset each stage first started at so overlapping stages show.
+    """
+
+    def __init__(self, metrics: MetricsRegistry, request_id: object):
+        self.metrics = metrics
+        self.request_id = request_id
+        self.stages: Dict[str, float] = {}
+        # Seconds from the start of the request to each stage's first entry
+        self.starts: Dict[str, float] = {}
+        # First stage that raised, for the error counter
+        self.failed_stage: Optional[str] = None
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.failed_stage = self.failed_stage or name
+            raise
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if name not in self.starts:
+            self.starts[name] = max(0.0, time.perf_counter() - seconds - self._t0)
+
+    def finish(self, outcome: str) -> float:
+        total = time.perf_counter() - self._t0
+        stage_hist = self.metrics.histogram(
+            "reachy_stage_seconds", "Time spent per request in each pipeline stage"
+        )
+        for name, seconds in self.stages.items():
+            stage_hist.observe(seconds, stage=name)
+        self.metrics.histogram(
+            "reachy_request_seconds", "End-to-end request latency"
+        ).observe(total, outcome=outcome)
+        self.metrics.counter("reachy_requests_total", "Handled mentions").inc(outcome=outcome)
+        if logger.isEnabledFor(logging.DEBUG):
+            parts = " ".join(
+                f"{k}={1000 * v:.0f}ms@+{1000 * self.starts[k]:.0f}ms"
+                for k, v in sorted(self.stages.items(), key=lambda kv: self.starts[kv[0]])
+            )
+            logger.debug(
+                "request=%s outcome=%s total=%.0fms %s", self.request_id, outcome, 1000 * total, parts
+            )
+        return total
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str, port: int) -> web.AppRunner:
+    """Serve `registry` at http://host:port/metrics in Prometheus text format."""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics available at http://%s:%d/metrics", host, port)
+    return runner
@@ -1,24 +1,327 @@
 from __future__ import annotations
 
+import asyncio
+import email.utils
+import logging
 import os
-from typing import List, Dict, Any
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
 
-from openai import OpenAI
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+)
+
+
+logger = logging.getLogger("reachy-mini.openai")
+
+T = TypeVar("T")
+
+# Statuses worth another attempt (same set the SDK's own retry logic uses)
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Longest Retry-After we are willing to sleep through before giving up on a model
+MAX_RETRY_AFTER = 30.0
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` seconds
+    one trial call is let through (half-open) and its outcome decides."""
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self._trial else "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self._trial = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+
+def _transient(e: BaseException) -> bool:
+    if isinstance(e, (APITimeoutError, APIConnectionError, CircuitOpenError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code in RETRY_STATUSES
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        pass
+    try:
+        # HTTP-date form
+        return max(0.0, email.utils.parsedate_to_datetime(raw).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _delta(event: Any) -> str:
+    if not event.choices:
+        return ""
+    return event.choices[0].delta.content or ""
 
 
 class OpenAIClient:
-    def __init__(self, api_key: str, model: str):
+    """Chat client with a pooled HTTP connection, explicit timeouts, jittered
+    retries that honour Retry-After, optional hedging of slow requests, a
+    circuit breaker per model and fallback to `fallback_model`.
+
+    `outcomes` counts ok / retry / hedge / hedge_won / fallback /
+    circuit_open / error; `responses` counts HTTP statuses.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: Optional[str] = None,
+        fallback_model: str = "",
+        timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 3,
+        hedge_after: float = 0.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0,
+        max_connections: int = 20,
+    ):
         # The official SDK reads from env as well, but we pass explicitly
         os.environ.setdefault("OPENAI_API_KEY", api_key)
-        self.client = OpenAI(api_key=api_key)
+        self.responses: Dict[int, int] = {}
+        self.outcomes: Dict[str, int] = {}
+        # One keep-alive pool for every call; retries are ours, not the SDK's
+        self.http = DefaultAsyncHttpxClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+            event_hooks={"response": [self._on_response]},
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url or None,
+            max_retries=0,
+            http_client=self.http,
+        )
         self.model = model
+        self.fallback_model = fallback_model if fallback_model != model else ""
+        self.max_retries = max(0, max_retries)
+        self.hedge_after = hedge_after
+        self._breakers: Dict[str, CircuitBreaker] = {
+            m: CircuitBreaker(breaker_threshold, breaker_cooldown)
+            for m in (model, self.fallback_model)
+            if m
+        }
 
-    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int | None = None) -> str:
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        return resp.choices[0].message.content or ""
+    async def _on_response(self, response: httpx.Response) -> None:
+        self.responses[response.status_code] = self.responses.get(response.status_code, 0) + 1
+
+    def _count(self, outcome: str) -> None:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def breaker_states(self) -> Dict[str, str]:
+        return {m: b.state for m, b in self._breakers.items()}
+
+    async def _with_retries(self, fn: Callable[[], Awaitable[T]]) -> T:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await fn()
+            except Exception as e:
+                if not _transient(e) or attempt >= self.max_retries:
+                    raise
+                wait = _retry_after(e)
+                if wait is None:
+                    # Exponential backoff with full jitter: 0.5s, 1s, 2s... capped at 8s
+                    wait = random.uniform(0, min(8.0, 0.5 * 2**attempt))
+                elif wait > MAX_RETRY_AFTER:
+                    raise
+                self._count("retry")
+                logger.info("OpenAI call failed (%s); retry %d in %.1fs", e, attempt + 1, wait)
+                await asyncio.sleep(wait)
+        raise AssertionError("unreachable")
+
+    async def _hedged(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        discard: Optional[Callable[[T], Awaitable[None]]] = None,
+    ) -> T:
+        # A second identical request after `hedge_after` seconds; the first
+        # to succeed wins and the other is cancelled (or discarded)
+        if self.hedge_after <= 0:
+            return await fn()
+        first = asyncio.ensure_future(fn())
+        second: Optional[asyncio.Future] = None
+        pending = {first}
+        error: Optional[BaseException] = None
+        winner: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                pending.clear()
+                return first.result()
+            self._count("hedge")
+            second = asyncio.ensure_future(fn())
+            pending.add(second)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        await discard(task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        if winner is None:
+            raise error  # type: ignore[misc]
+        if winner is second:
+            self._count("hedge_won")
+        return winner.result()
+
+    async def _call(
+        self,
+        fn: Callable[[str], Awaitable[T]],
+        discard: Optional[Callable[[T], Awaitable[None]]] = None,
+    ) -> T:
+        models = [self.model] + ([self.fallback_model] if self.fallback_model else [])
+        error: Optional[BaseException] = None
+        for i, model in enumerate(models):
+            breaker = self._breakers[model]
+            if not breaker.allow():
+                self._count("circuit_open")
+                error = CircuitOpenError(f"Circuit open for {model}")
+                continue
+            try:
+                result = await self._with_retries(lambda: self._hedged(lambda: fn(model), discard))
+            except Exception as e:
+                if not _transient(e):
+                    # A bad request fails the same way on every model
+                    breaker.success()
+                    self._count("error")
+                    raise
+                breaker.failure()
+                error = e
+                logger.warning("OpenAI model %s failed: %s", model, e)
+                continue
+            breaker.success()
+            self._count("fallback" if i else "ok")
+            return result
+        self._count("error")
+        raise error  # type: ignore[misc]
+
+    async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int | None = None) -> str:
+        async def call(model: str) -> str:
+            resp = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+            return resp.choices[0].message.content or ""
+
+        return await self._call(call)
+
+    async def chat_stream(
+        self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int | None = None
+    ) -> AsyncIterator[str]:
+        # Yields content deltas as soon as the API sends them. Retries,
+        # hedging and fallback apply until the first delta; after that a
+        # failure is raised, since part of the reply is already out.
+        async def open_stream(model: str):
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            events = stream.__aiter__()
+            try:
+                first = ""
+                while not first:
+                    first = _delta(await events.__anext__())
+            except StopAsyncIteration:
+                pass
+            except BaseException:
+                await stream.close()
+                raise
+            return stream, events, first
+
+        async def discard(opened) -> None:
+            await opened[0].close()
+
+        stream, events, first = await self._call(open_stream, discard)
+        try:
+            if first:
+                yield first
+            async for event in events:
+                delta = _delta(event)
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
+    async def warm(self, connections: int = 1) -> int:
+        """Open up to `connections` keep-alive connections (DNS, TCP and TLS)
+        ahead of the first chat call. Returns how many requests succeeded."""
+
+        async def one() -> bool:
+            try:
+                await self.client.models.list()
+                return True
+            except Exception as e:
+                logger.debug("Connection warm-up failed: %s", e)
+                return False
+
+        results = await asyncio.gather(*(one() for _ in range(max(1, connections))))
+        return sum(results)
 
+    async def close(self) -> None:
+        await self.client.close()
@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import io
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import discord
+
+
+logger = logging.getLogger("reachy-mini.outbound")
+
+# Discord hard limit ~2000 chars per message
+MESSAGE_LIMIT = 1900
+# Discord allows 50 requests per second per bot; stay under it
+GLOBAL_LIMIT = 45
+FILE_NAME = "answer.md"
+FILE_NOTE = f"(The full answer is attached as `{FILE_NAME}`.)"
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+# Room kept at the end of a message for closing a cut code block
+_FENCE_CLOSE = len("\n```")
+# Break points, best first: paragraph, line, sentence, word
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def open_fence(text: str) -> Optional[str]:
+    """The opening line of a code fence left open at the end of `text`."""
+    opener: Optional[str] = None
+    for line in text.split("\n"):
+        m = _FENCE_RE.match(line)
+        if not m:
+            continue
+        if opener is None:
+            opener = line.strip()
+        elif set(line.strip()) == {opener[0]}:
+            # Only a bare run of the same fence character closes a block
+            opener = None
+    return opener
+
+
+def _cut(text: str, limit: int) -> int:
+    # Latest break point in the first `limit` chars, but not so early that
+    # the message is mostly empty; a hard cut only for one enormous word
+    window = text[:limit]
+    for sep in _SEPARATORS:
+        i = window.rfind(sep)
+        if i >= limit // 3:
+            return i + len(sep)
+    return limit
+
+
+def take_message(text: str, limit: int = MESSAGE_LIMIT, prefix: str = "") -> Tuple[str, int, str]:
+    """Body of the next message for `text`, continuing after `prefix` (a
+    reopened code fence). Returns (body, chars of `text` used, prefix for
+    the message after it). A code block cut in two is closed at the end of
+    the body and reopened in the next message."""
+    if len(prefix) + len(text) <= limit:
+        return prefix + text, len(text), ""
+    # Room for the closing fence, in case the cut lands inside a block
+    used = _cut(text, max(1, limit - len(prefix) - _FENCE_CLOSE))
+    body = (prefix + text[:used]).rstrip()
+    fence = open_fence(body)
+    if fence is not None:
+        body += "\n" + fence[:3]
+    rest = text[used:]
+    # Leading blank lines would only push the next message down
+    used += len(rest) - len(rest.lstrip("\n"))
+    return body, used, f"{fence}\n" if fence is not None else ""
+
+
+class Reply:
+    """One answer on its way to a channel; see `OutboundQueue.reply`.
+
+    `update` replaces the text shown so far (a growing stream), `finish`
+    marks it complete, `abort` completes it with whatever was shown. None
+    of them wait for Discord. `done` resolves with the posted messages.
+    """
+
+    def __init__(self, channel: Any, reference: Optional[Any], wake: Callable[[], None]):
+        self.channel = channel
+        self.reference = reference
+        self.text = ""
+        self.final = False
+        self.quiet = False
+        self.messages: List[Any] = []
+        self.done: "asyncio.Future[List[Any]]" = asyncio.get_running_loop().create_future()
+        # Unawaited replies must not log "exception never retrieved"
+        self.done.add_done_callback(lambda f: f.cancelled() or f.exception())
+        # Discord calls run in the context of the request that queued them
+        self.context = contextvars.copy_context()
+        self._wake = wake
+        self._current: Optional[Any] = None  # message being edited
+        self._prefix = ""  # code fence reopened at the top of `_current`
+        self._offset = 0  # where `_current` starts in `text`
+        self._shown = ""
+        self._last_edit = 0.0
+        self._finished_at = 0.0
+
+    def update(self, text: str) -> None:
+        if not self.final:
+            self.text = text
+            self._wake()
+
+    def finish(self, text: Optional[str] = None) -> None:
+        if self.final:
+            return
+        if text is not None:
+            self.text = text
+        self.final = True
+        self._finished_at = time.perf_counter()
+        self._wake()
+
+    def abort(self) -> None:
+        # Keep what was streamed, but post nothing if nothing was
+        self.quiet = True
+        self.finish()
+
+
+class WindowBucket:
+    """At most `limit` calls in any `window` seconds: Discord's buckets
+    (limit, reset-after) tracked on our side. A token bucket would let a
+    full burst plus its refill into one window."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = max(1, limit)
+        self.window = window
+        self._calls: Deque[float] = deque()
+
+    def take(self, now: Optional[float] = None) -> float:
+        # 0.0 when the call may go now (and is counted), else seconds to wait
+        now = time.monotonic() if now is None else now
+        while self._calls and now - self._calls[0] >= self.window:
+            self._calls.popleft()
+        if len(self._calls) < self.limit:
+            self._calls.append(now)
+            return 0.0
+        return self._calls[0] + self.window - now
+
+    def restamp(self) -> None:
+        # Count the latest call from when it completed: Discord counts it on
+        # arrival, after our send time
+        if self._calls:
+            self._calls[-1] = time.monotonic()
+
+    def idle(self, now: float) -> bool:
+        return not self._calls or now - self._calls[-1] >= self.window
+
+
+class _Channel:
+    def __init__(self, limit: int, window: float):
+        self.bucket = WindowBucket(limit, window)
+        self.replies: Deque[Reply] = deque()
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # Set from a 429's retry-after
+        self.paused_until = 0.0
+
+
+class OutboundQueue:
+    """Per-channel queues for everything the bot posts or edits.
+
+    Handlers hand a reply over and move on; one task per channel posts it,
+    in order, at most `limit` calls per `window` seconds per channel and
+    `GLOBAL_LIMIT` per second overall, so Discord's own limits are rarely
+    hit. A 429 pauses the channel for its retry-after and the call is
+    retried. Long text is split at paragraph and code-fence boundaries;
+    replies over `file_chars` (0: never) are posted as one message with the
+    answer attached as a Markdown file. Streamed replies are edited at most
+    once per `edit_interval`, always showing the latest text.
+    """
+
+    def __init__(
+        self,
+        limit: int = 5,
+        window: float = 5.0,
+        edit_interval: float = 1.0,
+        file_chars: int = 6000,
+        message_limit: int = MESSAGE_LIMIT,
+        max_retries: int = 3,
+        max_channels: int = 10_000,
+    ):
+        self.limit = limit
+        self.window = window
+        self.edit_interval = edit_interval
+        self.file_chars = file_chars
+        self.message_limit = message_limit
+        self.max_retries = max_retries
+        self.max_channels = max_channels
+        self._global = WindowBucket(GLOBAL_LIMIT, 1.0)
+        self._channels: "OrderedDict[Any, _Channel]" = OrderedDict()
+        # Called with (op, seconds): op is "send", "edit", "file" for Discord
+        # calls, "pacing" for time held back and "delivery" from finish to done
+        self.timing_listeners: List[Callable[[str, float], None]] = []
+        self.calls: Dict[str, int] = {"send": 0, "edit": 0, "file": 0}
+        self.rate_limited = 0
+        self.failed = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(ch.replies) for ch in self._channels.values())
+
+    def reply(self, channel: Any, reference: Optional[Any] = None) -> Reply:
+        """A reply to stream into `channel`, the first message answering
+        `reference` if given."""
+        key = getattr(channel, "id", None) or id(channel)
+        ch = self._channels.get(key)
+        if ch is None:
+            self._prune()
+            ch = self._channels[key] = _Channel(self.limit, self.window)
+        self._channels.move_to_end(key)
+        r = Reply(channel, reference, ch.wake.set)
+        ch.replies.append(r)
+        if ch.task is None or ch.task.done():
+            ch.task = asyncio.create_task(self._run(ch), name=f"outbound-{key}")
+        return r
+
+    def send(self, channel: Any, text: str, reference: Optional[Any] = None) -> "asyncio.Future[List[Any]]":
+        """Queue `text` for `channel`; the future resolves once it is posted."""
+        r = self.reply(channel, reference)
+        r.finish(text)
+        return r.done
+
+    async def join(self) -> None:
+        """Wait until everything queued so far is posted (or failed)."""
+        pending = [r.done for ch in self._channels.values() for r in ch.replies]
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stop(self) -> None:
+        tasks = [ch.task for ch in self._channels.values() if ch.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for ch in self._channels.values():
+            for r in ch.replies:
+                r.done.cancel()
+            ch.replies.clear()
+
+    def _prune(self) -> None:
+        # Idle channels with an empty window are the same as new ones
+        if len(self._channels) <= self.max_channels:
+            return
+        now = time.monotonic()
+        for key in [k for k, ch in self._channels.items() if not ch.replies and ch.bucket.idle(now)]:
+            del self._channels[key]
+
+    def _observe(self, op: str, seconds: float) -> None:
+        for listener in self.timing_listeners:
+            try:
+                listener(op, seconds)
+            except Exception:
+                logger.exception("Outbound timing listener failed")
+
+    # -- channel worker --------------------------------------------------------
+
+    async def _run(self, ch: _Channel) -> None:
+        while ch.replies:
+            ch.wake.clear()
+            waits: List[float] = []
+            progressed = False
+            for r in list(ch.replies):
+                due = self._due(r)
+                if due is None:
+                    continue
+                if due > 0:
+                    waits.append(due)
+                    continue
+                progressed = True
+                try:
+                    settled = await self._step(ch, r)
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning("Could not post a reply in %s: %s", getattr(r.channel, "id", "?"), e)
+                    ch.replies.remove(r)
+                    if not r.done.done():
+                        r.done.set_exception(e)
+                    continue
+                if settled:
+                    ch.replies.remove(r)
+                    self._observe("delivery", time.perf_counter() - r._finished_at)
+                    if not r.done.done():
+                        r.done.set_result(r.messages)
+            if progressed:
+                continue
+            try:
+                await asyncio.wait_for(ch.wake.wait(), min(waits) if waits else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _overflows(self, r: Reply) -> bool:
+        return 0 < self.file_chars < len(r.text)
+
+    def _due(self, r: Reply) -> Optional[float]:
+        # 0 when `r` has work now, seconds until its next edit is allowed,
+        # or None while it waits for more text
+        if r.final:
+            return 0.0
+        if self._overflows(r):
+            # Going to a file; what was posted so far stays as it is
+            return None
+        view = r._prefix + r.text[r._offset :]
+        if len(view) > self.message_limit:
+            return 0.0
+        if not view.strip() or view == r._shown:
+            return None
+        if r._current is None:
+            return 0.0
+        return max(0.0, r._last_edit + self.edit_interval - time.monotonic())
+
+    async def _step(self, ch: _Channel, r: Reply) -> bool:
+        # One Discord call for `r`; returns whether it is fully posted
+        if r.final and self._overflows(r):
+            await self._send_file(ch, r)
+            return True
+        text = r.text[r._offset :]
+        if len(r._prefix) + len(text) > self.message_limit:
+            # The current message is full: settle it at a clean break and
+            # carry on in a new one
+            body, used, prefix = take_message(text, self.message_limit, r._prefix)
+            await self._publish(ch, r, body)
+            r._offset += used
+            r._prefix = prefix
+            r._current = None
+            r._shown = ""
+            return False
+        view = r._prefix + text
+        if view.strip() and view != r._shown:
+            await self._publish(ch, r, view)
+        elif r.final and not r.messages and not r.quiet:
+            await self._publish(ch, r, "(no content)")
+        return r.final
+
+    async def _publish(self, ch: _Channel, r: Reply, body: str) -> None:
+        if r._current is None:
+            kwargs = {"reference": r.reference} if r.reference is not None and not r.messages else {}
+            r._current = await self._call(ch, r, "send", lambda: r.channel.send(body, **kwargs))
+            r.messages.append(r._current)
+        else:
+            current = r._current
+            await self._call(ch, r, "edit", lambda: current.edit(content=body))
+        r._shown = body
+        r._last_edit = time.monotonic()
+
+    async def _send_file(self, ch: _Channel, r: Reply) -> None:
+        if r.messages:
+            # Streamed messages stay as a preview
+            content = FILE_NOTE
+        else:
+            preview, _, _ = take_message(r.text, self.message_limit - len(FILE_NOTE) - 2)
+            content = f"{preview}\n\n{FILE_NOTE}"
+        kwargs = {"reference": r.reference} if r.reference is not None and not r.messages else {}
+        data = r.text.encode("utf-8")
+        msg = await self._call(
+            ch,
+            r,
+            "file",
+            # A fresh File per attempt: a retry must not read a spent stream
+            lambda: r.channel.send(content, file=discord.File(io.BytesIO(data), filename=FILE_NAME), **kwargs),
+        )
+        r.messages.append(msg)
+
+    async def _call(self, ch: _Channel, r: Reply, op: str, make: Callable[[], Awaitable[Any]]) -> Any:
+        attempt = 0
+        while True:
+            await self._acquire(ch)
+            t = time.perf_counter()
+            try:
+                result = await r.context.run(asyncio.ensure_future, make())
+            except (discord.HTTPException, discord.RateLimited) as e:
+                ch.bucket.restamp()
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.rate_limited += 1
+                ch.paused_until = max(ch.paused_until, time.monotonic() + retry_after)
+                logger.info("Rate limited in %s; pausing %.1fs", getattr(r.channel, "id", "?"), retry_after)
+                continue
+            ch.bucket.restamp()
+            self.calls[op] += 1
+            self._observe(op, time.perf_counter() - t)
+            return result
+
+    async def _acquire(self, ch: _Channel) -> None:
+        t = time.perf_counter()
+        while True:
+            pause = ch.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = ch.bucket.take()
+            if wait == 0.0:
+                break
+            await asyncio.sleep(wait)
+        while True:
+            wait = self._global.take()
+            if wait == 0.0:
+                break
+            await asyncio.sleep(wait)
+        waited = time.perf_counter() - t
+        if waited > 0.001:
+            self._observe("pacing", waited)
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    # Seconds to wait for a rate-limit error; None for other failures
+    if isinstance(e, discord.RateLimited):
+        return float(e.retry_after)
+    if getattr(e, "status", None) != 429:
+        return None
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", 1.0))
+    except (TypeError, ValueError):
+        return 1.0
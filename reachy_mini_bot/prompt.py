@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .history import CachedMessage
+from .tokens import count_tokens, truncate_tokens
+
+if TYPE_CHECKING:
+    from .rag import RetrievedDoc
+
+
+logger = logging.getLogger("reachy-mini.prompt")
+
+SYSTEM_PROMPT = (
+    "You are Reachy Mini, a helpful assistant for troubleshooting robots in a Discord server. "
+    "Always respond in English. Be concise and actionable, ask for clarification when needed, and avoid fabricating facts. "
+    "Prefer bulleted steps. If you use retrieved context, cite the source filenames or titles in parentheses."
+    "In the first message of a new thread, briefly introduce yourself as Reachy Mini, you're here to help. Also that you will only respond if explicitly tagged with @reachy_mini."
+    "If the user's question is not clear, or if just saying 'hello', respond with a friendly message asking for more details about their robot issue. Don't make up any context."
+)
+
+# Share of the flexible budget each section gets before leftovers are redistributed
+SECTION_WEIGHTS = {"context": 0.5, "history": 0.25, "attachments": 0.25}
+# Smallest useful tail of a chunk or attachment; below this it is dropped
+MIN_PIECE_TOKENS = 64
+
+Complete = Callable[[List[dict]], Awaitable[str]]
+
+
+@dataclass
+class BuiltPrompt:
+    messages: List[dict]
+    tokens: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+
+def allocate(needs: Dict[str, int], weights: Dict[str, float], budget: int) -> Dict[str, int]:
+    """Split `budget` across sections by weight, handing unused shares to the
+    sections that still need more."""
+    alloc = {k: 0 for k in needs}
+    open_ = {k for k, n in needs.items() if n > 0}
+    left = max(0, budget)
+    while open_ and left > 0:
+        total_w = sum(weights[k] for k in open_)
+        spent = 0
+        for k in sorted(open_):
+            share = int(left * weights[k] / total_w)
+            give = min(share, needs[k] - alloc[k])
+            alloc[k] += give
+            spent += give
+        open_ = {k for k in open_ if alloc[k] < needs[k]}
+        if spent == 0:
+            break
+        left -= spent
+    return alloc
+
+
+def _norm(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def dedupe_context(docs: List[RetrievedDoc]) -> List[RetrievedDoc]:
+    # Drop repeated ids and chunks whose text is contained in a higher-ranked one
+    kept: List[Tuple[RetrievedDoc, str]] = []
+    seen_ids = set()
+    for d in docs:
+        if d.doc_id in seen_ids:
+            continue
+        seen_ids.add(d.doc_id)
+        n = _norm(d.text)
+        if not n or any(n in k for _, k in kept):
+            continue
+        kept.append((d, n))
+    return [d for d, _ in kept]
+
+
+@dataclass
+class _Summary:
+    upto: int
+    text: str
+
+
+class HistorySummarizer:
+    """Rolling per-thread summary of history that no longer fits the prompt.
+
+    Kept off the request path: `summarize` returns the thread's last summary
+    (possibly a message or two behind) and notes what it should now cover;
+    `schedule`, called once the reply is out, extends it in the background.
+    Only messages newer than the last summarized one are sent to the model.
+    A thread's first overflow goes without a summary.
+    """
+
+    def __init__(self, complete: Complete, max_threads: int = 256, max_tokens: int = 250):
+        self.complete = complete
+        self.max_threads = max_threads
+        self.max_tokens = max_tokens
+        self._cache: "OrderedDict[int, _Summary]" = OrderedDict()
+        # Latest messages each thread's summary should cover, until refreshed
+        self._pending: Dict[int, List[CachedMessage]] = {}
+        self._running: Dict[int, "asyncio.Task[None]"] = {}
+
+    def summarize(self, thread_id: int, messages: List[CachedMessage]) -> str:
+        if not messages:
+            return ""
+        cached = self._cache.get(thread_id)
+        if cached is None or cached.upto < messages[-1].id:
+            self._pending[thread_id] = messages
+            while len(self._pending) > self.max_threads:
+                self._pending.pop(next(iter(self._pending)))
+        if cached is None:
+            return ""
+        self._cache.move_to_end(thread_id)
+        return cached.text
+
+    def schedule(self, thread_id: int) -> None:
+        # One refresh per thread at a time; later messages wait for the next reply
+        if thread_id not in self._pending or thread_id in self._running:
+            return
+        task = asyncio.ensure_future(self._refresh(thread_id))
+        self._running[thread_id] = task
+        task.add_done_callback(lambda _: self._running.pop(thread_id, None))
+
+    async def _refresh(self, thread_id: int) -> None:
+        messages = self._pending.pop(thread_id, None)
+        if not messages:
+            return
+        try:
+            await self.refresh(thread_id, messages)
+        except Exception as e:
+            logger.warning("History summary failed: %s", e)
+
+    async def refresh(self, thread_id: int, messages: List[CachedMessage]) -> str:
+        """Bring the thread's summary up to the last of `messages` now."""
+        cached = self._cache.get(thread_id)
+        ids = {m.id for m in messages}
+        if cached is not None and cached.upto == messages[-1].id:
+            return cached.text
+        if cached is not None and cached.upto in ids:
+            previous = cached.text
+            fresh = [m for m in messages if m.id > cached.upto]
+        else:
+            previous = ""
+            fresh = messages
+        transcript = "\n".join(
+            f"{'assistant' if m.author_bot else 'user'}: {m.content}" for m in fresh if m.content
+        )
+        transcript = truncate_tokens(transcript, 3000)
+        prompt = [
+            {
+                "role": "system",
+                "content": "Summarize this support conversation for later context. Keep the robot setup, "
+                "the problem, what was tried and what worked. Be brief and factual.",
+            },
+            {
+                "role": "user",
+                "content": (f"Summary so far:\n{previous}\n\n" if previous else "")
+                + f"New messages:\n{transcript}",
+            },
+        ]
+        text = truncate_tokens((await self.complete(prompt)).strip(), self.max_tokens)
+        self._cache[thread_id] = _Summary(messages[-1].id, text)
+        self._cache.move_to_end(thread_id)
+        while len(self._cache) > self.max_threads:
+            self._cache.popitem(last=False)
+        return text
+
+
+class PromptBuilder:
+    """Assembles the chat prompt under a token budget.
+
+    The system prompt and the (capped) question are always included; the rest
+    of the budget is shared between retrieved context, thread history and
+    attachments. History that does not fit is replaced by the thread's last
+    rolling summary; building a prompt never waits on the model.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 6000,
+        query_tokens: int = 1000,
+        summarizer: Optional[HistorySummarizer] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.query_tokens = query_tokens
+        self.summarizer = summarizer
+
+    async def build(
+        self,
+        question: str,
+        attachments: List[str],
+        history: List[CachedMessage],
+        context: List[RetrievedDoc],
+        thread_id: Optional[int] = None,
+    ) -> BuiltPrompt:
+        tokens: Dict[str, int] = {}
+        question = truncate_tokens(question, self.query_tokens)
+        tokens["system"] = count_tokens(SYSTEM_PROMPT)
+        tokens["query"] = count_tokens(question) + 20  # section labels
+
+        context = dedupe_context(context)
+        ctx_pieces = [f"[Source: {d.source or d.doc_id}]\n{d.text}" for d in context]
+        hist_lines = [
+            f"{'assistant' if m.author_bot else 'user'}: {m.content}" for m in history if m.content
+        ]
+        needs = {
+            "context": sum(count_tokens(p) for p in ctx_pieces),
+            "history": sum(count_tokens(line) for line in hist_lines),
+            "attachments": sum(count_tokens(a) for a in attachments),
+        }
+        budget = self.max_tokens - tokens["system"] - tokens["query"]
+        alloc = allocate(needs, SECTION_WEIGHTS, budget)
+
+        ctx_text, tokens["context"] = _fit_pieces(ctx_pieces, alloc["context"], "\n\n")
+        att_text, tokens["attachments"] = _fit_attachments(attachments, alloc["attachments"])
+        hist_text, tokens["history"] = self._fit_history(
+            history, hist_lines, alloc["history"], thread_id
+        )
+
+        user_text = question
+        if att_text:
+            user_text += "\n\n[Attachments]\n" + att_text
+        user_prompt = (
+            f"User message:\n{user_text}\n\n"
+            + (f"Thread history:\n{hist_text}\n\n" if hist_text else "")
+            + f"Retrieved context:\n{ctx_text or '(no context found)'}\n\n"
+            + "Answer as Reachy Mini."
+        )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ]
+        return BuiltPrompt(messages=messages, tokens=tokens)
+
+    def _fit_history(
+        self,
+        history: List[CachedMessage],
+        lines: List[str],
+        budget: int,
+        thread_id: Optional[int],
+    ) -> Tuple[str, int]:
+        kept: List[str] = []
+        used = 0
+        for line in reversed(lines):
+            n = count_tokens(line)
+            if used + n > budget:
+                break
+            kept.insert(0, line)
+            used += n
+        dropped = len(lines) - len(kept)
+        if not dropped:
+            return "\n".join(kept), used
+        summary = ""
+        if self.summarizer is not None and thread_id is not None:
+            older = [m for m in history if m.content][:dropped]
+            summary = self.summarizer.summarize(thread_id, older)
+        if summary:
+            # The summary displaces the oldest of the kept messages if needed
+            s_line = f"(summary of earlier messages) {summary}"
+            used += count_tokens(s_line)
+            while kept and used > budget:
+                used -= count_tokens(kept.pop(0))
+            kept.insert(0, s_line)
+        return "\n".join(kept), used
+
+
+def _fit_pieces(pieces: List[str], budget: int, sep: str) -> Tuple[str, int]:
+    out: List[str] = []
+    used = 0
+    for p in pieces:
+        n = count_tokens(p)
+        if used + n <= budget:
+            out.append(p)
+            used += n
+            continue
+        room = budget - used
+        if room >= MIN_PIECE_TOKENS:
+            out.append(truncate_tokens(p, room) + " …")
+            used += room
+        break
+    return sep.join(out), used
+
+
+def _fit_attachments(attachments: List[str], budget: int) -> Tuple[str, int]:
+    # Even split, with what small attachments leave over going to larger ones
+    if not attachments:
+        return "", 0
+    sizes = {str(i): count_tokens(a) for i, a in enumerate(attachments)}
+    alloc = allocate(sizes, {k: 1.0 for k in sizes}, budget)
+    out: List[str] = []
+    used = 0
+    for i, a in enumerate(attachments):
+        room = alloc[str(i)]
+        if room >= sizes[str(i)]:
+            out.append(a)
+        elif room >= MIN_PIECE_TOKENS:
+            out.append(truncate_tokens(a, room) + "\n… (truncated)")
+        else:
+            continue
+        used += min(room, sizes[str(i)])
+    return "\n\n".join(out), used
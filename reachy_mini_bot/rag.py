@@ -1,12 +1,62 @@
 from __future__ import annotations
 
+import logging
 import os
-from dataclasses import dataclass
-from typing import Iterable, List, Optional, Tuple
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import chromadb
+import numpy as np
 from chromadb.api import ClientAPI
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+from chromadb.api.types import EmbeddingFunction, Embeddings
+
+from .bm25 import BM25Index
+from .config import Settings
+from .embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+from .embeddings import collection_name, embedding_key, make_embedding_function
+from .rerank import OnnxCrossEncoder, Reranker
+from .tokens import count_tokens, truncate_tokens
+from .vector_index import MmapVectorIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+logger = logging.getLogger("reachy-mini.rag")
+
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+# "chroma": PersistentClient collection; "mmap": MmapVectorIndex files
+VECTOR_STORES = ("chroma", "mmap")
+# Reciprocal rank fusion constant; 60 is the usual choice
+RRF_K = 60
+
+
+@contextmanager
+def store_lock(path: str, exclusive: bool) -> Iterator[None]:
+    """Lock on a store directory shared by every process that opens it.
+
+    Writers hold it exclusively while they change files; read-only opens
+    share it, so they never load a half-written index or files a compaction
+    is removing. A no-op where `fcntl` is unavailable.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(path, "store.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
 
 
 @dataclass
@@ -14,41 +64,409 @@ class RetrievedDoc:
     doc_id: str
     text: str
     source: Optional[str]
+    score: float = 0.0
+    chunk_index: Optional[int] = None
+    # Ids of neighbouring chunks merged into this one by the reranker
+    merged_ids: List[str] = field(default_factory=list)
 
 
 class RAGStore:
-    def __init__(self, path: str, collection: str, openai_api_key: str, embedding_model: str):
-        os.makedirs(path, exist_ok=True)
-        self.client: ClientAPI = chromadb.PersistentClient(path=path)
-        self.embedding = OpenAIEmbeddingFunction(
-            api_key=openai_api_key,
-            model_name=embedding_model,
-        )
-        self.collection = self.client.get_or_create_collection(
-            name=collection,
-            embedding_function=self.embedding,
-            metadata={"hnsw:space": "cosine"},
+    def __init__(
+        self,
+        path: str,
+        collection: str,
+        embedding_function: EmbeddingFunction,
+        embedding_model: str,
+        backend: str = "openai",
+        cache_size: int = 200_000,
+        search_mode: str = "hybrid",
+        vector_timeout: float = 5.0,
+        reranker: Optional[Reranker] = None,
+        rerank_fetch: int = 30,
+        vector_store: str = "chroma",
+        vector_dtype: str = "int8",
+        vector_rescore: bool = True,
+        read_only: bool = False,
+    ):
+        if read_only and vector_store != "mmap":
+            # A Chroma client replaying the write log persists HNSW files and
+            # sequence ids, so it cannot open a collection without writing
+            raise ValueError("Only the mmap vector store can be opened read-only")
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+        # Read-only (query workers): no cache inserts or LRU updates, no
+        # requantizing or trimming of vector files and no saved BM25 index
+        self.read_only = read_only
+        self.vector_store = vector_store if vector_store in VECTOR_STORES else "chroma"
+        self.search_mode = search_mode if search_mode in SEARCH_MODES else "hybrid"
+        self.vector_timeout = vector_timeout
+        # Over-fetch `rerank_fetch` candidates and let the reranker pick k
+        self.reranker = reranker
+        self.rerank_fetch = rerank_fetch
+        # Stored chunk vectors recently read for reranking (ids are content
+        # hashes, so an entry never goes stale; deletes just drop it)
+        self._chunk_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._chunk_vectors_max = 4096
+        self._chunk_vectors_lock = threading.Lock()
+        # Vector search runs on its own small pool so a stalled embedding call
+        # can be abandoned after `vector_timeout` in favour of lexical results
+        self._vector_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-vector")
+        self._vector_down_until = 0.0
+        # Called with the ids of chunks that were written or removed
+        self.change_listeners: List[Callable[[List[str]], None]] = []
+        # Called once `persist` has saved the BM25 index and compacted: other
+        # processes reopening the store from then on see every write
+        self.persist_listeners: List[Callable[[], None]] = []
+        # Called with (operation, seconds) for "embed", "vector_search",
+        # "lexical_search" and "rerank", and for each whole search by the path
+        # it took ("search_hybrid", "search_vector", "search_lexical"); may
+        # run on worker threads
+        self.timing_listeners: List[Callable[[str, float], None]] = []
+
+        self.embedding = embedding_function
+        # Vectors from different backends/models never share a collection
+        self.collection_name = collection_name(collection, backend, embedding_model)
+        if self.vector_store == "mmap":
+            # Own name, so the BM25 index and ingest manifest are kept apart
+            self.collection_name = f"{self.collection_name[:58]}-mmap"
+        self.lexical_path = os.path.join(path, f"bm25_index.{self.collection_name}.json")
+        self.client: Optional[ClientAPI] = None
+        with store_lock(path, exclusive=not read_only):
+            # Unchanged chunks and repeated questions are served from a local cache
+            self.embedding_cache: Optional[EmbeddingCache] = None
+            cache_path = os.path.join(path, "embedding_cache.sqlite")
+            if cache_size > 0 and (not read_only or os.path.exists(cache_path)):
+                self.embedding_cache = EmbeddingCache(
+                    cache_path, max_entries=cache_size, read_only=read_only
+                )
+                self.embedding = CachedEmbeddingFunction(
+                    self.embedding, embedding_key(backend, embedding_model), self.embedding_cache
+                )
+            if self.vector_store == "mmap":
+                self.collection = MmapVectorIndex(
+                    os.path.join(path, f"vectors.{self.collection_name}"),
+                    embedding_function=self.embedding,
+                    dtype=vector_dtype,
+                    rescore=vector_rescore,
+                    read_only=read_only,
+                )
+            else:
+                self.client = chromadb.PersistentClient(path=path)
+                self.collection = self.client.get_or_create_collection(
+                    name=self.collection_name,
+                    embedding_function=self.embedding,
+                    metadata={"hnsw:space": "cosine"},
+                )
+
+            lexical = BM25Index.load(self.lexical_path)
+            if lexical is None:
+                lexical = BM25Index()
+                self._rebuild_lexical(lexical)
+            self.lexical = lexical
+            if not read_only:
+                self._warn_legacy(collection)
+
+    @classmethod
+    def from_settings(cls, settings: Settings, read_only: bool = False) -> "RAGStore":
+        embedding_function, model = make_embedding_function(settings)
+        reranker = None
+        if settings.rag_rerank:
+            cross_encoder = None
+            if settings.rerank_model_path:
+                cross_encoder = OnnxCrossEncoder(
+                    settings.rerank_model_path, threads=settings.embedding_threads
+                )
+            reranker = Reranker(
+                diversity=settings.rerank_diversity,
+                max_tokens=settings.rag_context_tokens,
+                cross_encoder=cross_encoder,
+            )
+        return cls(
+            path=settings.rag_db_path,
+            collection=settings.rag_collection,
+            embedding_function=embedding_function,
+            embedding_model=model,
+            backend=settings.embedding_backend,
+            cache_size=settings.embedding_cache_size,
+            search_mode=settings.rag_search_mode,
+            vector_timeout=settings.rag_vector_timeout,
+            reranker=reranker,
+            rerank_fetch=settings.rerank_fetch,
+            vector_store=settings.vector_store,
+            vector_dtype=settings.vector_dtype,
+            vector_rescore=settings.vector_rescore,
+            read_only=read_only,
         )
 
-    def add_documents(self, ids: List[str], texts: List[str], metadatas: Optional[List[dict]] = None) -> None:
-        # Chroma is idempotent on ids; newer add of existing ids will fail unless we handle upsert via delete
-        # To keep it simple, delete existing ids first (if any)
-        if ids:
+    def _rebuild_lexical(self, index: BM25Index) -> None:
+        # Databases ingested before the lexical index existed: build it from
+        # the stored chunks (local read, no embedding calls)
+        total = self.collection.count()
+        for offset in range(0, total, 1000):
+            res = self.collection.get(
+                limit=1000, offset=offset, include=["documents", "metadatas"]
+            )
+            index.add(res["ids"], res["documents"] or [], res["metadatas"] or None)
+        if total and not self.read_only:
+            index.save(self.lexical_path)
+
+    def _warn_legacy(self, base: str) -> None:
+        # Before collections were namespaced by backend and model, everything
+        # went into `base` with one manifest; after an upgrade the namespaced
+        # collection starts empty until ingestion is re-run
+        if self.collection.count():
+            return
+        legacy = os.path.exists(os.path.join(self.path, "ingest_manifest.json"))
+        if not legacy and self.client is not None:
             try:
-                self.collection.delete(ids=ids)
+                legacy = self.client.get_collection(base).count() > 0
+            except Exception:
+                legacy = False
+        if legacy:
+            logger.warning(
+                "Collection %s is empty, but %s holds an index from an earlier version "
+                "(collection %r or ingest_manifest.json). Collections are now per embedding "
+                "backend and model: re-run `python -m reachy_mini_bot.scripts.ingest` to "
+                "index into the new one. Until then answers have no document context.",
+                self.collection_name,
+                self.path,
+                base,
+            )
+
+    def _notify(self, ids: List[str]) -> None:
+        with self._chunk_vectors_lock:
+            for i in ids:
+                self._chunk_vectors.pop(i, None)
+        for listener in self.change_listeners:
+            try:
+                listener(ids)
+            except Exception:
+                logger.exception("RAG change listener failed")
+
+    def _timed(self, op: str, seconds: float) -> None:
+        for listener in self.timing_listeners:
+            try:
+                listener(op, seconds)
             except Exception:
-                pass
-        self.collection.add(ids=ids, documents=texts, metadatas=metadatas)
+                logger.exception("RAG timing listener failed")
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        if self.read_only:
+            raise RuntimeError(f"RAG store {self.path} is open read-only")
+        with store_lock(self.path, exclusive=True):
+            yield
+
+    def persist(self) -> None:
+        with self._writing():
+            if self.lexical.dirty:
+                self.lexical.save(self.lexical_path)
+            if isinstance(self.collection, MmapVectorIndex):
+                self.collection.compact()
+        for listener in self.persist_listeners:
+            try:
+                listener()
+            except Exception:
+                logger.exception("RAG persist listener failed")
+
+    def close(self) -> None:
+        self._vector_pool.shutdown(wait=False)
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+
+    def embed(self, texts: List[str]) -> Embeddings:
+        return self.embedding(texts)
+
+    def warm(self) -> None:
+        """Pay first-query costs up front: the embedding backend's session or
+        connection pool, the tokenizer and loading the HNSW index."""
+        count_tokens("warm up")
+        # Past the cache on purpose: a cache hit would not touch the backend
+        inner = getattr(self.embedding, "inner", self.embedding)
+        vector = inner(["warm up"])[0]
+        if self.collection.count():
+            self.collection.query(query_embeddings=[vector], n_results=1, include=[])
+
+    def add_documents(
+        self,
+        ids: List[str],
+        texts: List[str],
+        metadatas: Optional[List[dict]] = None,
+        embeddings: Optional[Embeddings] = None,
+    ) -> None:
+        # Precomputed embeddings skip the collection's embedding function
+        if not ids:
+            return
+        with self._writing():
+            self.collection.upsert(
+                ids=ids, documents=texts, metadatas=metadatas, embeddings=embeddings
+            )
+            self.lexical.add(ids, texts, metadatas)
+        self._notify(ids)
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]) -> None:
+        if ids:
+            with self._writing():
+                self.collection.update(ids=ids, metadatas=metadatas)
+                self.lexical.update_metadata(ids, metadatas)
+
+    def delete_documents(self, ids: List[str]) -> None:
+        if ids:
+            with self._writing():
+                self.collection.delete(ids=ids)
+                self.lexical.remove(ids)
+            self._notify(ids)
+
+    def delete_source(self, source: str) -> None:
+        # Drops every chunk of a file, including ones written by older ingests
+        ids = self.lexical.source_ids(source)
+        with self._writing():
+            self.collection.delete(where={"source": source})
+            self.lexical.remove(ids)
+        self._notify(ids)
 
-    def query(self, text: str, k: int = 5) -> List[RetrievedDoc]:
+    def query(
+        self, text: str, k: int = 5, mode: Optional[str] = None, rerank: bool = True
+    ) -> List[RetrievedDoc]:
         if not text.strip():
             return []
+        if self.reranker is None or not rerank:
+            return self._search(text, k, mode)
+        candidates = self._search(text, max(k, self.rerank_fetch), mode)
+        t0 = time.perf_counter()
+        docs = self.rerank(text, candidates, k)
+        self._timed("rerank", time.perf_counter() - t0)
+        return docs
+
+    def rerank(self, text: str, candidates: List[RetrievedDoc], k: int) -> List[RetrievedDoc]:
+        if self.reranker is None or len(candidates) <= 1:
+            return candidates[:k]
+        groups = self.reranker.select(
+            text, candidates, self._stored_embeddings([d.doc_id for d in candidates]), k
+        )
+        docs: List[RetrievedDoc] = []
+        for group in groups:
+            first = group[0]
+            docs.append(
+                RetrievedDoc(
+                    doc_id=first.doc_id,
+                    text="\n\n".join(d.text for d in group),
+                    source=first.source,
+                    score=max(d.score for d in group),
+                    chunk_index=first.chunk_index,
+                    merged_ids=[d.doc_id for d in group[1:]],
+                )
+            )
+        return docs
+
+    def _stored_embeddings(self, ids: List[str]) -> Optional[np.ndarray]:
+        # Local read of the vectors written at ingest; no embedding calls
+        with self._chunk_vectors_lock:
+            by_id = {i: self._chunk_vectors[i] for i in ids if i in self._chunk_vectors}
+            for i in by_id:
+                self._chunk_vectors.move_to_end(i)
+        missing = [i for i in ids if i not in by_id]
+        if missing:
+            try:
+                res = self.collection.get(ids=missing, include=["embeddings"])
+            except Exception as e:
+                logger.warning("Could not read chunk embeddings for reranking: %s", e)
+                return None
+            found = res.get("embeddings")
+            if found is None or len(found) < len(missing):
+                return None
+            fetched = {i: np.asarray(v, dtype=np.float32) for i, v in zip(res["ids"], found)}
+            by_id.update(fetched)
+            with self._chunk_vectors_lock:
+                self._chunk_vectors.update(fetched)
+                while len(self._chunk_vectors) > self._chunk_vectors_max:
+                    self._chunk_vectors.popitem(last=False)
+        if len(by_id) < len(ids):
+            return None
+        return np.stack([by_id[i] for i in ids])
+
+    def _search(self, text: str, k: int, mode: Optional[str]) -> List[RetrievedDoc]:
+        mode = mode or self.search_mode
+        t0 = time.perf_counter()
+        if mode == "lexical" or (mode == "hybrid" and time.monotonic() < self._vector_down_until):
+            # Fast path: zero network calls
+            docs = self.lexical_query(text, k)
+            self._timed("search_lexical", time.perf_counter() - t0)
+            return docs
+        # Fusion needs deeper lists than k, unless k is already deep (rerank)
+        fetch = k if mode == "vector" or k >= 20 else max(4 * k, 20)
+        try:
+            vector = self._vector_pool.submit(self.vector_query, text, fetch).result(
+                timeout=self.vector_timeout
+            )
+        except Exception as e:
+            if mode == "vector":
+                raise
+            # Embedding service slow or down: serve lexical results for a while
+            logger.warning("Vector search unavailable (%r); using lexical results", e)
+            self._vector_down_until = time.monotonic() + 30.0
+            docs = self.lexical_query(text, k)
+            self._timed("search_lexical", time.perf_counter() - t0)
+            return docs
+        if mode == "vector":
+            self._timed("search_vector", time.perf_counter() - t0)
+            return vector[:k]
+        docs = self._fuse([vector, self.lexical_query(text, fetch)], k)
+        self._timed("search_hybrid", time.perf_counter() - t0)
+        return docs
+
+    def lexical_query(self, text: str, k: int = 5) -> List[RetrievedDoc]:
+        t0 = time.perf_counter()
+        hits = self.lexical.search(text, k)
+        self._timed("lexical_search", time.perf_counter() - t0)
+        docs: List[RetrievedDoc] = []
+        for doc_id, score in hits:
+            entry = self.lexical.docs.get(doc_id)
+            if entry is None:
+                continue
+            chunk, meta = entry
+            docs.append(
+                RetrievedDoc(
+                    doc_id=doc_id,
+                    text=chunk,
+                    source=meta.get("source"),
+                    score=score,
+                    chunk_index=meta.get("chunk_index"),
+                )
+            )
+        return docs
+
+    def _fuse(self, rankings: List[List[RetrievedDoc]], k: int) -> List[RetrievedDoc]:
+        # Reciprocal rank fusion: robust to the different score scales of BM25
+        # and cosine distance
+        fused: Dict[str, RetrievedDoc] = {}
+        scores: Dict[str, float] = {}
+        for ranking in rankings:
+            for rank, d in enumerate(ranking):
+                fused.setdefault(d.doc_id, d)
+                scores[d.doc_id] = scores.get(d.doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        order = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [
+            RetrievedDoc(
+                fused[i].doc_id, fused[i].text, fused[i].source, scores[i], fused[i].chunk_index
+            )
+            for i in order
+        ]
+
+    def vector_query(self, text: str, k: int = 5) -> List[RetrievedDoc]:
+        # Embed explicitly so embedding and index search are timed apart
+        t0 = time.perf_counter()
+        vectors = self.embedding([text])
+        t1 = time.perf_counter()
+        self._timed("embed", t1 - t0)
         # Note: 'ids' is always returned by Chroma and must NOT be listed in 'include'.
         res = self.collection.query(
-            query_texts=[text],
+            query_embeddings=vectors,
             n_results=k,
             include=["documents", "metadatas", "distances"],
         )
+        self._timed("vector_search", time.perf_counter() - t1)
         docs: List[RetrievedDoc] = []
         if res and res.get("documents"):
             for i, doc in enumerate(res["documents"][0]):
@@ -56,26 +474,165 @@ class RAGStore:
                 if res.get("metadatas") and res["metadatas"][0] and i < len(res["metadatas"][0]):
                     meta = res["metadatas"][0][i]
                 doc_id = res["ids"][0][i] if res.get("ids") else str(i)
+                dist = res["distances"][0][i] if res.get("distances") else None
                 docs.append(
                     RetrievedDoc(
                         doc_id=doc_id,
                         text=doc,
                         source=(meta or {}).get("source") if meta else None,
+                        score=1.0 - dist if dist is not None else 0.0,
+                        chunk_index=(meta or {}).get("chunk_index"),
                     )
                 )
         return docs
 
 
-def chunk_text(text: str, chunk_size: int = 1500, overlap: int = 200) -> List[str]:
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n")
+
+
+@dataclass
+class Chunk:
+    text: str
+    headings: List[str] = field(default_factory=list)
+
+    @property
+    def heading_path(self) -> str:
+        return " > ".join(self.headings)
+
+
+def _markdown_blocks(text: str) -> List[Tuple[List[str], str, bool]]:
+    # Yields (heading path, block, is_heading) for headings, paragraphs and
+    # whole fenced code blocks, in document order
+    blocks: List[Tuple[List[str], str, bool]] = []
+    stack: List[Tuple[int, str]] = []
+    buf: List[str] = []
+    fence: Optional[str] = None
+
+    def flush() -> None:
+        block = "\n".join(buf).strip("\n")
+        buf.clear()
+        if block.strip():
+            blocks.append(([t for _, t in stack], block, False))
+
+    for line in text.split("\n"):
+        if fence is not None:
+            buf.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                flush()
+            continue
+        m = _FENCE_RE.match(line)
+        if m:
+            flush()
+            fence = m.group(1)
+            buf.append(line)
+            continue
+        h = _HEADING_RE.match(line)
+        if h:
+            flush()
+            level = len(h.group(1))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, h.group(2).replace("\\", "")))
+            blocks.append(([t for _, t in stack], line, True))
+            continue
+        if not line.strip():
+            flush()
+            continue
+        buf.append(line)
+    flush()
+    return blocks
+
+
+def _pack(pieces: List[str], max_tokens: int, sep: str) -> List[str]:
+    out: List[str] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for piece in pieces:
+        n = count_tokens(piece)
+        if n > max_tokens:
+            # Nothing left to split on: hard cut by tokens
+            if cur:
+                out.append(sep.join(cur))
+                cur, cur_tokens = [], 0
+            rest = piece
+            while rest:
+                head = truncate_tokens(rest, max_tokens)
+                out.append(head)
+                rest = rest[len(head) :].lstrip()
+            continue
+        if cur and cur_tokens + n > max_tokens:
+            out.append(sep.join(cur))
+            cur, cur_tokens = [], 0
+        cur.append(piece)
+        cur_tokens += n
+    if cur:
+        out.append(sep.join(cur))
+    return out
+
+
+def _split_block(block: str, max_tokens: int) -> List[str]:
+    lines = block.split("\n")
+    m = _FENCE_RE.match(lines[0])
+    if m:
+        # Keep every piece a valid fenced block of the same language
+        opener = lines[0].strip()
+        body = lines[1:-1] if len(lines) > 1 and lines[-1].strip().startswith(m.group(1)) else lines[1:]
+        budget = max(1, max_tokens - count_tokens(opener) - 2)
+        return [f"{opener}\n{p}\n{m.group(1)}" for p in _pack(body, budget, "\n")]
+    sentences = [s for s in _SENTENCE_RE.split(block) if s.strip()]
+    return _pack(sentences, max_tokens, " ")
+
+
+def chunk_markdown(text: str, max_tokens: int = 512) -> List[Chunk]:
+    """Split Markdown into chunks of at most ~`max_tokens` tokens.
+
+    Chunks break on headings, paragraphs and fenced code blocks rather than at
+    fixed offsets, never overlap, and carry the heading path they sit under.
+    Plain text degrades to paragraph packing.
+    """
     text = text.replace("\r\n", "\n")
-    chunks: List[str] = []
-    start = 0
-    n = len(text)
-    while start < n:
-        end = min(start + chunk_size, n)
-        chunk = text[start:end]
-        chunks.append(chunk)
-        if end == n:
-            break
-        start = max(0, end - overlap)
+    chunks: List[Chunk] = []
+    cur: List[Tuple[List[str], str, bool]] = []
+    cur_tokens = 0
+
+    def emit() -> None:
+        nonlocal cur, cur_tokens
+        # A trailing heading belongs with the content that follows it
+        carry = []
+        while cur and cur[-1][2]:
+            carry.insert(0, cur.pop())
+        if cur:
+            chunks.append(Chunk("\n\n".join(b for _, b, _ in cur), cur[0][0]))
+        cur = carry
+        cur_tokens = sum(count_tokens(b) for _, b, _ in cur)
+
+    for headings, block, is_heading in _markdown_blocks(text):
+        n = count_tokens(block)
+        if n > max_tokens:
+            emit()
+            prefix = "\n\n".join(b for _, b, _ in cur)
+            path = cur[0][0] if cur else headings
+            cur, cur_tokens = [], 0
+            for i, piece in enumerate(_split_block(block, max_tokens)):
+                if i == 0 and prefix:
+                    piece = f"{prefix}\n\n{piece}"
+                chunks.append(Chunk(piece, path if i == 0 else headings))
+            continue
+        # Start a new chunk at a heading once the current one is reasonably full
+        full = cur_tokens + n > max_tokens
+        if cur and (full or (is_heading and cur_tokens >= max_tokens * 3 // 4)):
+            emit()
+        cur.append((headings, block, is_heading))
+        cur_tokens += n
+    emit()
+    if cur:
+        # Document ended on headings only
+        chunks.append(Chunk("\n\n".join(b for _, b, _ in cur), cur[0][0]))
     return chunks
+
+
+def chunk_text(text: str, max_tokens: int = 512) -> List[str]:
+    return [c.text for c in chunk_markdown(text, max_tokens=max_tokens)]
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+import numpy as np
+
+from .tokens import count_tokens
+
+if TYPE_CHECKING:
+    from .rag import RetrievedDoc
+
+
+@dataclass
+class _Group:
+    # Adjacent chunks of one source, merged into a single context piece
+    source: Optional[str]
+    first: int
+    last: int
+    members: List[int] = field(default_factory=list)
+
+
+class OnnxCrossEncoder:
+    """Query/passage relevance from a local ONNX cross-encoder on CPU.
+
+    `model_dir` must hold `model.onnx` and a Hugging Face `tokenizer.json`
+    (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 exported to ONNX). Returns one
+    logit per passage; higher is more relevant.
+    """
+
+    def __init__(self, model_dir: str, threads: int = 0, max_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = os.path.expanduser(model_dir)
+        model_path = os.path.join(model_dir, "model.onnx")
+        tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        if not (os.path.exists(model_path) and os.path.exists(tokenizer_path)):
+            raise RuntimeError(
+                f"Cross-encoder model not found in {model_dir} "
+                "(expected model.onnx and tokenizer.json)"
+            )
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            model_path, sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        if not passages:
+            return np.zeros(0, dtype=np.float32)
+        enc = self.tokenizer.encode_batch([(query, p) for p in passages])
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        feeds = {
+            "input_ids": ids,
+            "attention_mask": np.array([e.attention_mask for e in enc], dtype=np.int64),
+        }
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+        logits = self.session.run(None, feeds)[0]
+        return np.asarray(logits, dtype=np.float32).reshape(len(passages), -1)[:, 0]
+
+
+def _unit_range(x: np.ndarray) -> np.ndarray:
+    lo, hi = float(x.min()), float(x.max())
+    return (x - lo) / (hi - lo) if hi > lo else np.ones_like(x)
+
+
+class Reranker:
+    """Turns an over-fetched candidate list into a small, diverse context.
+
+    1. Relevance is the first-stage score (or a cross-encoder's, if given),
+       scaled to [0, 1].
+    2. Maximal marginal relevance on the stored chunk embeddings picks
+       candidates that are relevant but unlike the ones already picked
+       (`diversity` trades one for the other).
+    3. A pick adjacent to an already picked chunk of the same source is
+       merged into it, so neighbours read as one passage.
+    4. Picks stop at `k` chunks or `max_tokens`, whichever is first.
+    """
+
+    def __init__(
+        self,
+        diversity: float = 0.3,
+        max_tokens: int = 3000,
+        cross_encoder: Optional[OnnxCrossEncoder] = None,
+    ):
+        self.diversity = min(1.0, max(0.0, diversity))
+        self.max_tokens = max_tokens
+        self.cross_encoder = cross_encoder
+
+    def relevance(self, query: str, candidates: Sequence[RetrievedDoc]) -> np.ndarray:
+        if self.cross_encoder is not None:
+            scores = self.cross_encoder.score(query, [c.text for c in candidates])
+        else:
+            scores = np.array([c.score for c in candidates], dtype=np.float32)
+        return _unit_range(scores)
+
+    def select(
+        self,
+        query: str,
+        candidates: Sequence[RetrievedDoc],
+        embeddings: Optional[np.ndarray],
+        k: int,
+    ) -> List[List[RetrievedDoc]]:
+        """Returns groups of at most `k` candidates in total; each group is
+        one source's adjacent chunks in document order."""
+        n = len(candidates)
+        if not n or k <= 0:
+            return []
+        rel = self.relevance(query, candidates)
+        if embeddings is not None and len(embeddings) == n:
+            e = np.asarray(embeddings, dtype=np.float32)
+            e = e / np.clip(np.linalg.norm(e, axis=1, keepdims=True), 1e-12, None)
+            sim = e @ e.T
+        else:
+            # No vectors: plain relevance order, still merged and trimmed
+            sim = np.zeros((n, n), dtype=np.float32)
+        lam = 1.0 - self.diversity
+        redundancy = np.zeros(n, dtype=np.float32)
+        open_ = np.ones(n, dtype=bool)
+        groups: List[_Group] = []
+        used = 0
+        picked = 0
+        while open_.any() and picked < k:
+            mmr = np.where(open_, lam * rel - (1.0 - lam) * redundancy, -np.inf)
+            j = int(np.argmax(mmr))
+            open_[j] = False
+            c = candidates[j]
+            tokens = count_tokens(c.text)
+            if used + tokens > self.max_tokens:
+                continue
+            group = self._adjacent(groups, c)
+            if group is None:
+                group = _Group(c.source, c.chunk_index or 0, c.chunk_index or 0)
+                groups.append(group)
+            elif c.chunk_index is not None:
+                group.first = min(group.first, c.chunk_index)
+                group.last = max(group.last, c.chunk_index)
+            group.members.append(j)
+            used += tokens
+            picked += 1
+            redundancy = np.maximum(redundancy, sim[j])
+        return [
+            sorted((candidates[i] for i in g.members), key=lambda c: c.chunk_index or 0)
+            for g in groups
+        ]
+
+    @staticmethod
+    def _adjacent(groups: List[_Group], c: RetrievedDoc) -> Optional[_Group]:
+        if c.source is None or c.chunk_index is None:
+            return None
+        for g in groups:
+            if g.source == c.source and g.first - 1 <= c.chunk_index <= g.last + 1:
+                return g
+        return None
@@ -1,6 +1,13 @@
-from .discord_bot import run_bot
+import time
+
+
+def run_bot():
+    # Imported here so the startup log can include how long imports took
+    started_at = time.perf_counter()
+    from .discord_bot import run_bot as start
+
+    start(started_at)
 
 
 if __name__ == "__main__":
     run_bot()
-
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: Optional[float] = None) -> float:
+        # 0.0 when a token was taken, otherwise seconds until one is available
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _Buckets:
+    # Keyed token buckets; refilled buckets are equivalent to new ones, so
+    # they are dropped once the table grows
+    def __init__(self, rate: float, burst: float, max_keys: int = 10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+
+    def take(self, key: Any, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        self._buckets.move_to_end(key)
+        wait = bucket.take(now)
+        if len(self._buckets) > self.max_keys:
+            for k in [k for k, b in self._buckets.items() if b.full(now)]:
+                del self._buckets[k]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+@dataclass
+class Ticket:
+    key: Any  # thread (or channel) the request answers in
+    user_id: int
+    text: str
+    priority: int
+    messages: List[Any] = field(default_factory=list)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started: bool = False
+    granted: "asyncio.Future[None]" = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    done: "asyncio.Future[None]" = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class RequestScheduler:
+    """Admission control and fair ordering for mentions.
+
+    - Per-user and per-channel token buckets reject bursts up front.
+    - At most `concurrency` requests run at once; the rest wait in a queue
+      bounded by `max_queue`.
+    - Queued requests are ordered by priority (how many requests the same
+      user already has queued or running, so one user cannot crowd out the
+      others), then round-robin across threads.
+    - A mention from the same user in the same thread while their previous
+      one is still queued is merged into it, and an identical mention while
+      one is running waits for that answer, so neither costs an LLM call.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        max_queue: int = 50,
+        user_rate: float = 0.1,
+        user_burst: float = 3,
+        channel_rate: float = 0.5,
+        channel_burst: float = 10,
+        coalesce_window: float = 10.0,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.coalesce_window = coalesce_window
+        self._users = _Buckets(user_rate, user_burst)
+        self._channels = _Buckets(channel_rate, channel_burst)
+        # priority -> thread key -> tickets, in round-robin order
+        self._levels: Dict[int, "OrderedDict[Any, Deque[Ticket]]"] = {}
+        self._queued = 0
+        self._running: Dict[Any, List[Ticket]] = {}
+        self._running_count = 0
+        self._user_load: Dict[int, int] = {}
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return self._running_count
+
+    def admit(self, user_id: int, channel_id: Any) -> float:
+        """0.0 if the request may proceed, else seconds until it could."""
+        now = time.monotonic()
+        wait = self._users.take(user_id, now)
+        if wait:
+            return wait
+        return self._channels.take(channel_id, now)
+
+    def enqueue(self, key: Any, user_id: int, text: str, message: Any) -> Tuple[str, Ticket, int]:
+        """Returns (status, ticket, position).
+
+        status is "started" (runs now), "queued" (position N, 1-based),
+        "merged" (folded into a queued ticket), "duplicate" (same question
+        already running) or "full" (rejected).
+        """
+        now = time.monotonic()
+        normalized = " ".join(text.split()).lower()
+        for t in self._iter_queued():
+            if t.key == key and t.user_id == user_id and now - t.enqueued_at <= self.coalesce_window:
+                t.messages.append(message)
+                return "merged", t, self.position(t)
+        for t in self._running.get(key, ()):
+            if t.text == normalized and now - t.enqueued_at <= self.coalesce_window:
+                return "duplicate", t, 0
+
+        ticket = Ticket(key=key, user_id=user_id, text=normalized, priority=self._user_load.get(user_id, 0))
+        ticket.messages.append(message)
+        if self._running_count < self.concurrency and not self._queued:
+            self._start(ticket)
+            return "started", ticket, 0
+        if self._queued >= self.max_queue:
+            return "full", ticket, 0
+        self._user_load[user_id] = self._user_load.get(user_id, 0) + 1
+        self._levels.setdefault(ticket.priority, OrderedDict()).setdefault(key, deque()).append(ticket)
+        self._queued += 1
+        return "queued", ticket, self.position(ticket)
+
+    async def wait(self, ticket: Ticket) -> None:
+        try:
+            await asyncio.shield(ticket.granted)
+        except asyncio.CancelledError:
+            if not ticket.started:
+                self._remove(ticket)
+            else:
+                self.release(ticket)
+            raise
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.done.done():
+            return
+        ticket.done.set_result(None)
+        running = self._running.get(ticket.key, [])
+        if ticket in running:
+            running.remove(ticket)
+            if not running:
+                del self._running[ticket.key]
+        self._running_count -= 1
+        self._drop_load(ticket.user_id)
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        for i, t in enumerate(self._order(), 1):
+            if t is ticket:
+                return i
+        return 0
+
+    def _order(self) -> Iterator[Ticket]:
+        # Dispatch order without mutating the queue
+        for priority in sorted(self._levels):
+            lanes = [list(q) for q in self._levels[priority].values()]
+            depth = 0
+            while True:
+                row = [lane[depth] for lane in lanes if depth < len(lane)]
+                if not row:
+                    break
+                yield from row
+                depth += 1
+
+    def _iter_queued(self) -> Iterator[Ticket]:
+        for level in self._levels.values():
+            for lane in level.values():
+                yield from lane
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.started = True
+        self._running.setdefault(ticket.key, []).append(ticket)
+        self._running_count += 1
+        self._user_load[ticket.user_id] = self._user_load.get(ticket.user_id, 0) + 1
+        if not ticket.granted.done():
+            ticket.granted.set_result(None)
+
+    def _dispatch(self) -> None:
+        while self._running_count < self.concurrency and self._queued:
+            priority = min(self._levels)
+            level = self._levels[priority]
+            key, lane = next(iter(level.items()))
+            ticket = lane.popleft()
+            # Round robin: this thread goes to the back of its level
+            del level[key]
+            if lane:
+                level[key] = lane
+            if not level:
+                del self._levels[priority]
+            self._queued -= 1
+            self._drop_load(ticket.user_id)
+            self._start(ticket)
+
+    def _remove(self, ticket: Ticket) -> None:
+        level = self._levels.get(ticket.priority)
+        lane = level.get(ticket.key) if level else None
+        if not lane or ticket not in lane:
+            return
+        lane.remove(ticket)
+        if not lane:
+            del level[ticket.key]
+        if not level:
+            del self._levels[ticket.priority]
+        self._queued -= 1
+        self._drop_load(ticket.user_id)
+        if not ticket.done.done():
+            ticket.done.set_result(None)
+
+    def _drop_load(self, user_id: int) -> None:
+        n = self._user_load.get(user_id, 0) - 1
+        if n > 0:
+            self._user_load[user_id] = n
+        else:
+            self._user_load.pop(user_id, None)
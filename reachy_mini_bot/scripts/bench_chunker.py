@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from ..rag import chunk_text
+from ..tokens import count_tokens
+from .ingest import list_files, read_file
+
+
+_TERM_RE = re.compile(r"[a-z0-9_]+")
+
+
+def chunk_fixed(text: str, chunk_size: int = 1500, overlap: int = 200) -> List[str]:
+    # The previous chunker: fixed character windows with overlap
+    text = text.replace("\r\n", "\n")
+    chunks: List[str] = []
+    start = 0
+    n = len(text)
+    while start < n:
+        end = min(start + chunk_size, n)
+        chunks.append(text[start:end])
+        if end == n:
+            break
+        start = max(0, end - overlap)
+    return chunks
+
+
+def load_questions(path: Path) -> List[dict]:
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _tfidf(texts: List[str], vocab: Dict[str, int], idf: np.ndarray) -> np.ndarray:
+    m = np.zeros((len(texts), len(vocab)), dtype=np.float32)
+    for i, t in enumerate(texts):
+        for term, c in Counter(_TERM_RE.findall(t.lower())).items():
+            j = vocab.get(term)
+            if j is not None:
+                m[i, j] = 1.0 + np.log(c)
+    m *= idf
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def evaluate(
+    chunks: List[Tuple[str, str]], questions: List[dict], k: int
+) -> Dict[str, float]:
+    # Offline proxy for retrieval quality: TF-IDF cosine top-k, a hit when a
+    # retrieved chunk from the expected source contains the expected answer
+    df: Counter = Counter()
+    for _, text in chunks:
+        df.update(set(_TERM_RE.findall(text.lower())))
+    vocab = {term: i for i, term in enumerate(df)}
+    idf = np.log((1 + len(chunks)) / (1 + np.array([df[t] for t in vocab], dtype=np.float32))) + 1
+    doc_m = _tfidf([t for _, t in chunks], vocab, idf)
+    q_m = _tfidf([q["question"] for q in questions], vocab, idf)
+    scores = q_m @ doc_m.T
+
+    hits = 0
+    for qi, q in enumerate(questions):
+        top = np.argsort(-scores[qi])[:k]
+        for ci in top:
+            source, text = chunks[ci]
+            if Path(source).name == q["source"] and q["answer"] in text:
+                hits += 1
+                break
+    tokens = [count_tokens(t) for _, t in chunks]
+    return {
+        "chunks": len(chunks),
+        "total_tokens": int(sum(tokens)),
+        "mean_tokens": float(np.mean(tokens)) if tokens else 0.0,
+        "max_tokens": int(max(tokens)) if tokens else 0,
+        f"hit_rate@{k}": hits / len(questions) if questions else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the Markdown chunker against fixed character windows"
+    )
+    parser.add_argument("folder", nargs="?", default="rag_documents", help="Docs folder")
+    parser.add_argument(
+        "--questions", default="benchmarks/questions.jsonl", help="JSONL question set"
+    )
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--chunk-tokens", type=int, default=512)
+    parser.add_argument("--json", dest="json_out", default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    texts = [(str(p), read_file(p)) for p in list_files(Path(args.folder))]
+    questions = load_questions(Path(args.questions))
+    chunkers: Dict[str, Callable[[str], List[str]]] = {
+        "fixed_1500_200": chunk_fixed,
+        f"markdown_{args.chunk_tokens}": lambda t: chunk_text(t, max_tokens=args.chunk_tokens),
+    }
+    results = {}
+    for name, fn in chunkers.items():
+        chunks = [(src, c) for src, text in texts for c in fn(text)]
+        results[name] = evaluate(chunks, questions, args.k)
+        row = ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in results[name].items())
+        print(f"{name}: {row}")
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from ..config import load_settings
+from ..embeddings import make_embedding_function
+from ..rag import chunk_text
+from .ingest import list_files, read_file
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure embedding latency for the configured backend (EMBEDDING_BACKEND)"
+    )
+    parser.add_argument("folder", nargs="?", default="rag_documents", help="Docs to sample chunks from")
+    parser.add_argument("--queries", type=int, default=50, help="Single-text calls to time")
+    parser.add_argument(
+        "--batch-sizes", default="8,32,64", help="Comma-separated batch sizes to time"
+    )
+    parser.add_argument("--json", dest="json_out", default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    settings = load_settings()
+    t0 = time.perf_counter()
+    fn, model = make_embedding_function(settings)
+    load_s = time.perf_counter() - t0
+
+    chunks = [c for p in list_files(Path(args.folder)) for c in chunk_text(read_file(p))]
+    questions = [c.split("\n", 1)[0][:200] or c[:200] for c in chunks]
+    if not chunks:
+        raise SystemExit(f"No documents found in {args.folder}")
+    fn(questions[:1])  # warm-up
+
+    per_query: List[float] = []
+    for i in range(args.queries):
+        t = time.perf_counter()
+        fn([questions[i % len(questions)]])
+        per_query.append(time.perf_counter() - t)
+
+    results: Dict[str, object] = {
+        "backend": settings.embedding_backend,
+        "model": model,
+        "load_s": round(load_s, 4),
+        "query_p50_ms": round(1000 * statistics.median(per_query), 2),
+        "query_p95_ms": round(1000 * _percentile(per_query, 0.95), 2),
+        "batches": {},
+    }
+    for size in [int(x) for x in args.batch_sizes.split(",") if x.strip()]:
+        batch = (chunks * (size // len(chunks) + 1))[:size]
+        t = time.perf_counter()
+        fn(batch)
+        dt = time.perf_counter() - t
+        results["batches"][str(size)] = {
+            "batch_ms": round(1000 * dt, 2),
+            "texts_per_s": round(size / dt, 1),
+        }
+    print(json.dumps(results, indent=2))
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..config import load_settings
+from ..embeddings import HashingEmbeddingFunction
+from ..rag import SEARCH_MODES, VECTOR_STORES, RAGStore, RetrievedDoc
+from ..rerank import Reranker
+from ..tokens import count_tokens
+from .bench_chunker import load_questions
+from .ingest import ingest_folder
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def first_relevant(docs: List[RetrievedDoc], question: dict) -> Optional[int]:
+    # 1-based rank of the first chunk from the expected source that contains
+    # the expected answer (same judgement as bench_chunker)
+    for rank, d in enumerate(docs, 1):
+        if d.source and Path(d.source).name == question["source"] and question["answer"] in d.text:
+            return rank
+    return None
+
+
+def evaluate(
+    store: RAGStore, questions: List[dict], k: int, mode: str, rerank: bool = False
+) -> Dict[str, float]:
+    recall = 0
+    source_recall = 0
+    rr = 0.0
+    tokens = 0
+    sources = 0
+    for q in questions:
+        docs = store.query(q["question"], k=k, mode=mode, rerank=rerank)
+        # Prompt cost of the context and how many distinct files it covers
+        tokens += sum(count_tokens(d.text) for d in docs)
+        sources += len({d.source for d in docs})
+        rank = first_relevant(docs, q)
+        if rank is not None:
+            recall += 1
+            rr += 1.0 / rank
+        if any(d.source and Path(d.source).name == q["source"] for d in docs):
+            source_recall += 1
+    n = max(1, len(questions))
+    return {
+        f"recall@{k}": round(recall / n, 4),
+        f"source_recall@{k}": round(source_recall / n, 4),
+        "mrr": round(rr / n, 4),
+        "context_tokens": round(tokens / n, 1),
+        "distinct_sources": round(sources / n, 2),
+    }
+
+
+def time_queries(
+    store: RAGStore,
+    questions: List[dict],
+    k: int,
+    mode: str,
+    repeat: int,
+    concurrency: int,
+    rerank: bool = False,
+) -> Dict[str, float]:
+    texts = [q["question"] for q in questions] * repeat
+
+    def one(text: str) -> float:
+        t = time.perf_counter()
+        store.query(text, k=k, mode=mode, rerank=rerank)
+        return time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    if concurrency <= 1:
+        samples = [one(t) for t in texts]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(one, texts))
+    wall = time.perf_counter() - t0
+    return {
+        "queries": len(samples),
+        "p50_ms": round(1000 * _percentile(samples, 0.50), 3),
+        "p95_ms": round(1000 * _percentile(samples, 0.95), 3),
+        "p99_ms": round(1000 * _percentile(samples, 0.99), 3),
+        "qps": round(len(samples) / wall, 1) if wall > 0 else 0.0,
+    }
+
+
+def open_store(args) -> RAGStore:
+    if not args.fake:
+        return RAGStore.from_settings(load_settings())
+    # Offline: a throwaway DB built from the docs with deterministic vectors
+    db = args.db or args.tmp_db
+    store = RAGStore(
+        path=db,
+        collection="bench",
+        embedding_function=HashingEmbeddingFunction(),
+        embedding_model="hashing-256",
+        backend="hash",
+        cache_size=0,
+        reranker=Reranker(diversity=args.rerank_diversity, max_tokens=args.context_tokens),
+        rerank_fetch=args.rerank_fetch,
+        vector_store=args.vector_store,
+    )
+    ingest_folder(Path(args.docs), store, chunk_tokens=args.chunk_tokens)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure retrieval latency, throughput and quality against a question set"
+    )
+    parser.add_argument(
+        "--questions", default="benchmarks/questions.jsonl", help="JSONL of {question, source, answer}"
+    )
+    parser.add_argument("--k", type=int, default=5, help="Chunks retrieved per question")
+    parser.add_argument(
+        "--modes", default=",".join(SEARCH_MODES), help="Comma-separated search modes to run"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the questions when timing")
+    parser.add_argument(
+        "--concurrency", default="1,4,8", help="Comma-separated thread counts for throughput"
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="Offline: deterministic hashing embedder on a DB built from --docs",
+    )
+    parser.add_argument("--docs", default="rag_documents", help="Docs to ingest with --fake")
+    parser.add_argument("--db", default=None, help="DB path for --fake (default: a temp dir)")
+    parser.add_argument("--chunk-tokens", type=int, default=512, help="Token budget per chunk with --fake")
+    parser.add_argument(
+        "--vector-store", choices=VECTOR_STORES, default="chroma", help="Vector index with --fake"
+    )
+    parser.add_argument(
+        "--rerank",
+        choices=("off", "on", "both"),
+        default="both",
+        help="Run each mode without and/or with the rerank stage",
+    )
+    parser.add_argument("--rerank-fetch", type=int, default=30, help="Candidates reranked with --fake")
+    parser.add_argument("--rerank-diversity", type=float, default=0.3, help="MMR diversity with --fake")
+    parser.add_argument(
+        "--context-tokens", type=int, default=3000, help="Reranked context budget with --fake"
+    )
+    parser.add_argument("--json", dest="json_out", default=None, help="Write results to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    questions = load_questions(Path(args.questions))
+    if not questions:
+        raise SystemExit(f"No questions in {args.questions}")
+    args.tmp_db = None if args.db or not args.fake else tempfile.mkdtemp(prefix="bench_rag_")
+    t0 = time.perf_counter()
+    store = open_store(args)
+    setup_s = time.perf_counter() - t0
+
+    results: Dict[str, object] = {
+        "collection": store.collection_name,
+        "chunks": store.collection.count(),
+        "questions": len(questions),
+        "k": args.k,
+        "fake": args.fake,
+        "setup_s": round(setup_s, 3),
+        "python": platform.python_version(),
+        "modes": {},
+    }
+    rerank_runs = {"off": [False], "on": [True], "both": [False, True]}[args.rerank]
+    if store.reranker is None:
+        rerank_runs = [False]
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode not in SEARCH_MODES:
+            raise SystemExit(f"Unknown mode {mode!r}; expected one of {', '.join(SEARCH_MODES)}")
+        for rerank in rerank_runs:
+            # Warm-up: load indexes and fill the embedding cache like a running bot
+            store.query(questions[0]["question"], k=args.k, mode=mode, rerank=rerank)
+            entry: Dict[str, object] = evaluate(store, questions, args.k, mode, rerank)
+            entry["latency"] = {
+                str(c): time_queries(store, questions, args.k, mode, args.repeat, c, rerank)
+                for c in [int(x) for x in args.concurrency.split(",") if x.strip()]
+            }
+            results["modes"][f"{mode}+rerank" if rerank else mode] = entry
+    print(json.dumps(results, indent=2))
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if args.tmp_db:
+        shutil.rmtree(args.tmp_db, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
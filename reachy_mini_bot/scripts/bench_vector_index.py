@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ..embeddings import HashingEmbeddingFunction
+from ..vector_index import MmapVectorIndex
+from .bench_chunker import load_questions
+from .ingest import file_chunks, list_files, read_file
+
+
+BACKENDS = ("chroma", "mmap-float16", "mmap-int8")
+_COLLECTION = "bench"
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _rss_mb() -> float:
+    # Current resident set; ru_maxrss (the peak) where /proc is missing
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _dir_mb(path: str) -> float:
+    total = sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+    return round(total / 2**20, 2)
+
+
+def build_corpus(
+    docs: Path, dim: int, copies: int, chunk_tokens: int
+) -> Tuple[List[str], List[str], List[dict], np.ndarray]:
+    """Chunks of `docs` with hashing vectors, repeated `copies` times. Each
+    copy is jittered so the corpus grows without exact duplicates."""
+    ids: List[str] = []
+    texts: List[str] = []
+    metas: List[dict] = []
+    for path in list_files(docs):
+        for chunk_id, text, meta in file_chunks(str(path), read_file(path), chunk_tokens):
+            ids.append(chunk_id)
+            texts.append(text)
+            metas.append(meta)
+    base = np.asarray(HashingEmbeddingFunction(dim)(texts), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    parts = [base]
+    for c in range(1, copies):
+        noisy = base + rng.normal(0, 0.05, base.shape).astype(np.float32)
+        parts.append(noisy / np.linalg.norm(noisy, axis=1, keepdims=True))
+    all_ids = [f"{c}:{i}" for c in range(copies) for i in ids]
+    return all_ids, texts * copies, metas * copies, np.concatenate(parts)
+
+
+def _open(backend: str, path: str, rescore: bool):
+    if backend == "chroma":
+        import chromadb
+
+        client = chromadb.PersistentClient(path=path)
+        return client.get_or_create_collection(
+            name=_COLLECTION, embedding_function=None, metadata={"hnsw:space": "cosine"}
+        )
+    return MmapVectorIndex(path, dtype=backend.split("-", 1)[1], rescore=rescore)
+
+
+def ingest(backend: str, path: str, ids, texts, metas, vectors, batch: int, rescore: bool) -> float:
+    collection = _open(backend, path, rescore)
+    t0 = time.perf_counter()
+    for start in range(0, len(ids), batch):
+        end = start + batch
+        collection.upsert(
+            ids=ids[start:end],
+            documents=texts[start:end],
+            metadatas=metas[start:end],
+            embeddings=vectors[start:end],
+        )
+    return time.perf_counter() - t0
+
+
+def measure(backend: str, path: str, queries: np.ndarray, k: int, repeat: int, rescore: bool) -> dict:
+    """Runs in a fresh process, so open time and memory start cold."""
+    if backend == "chroma":
+        import chromadb  # noqa: F401  (import cost is not open cost)
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    collection = _open(backend, path, rescore)
+    open_s = time.perf_counter() - t0
+    rss_open = _rss_mb()
+    # Chroma loads its HNSW index on the first query
+    t0 = time.perf_counter()
+    first = collection.query(query_embeddings=queries[:1], n_results=k, include=[])
+    first_s = time.perf_counter() - t0
+    results = [first["ids"][0]]
+    for q in queries[1:]:
+        results.append(collection.query(query_embeddings=q[None, :], n_results=k, include=[])["ids"][0])
+    samples: List[float] = []
+    for _ in range(repeat):
+        for q in queries:
+            t = time.perf_counter()
+            collection.query(
+                query_embeddings=q[None, :], n_results=k, include=["documents", "metadatas", "distances"]
+            )
+            samples.append(time.perf_counter() - t)
+    return {
+        "open_ms": round(1000 * open_s, 2),
+        "first_query_ms": round(1000 * first_s, 2),
+        "p50_ms": round(1000 * _percentile(samples, 0.50), 3),
+        "p95_ms": round(1000 * _percentile(samples, 0.95), 3),
+        "rss_open_mb": round(rss_open - rss0, 1),
+        "rss_queries_mb": round(_rss_mb() - rss0, 1),
+        "results": results,
+    }
+
+
+def exact_top_k(ids: List[str], vectors: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    scores = queries @ vectors.T
+    return [{ids[j] for j in np.argsort(-row, kind="stable")[:k]} for row in scores]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the Chroma collection with the memory-mapped vector index: "
+        "ingest time, disk size, open time, memory, query latency and recall"
+    )
+    parser.add_argument("--docs", default="rag_documents", help="Docs to chunk and index")
+    parser.add_argument(
+        "--questions", default="benchmarks/questions.jsonl", help="JSONL of {question, ...} used as queries"
+    )
+    parser.add_argument("--dim", type=int, default=1536, help="Vector dimension (1536 = OpenAI small)")
+    parser.add_argument("--copies", type=int, default=1, help="Repeat the corpus to scale it up")
+    parser.add_argument("--chunk-tokens", type=int, default=512, help="Token budget per chunk")
+    parser.add_argument("--k", type=int, default=5, help="Results per query")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the questions when timing")
+    parser.add_argument("--batch", type=int, default=256, help="Chunks per upsert")
+    parser.add_argument(
+        "--backends", default=",".join(BACKENDS), help="Comma-separated backends to run"
+    )
+    parser.add_argument(
+        "--no-rescore", action="store_true", help="Rank mmap results by quantized scores only"
+    )
+    parser.add_argument("--json", dest="json_out", default=None, help="Write results to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    questions = load_questions(Path(args.questions))
+    if not questions:
+        raise SystemExit(f"No questions in {args.questions}")
+    ids, texts, metas, vectors = build_corpus(Path(args.docs), args.dim, args.copies, args.chunk_tokens)
+    queries = np.asarray(
+        HashingEmbeddingFunction(args.dim)([q["question"] for q in questions]), dtype=np.float32
+    )
+    truth = exact_top_k(ids, vectors, queries, args.k)
+    rescore = not args.no_rescore
+
+    results: Dict[str, object] = {
+        "chunks": len(ids),
+        "dim": args.dim,
+        "queries": len(queries),
+        "k": args.k,
+        "rescore": rescore,
+        "python": platform.python_version(),
+        "backends": {},
+    }
+    root = tempfile.mkdtemp(prefix="bench_vectors_")
+    # One fresh interpreter per measurement
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            if backend not in BACKENDS:
+                raise SystemExit(f"Unknown backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+            path = os.path.join(root, backend)
+            ingest_s = ingest(backend, path, ids, texts, metas, vectors, args.batch, rescore)
+            with ctx.Pool(1) as pool:
+                entry = pool.apply(measure, (backend, path, queries, args.k, args.repeat, rescore))
+            found = entry.pop("results")
+            overlap = [len(truth[n] & set(r)) / args.k for n, r in enumerate(found)]
+            entry.update(
+                ingest_s=round(ingest_s, 3),
+                disk_mb=_dir_mb(path),
+                overlap_at_k=round(float(np.mean(overlap)), 4),
+            )
+            results["backends"][backend] = entry
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from aiohttp import web
+
+from ..embeddings import HashingEmbeddingFunction
+
+
+_WORDS = (
+    "Reachy Mini can move its head and antennas, play sounds and run apps. "
+    "Check the daemon logs, the USB connection and the power supply first, "
+    "then restart the daemon and try the dashboard again."
+).split()
+
+
+@dataclass
+class FakeOpenAIConfig:
+    # Seconds before the first byte of a chat reply; uniformly +/- `jitter` of it
+    chat_latency: float = 0.5
+    jitter: float = 0.5
+    # Streamed replies: words per reply and delay between them
+    reply_words: int = 120
+    word_interval: float = 0.01
+    embed_latency: float = 0.05
+    # Fraction of requests answered with HTTP 500 / 429
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    # Fraction of chat requests that hang for `stall_seconds` before answering
+    stall_rate: float = 0.0
+    stall_seconds: float = 30.0
+    # Chat models that always answer HTTP 503 (to exercise fallback)
+    failing_models: Tuple[str, ...] = ()
+    dim: int = 256
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeOpenAIStats:
+    chat: int = 0
+    chat_streams: int = 0
+    embeddings: int = 0
+    embedded_texts: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    stalls: int = 0
+    by_status: Dict[int, int] = field(default_factory=dict)
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI chat and embeddings endpoints.
+
+    Speaks enough of the HTTP API for `AsyncOpenAI` and Chroma's
+    OpenAIEmbeddingFunction (point them at `base_url`), with configurable
+    latency and error rates. Embeddings are deterministic hashing vectors.
+    """
+
+    def __init__(self, config: Optional[FakeOpenAIConfig] = None):
+        self.config = config or FakeOpenAIConfig()
+        self.stats = FakeOpenAIStats()
+        self._rng = random.Random(self.config.seed)
+        self._embedder = HashingEmbeddingFunction(self.config.dim)
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.base_url = ""
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        app.router.add_get("/v1/models", self._models)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}/v1"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        # Own loop on its own thread, so the fake's work never shows up as
+        # event-loop lag in the process under test
+        ready = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start(host, port))
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-openai", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.base_url
+
+    def stop_thread(self) -> None:
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def _delay(self, mean: float) -> float:
+        j = self.config.jitter
+        return max(0.0, mean * self._rng.uniform(1 - j, 1 + j))
+
+    def _failure(self) -> Optional[web.Response]:
+        r = self._rng.random()
+        status = None
+        if r < self.config.error_rate:
+            self.stats.errors += 1
+            status = 500
+            resp = web.json_response(
+                {"error": {"message": "fake server error", "type": "server_error"}}, status=500
+            )
+        elif r < self.config.error_rate + self.config.rate_limit_rate:
+            self.stats.rate_limited += 1
+            status = 429
+            resp = web.json_response(
+                {"error": {"message": "fake rate limit", "type": "rate_limit_error"}},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+        if status is None:
+            return None
+        self.stats.by_status[status] = self.stats.by_status.get(status, 0) + 1
+        return resp
+
+    def _reply_words(self):
+        n = self.config.reply_words
+        return [_WORDS[i % len(_WORDS)] + " " for i in range(n)]
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "fake")
+        if self._rng.random() < self.config.stall_rate:
+            self.stats.stalls += 1
+            await asyncio.sleep(self.config.stall_seconds)
+        await asyncio.sleep(self._delay(self.config.chat_latency))
+        if model in self.config.failing_models:
+            self.stats.errors += 1
+            self.stats.by_status[503] = self.stats.by_status.get(503, 0) + 1
+            return web.json_response(
+                {"error": {"message": f"{model} unavailable", "type": "server_error"}}, status=503
+            )
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        created = int(time.time())
+        if not body.get("stream"):
+            self.stats.chat += 1
+            text = "".join(self._reply_words())
+            if self.config.word_interval:
+                await asyncio.sleep(self.config.word_interval * self.config.reply_words)
+            return web.json_response(
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }
+            )
+
+        self.stats.chat_streams += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+
+        async def event(delta: dict, finish: Optional[str] = None) -> None:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        try:
+            await resp.prepare(request)
+            await event({"role": "assistant", "content": ""})
+            for word in self._reply_words():
+                await event({"content": word})
+                if self.config.word_interval:
+                    await asyncio.sleep(self.config.word_interval)
+            await event({}, "stop")
+            await resp.write(b"data: [DONE]\n\n")
+            await resp.write_eof()
+        except ConnectionResetError:
+            # Client closed the stream early
+            pass
+        return resp
+
+    async def _models(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "fake"}]}
+        )
+
+    async def _embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self._delay(self.config.embed_latency))
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        texts = body.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        self.stats.embeddings += 1
+        self.stats.embedded_texts += len(texts)
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, vec in enumerate(self._embedder([str(t) for t in texts])):
+            arr = np.asarray(vec, dtype=np.float32)
+            emb = base64.b64encode(arr.tobytes()).decode() if as_base64 else arr.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": emb})
+        return web.json_response(
+            {
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "fake"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Seconds to first chat byte")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Relative latency jitter (0-1)")
+    parser.add_argument("--reply-words", type=int, default=120, help="Words per chat reply")
+    parser.add_argument("--word-interval", type=float, default=0.01, help="Seconds between streamed words")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embeddings call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of HTTP 500 replies")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of HTTP 429 replies")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of chat requests that hang")
+    parser.add_argument("--stall-seconds", type=float, default=30.0, help="How long a stalled request hangs")
+    parser.add_argument(
+        "--failing-model", action="append", default=[], help="Chat model that always returns 503 (repeatable)"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency and error draws")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeOpenAIConfig:
+    return FakeOpenAIConfig(
+        chat_latency=args.chat_latency,
+        jitter=min(1.0, max(0.0, args.jitter)),
+        reply_words=max(1, args.reply_words),
+        word_interval=max(0.0, args.word_interval),
+        embed_latency=args.embed_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        failing_models=tuple(args.failing_model),
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a fake OpenAI-compatible server (set OPENAI_BASE_URL to its URL)"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    async def serve() -> None:
+        server = FakeOpenAIServer(config_from_args(args))
+        url = await server.start(args.host, args.port)
+        print(f"Fake OpenAI listening on {url}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,26 @@ from __future__ import annotations
 
 import argparse
 import hashlib
+import json
+import logging
 import os
+import random
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from bs4 import BeautifulSoup
 
+try:
+    from tqdm import tqdm
+except ImportError:  # progress bars are optional
+    tqdm = None
+
 from ..config import load_settings
-from ..rag import RAGStore, chunk_text
+from ..rag import RAGStore, chunk_markdown
 
 
 TEXT_EXTS = {".txt", ".md", ".log"}
@@ -17,6 +29,9 @@ HTML_EXTS = {".html", ".htm"}
 PDF_EXTS = {".pdf"}
 
 
+logger = logging.getLogger("reachy-mini.ingest")
+
+
 def read_file(path: Path) -> str:
     suffix = path.suffix.lower()
     if suffix in TEXT_EXTS:
@@ -34,54 +49,359 @@ def read_file(path: Path) -> str:
     return ""
 
 
-def file_id(path: Path, chunk_idx: int) -> str:
-    h = hashlib.sha1(f"{str(path)}::{chunk_idx}".encode("utf-8")).hexdigest()
-    return h
+def chunk_id(source: str, chunk: str, occurrence: int = 0) -> str:
+    # Content-addressed: inserting text only changes the ids of chunks that changed.
+    # `occurrence` disambiguates identical chunks within the same file.
+    digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+    return hashlib.sha1(f"{source}::{digest}::{occurrence}".encode("utf-8")).hexdigest()
+
+
+def file_chunks(
+    source: str, text: str, max_tokens: int = 512
+) -> List[Tuple[str, str, dict]]:
+    seen: Dict[str, int] = {}
+    out: List[Tuple[str, str, dict]] = []
+    for idx, chunk in enumerate(chunk_markdown(text, max_tokens=max_tokens)):
+        n = seen.get(chunk.text, 0)
+        seen[chunk.text] = n + 1
+        meta = {"source": source, "headings": chunk.heading_path, "chunk_index": idx}
+        out.append((chunk_id(source, chunk.text, n), chunk.text, meta))
+    return out
+
+
+def default_manifest_path(store: RAGStore) -> Path:
+    # One manifest per collection, next to the DB
+    return Path(store.path) / f"ingest_manifest.{store.collection_name}.json"
+
+
+def load_manifest(path: Path) -> Dict[str, dict]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return data.get("files", {})
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        # A corrupt manifest only costs a full re-ingest
+        return {}
+
+
+def save_manifest(path: Path, files: Dict[str, dict]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": 1, "files": files}, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@dataclass
+class IngestStats:
+    added: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    chunks_upserted: int = 0
+    chunks_deleted: int = 0
 
+    def summary(self) -> str:
+        return (
+            f"files: {self.added} added, {self.updated} updated, "
+            f"{self.deleted} deleted, {self.unchanged} unchanged; "
+            f"chunks: {self.chunks_upserted} upserted, {self.chunks_deleted} deleted"
+        )
 
-def ingest_folder(folder: Path, store: RAGStore) -> None:
+
+def list_files(folder: Path) -> List[Path]:
     paths: List[Path] = []
     for root, _dirs, files in os.walk(folder):
         for name in files:
             p = Path(root) / name
             if p.suffix.lower() in TEXT_EXTS | HTML_EXTS | PDF_EXTS:
                 paths.append(p)
-    ids: List[str] = []
-    docs: List[str] = []
-    metas: List[dict] = []
-    for p in sorted(paths):
-        text = read_file(p)
-        if not text.strip():
+    return sorted(paths)
+
+
+def _under(source: str, folder: Path) -> bool:
+    try:
+        Path(source).resolve().relative_to(folder.resolve())
+        return True
+    except ValueError:
+        return False
+
+
+def _prepare(
+    source: str, known_hash: Optional[str], max_tokens: int
+) -> Tuple[str, str, List[Tuple[str, str, dict]]]:
+    # Runs in a worker process: parsing PDFs/HTML and chunking are CPU-bound.
+    # Chunks are skipped when the content hash matches the manifest.
+    text = read_file(Path(source))
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    if content_hash == known_hash or not text.strip():
+        return source, content_hash, []
+    return source, content_hash, file_chunks(source, text, max_tokens=max_tokens)
+
+
+def _bounded_map(pool: Optional[ProcessPoolExecutor], fn, args: List[tuple], window: int) -> Iterator:
+    # Like pool.map, but keeps at most `window` results pending so memory
+    # stays flat regardless of the number of files
+    if pool is None:
+        for a in args:
+            yield fn(*a)
+        return
+    it = iter(args)
+    inflight: Deque[Future] = deque()
+    for a in it:
+        inflight.append(pool.submit(fn, *a))
+        if len(inflight) >= window:
+            break
+    while inflight:
+        fut = inflight.popleft()
+        nxt = next(it, None)
+        if nxt is not None:
+            inflight.append(pool.submit(fn, *nxt))
+        yield fut.result()
+
+
+def _embed_with_retry(
+    store: RAGStore, texts: List[str], retries: int = 5, base_delay: float = 1.0
+):
+    for attempt in range(retries + 1):
+        try:
+            return store.embed(texts)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = base_delay * (2**attempt) * (0.5 + random.random())
+            logger.warning("Embedding batch failed (%s); retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+
+@dataclass
+class _PendingFile:
+    entry: dict
+    stale: List[str]
+    remaining: int
+    # Unchanged chunks whose position metadata may have shifted
+    kept: List[Tuple[str, str, dict]]
+
+
+def ingest_folder(
+    folder: Path,
+    store: RAGStore,
+    manifest_path: Optional[Path] = None,
+    workers: int = 1,
+    batch_size: int = 64,
+    embed_concurrency: int = 4,
+    progress: bool = False,
+    chunk_tokens: int = 512,
+) -> IngestStats:
+    return ingest_paths(
+        list_files(folder),
+        store,
+        manifest_path=manifest_path,
+        workers=workers,
+        batch_size=batch_size,
+        embed_concurrency=embed_concurrency,
+        progress=progress,
+        chunk_tokens=chunk_tokens,
+        prune=folder,
+    )
+
+
+def ingest_paths(
+    paths: Iterable[Path],
+    store: RAGStore,
+    manifest_path: Optional[Path] = None,
+    workers: int = 1,
+    batch_size: int = 64,
+    embed_concurrency: int = 4,
+    progress: bool = False,
+    chunk_tokens: int = 512,
+    prune: Optional[Path] = None,
+) -> IngestStats:
+    """Incrementally ingest `paths` into `store`.
+
+    Paths that no longer exist have their chunks removed. With `prune`,
+    every manifest entry under that folder that is not in `paths` is
+    removed as well (a full folder scan).
+    """
+    manifest_path = manifest_path or default_manifest_path(store)
+    manifest = load_manifest(manifest_path)
+    stats = IngestStats()
+
+    present = set()
+    gone: List[str] = []
+    todo: List[Tuple[str, Optional[str], int]] = []
+    stat_of: Dict[str, os.stat_result] = {}
+    for p in paths:
+        source = str(p)
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            gone.append(source)
+            continue
+        present.add(source)
+        entry = manifest.get(source)
+        if entry and entry.get("mtime") == st.st_mtime and entry.get("size") == st.st_size:
+            stats.unchanged += 1
             continue
-        chunks = chunk_text(text)
-        for idx, chunk in enumerate(chunks):
-            ids.append(file_id(p, idx))
-            docs.append(chunk)
-            metas.append({"source": str(p)})
-    if ids:
-        store.add_documents(ids, docs, metas)
+        stat_of[source] = st
+        todo.append((source, entry.get("sha256") if entry else None, chunk_tokens))
+
+    pending: Dict[str, _PendingFile] = {}
+    batch: List[Tuple[str, str, dict]] = []  # (chunk id, text, metadata)
+    inflight: Deque[Tuple[Future, List[Tuple[str, str, dict]]]] = deque()
+    bar = tqdm(total=len(todo), unit="file", desc="ingest") if progress and tqdm else None
+
+    def finish(source: str) -> None:
+        pf = pending.pop(source)
+        store.update_metadata([cid for cid, _, _ in pf.kept], [m for _, _, m in pf.kept])
+        store.delete_documents(pf.stale)
+        stats.chunks_deleted += len(pf.stale)
+        manifest[source] = pf.entry
+        if len(manifest) % 50 == 0:
+            save_manifest(manifest_path, manifest)
+
+    def drain(limit: int) -> None:
+        # Chroma writes stay on this thread; only embedding runs concurrently
+        while len(inflight) > limit:
+            fut, items = inflight.popleft()
+            embeddings = fut.result()
+            store.add_documents(
+                [cid for cid, _, _ in items],
+                [text for _, text, _ in items],
+                [meta for _, _, meta in items],
+                embeddings=embeddings,
+            )
+            stats.chunks_upserted += len(items)
+            if bar is not None:
+                bar.set_postfix(chunks=stats.chunks_upserted)
+            for _, _, meta in items:
+                src = meta["source"]
+                pending[src].remaining -= 1
+                if pending[src].remaining == 0:
+                    finish(src)
+
+    def submit(epool: ThreadPoolExecutor) -> None:
+        items = list(batch)
+        batch.clear()
+        inflight.append((epool.submit(_embed_with_retry, store, [t for _, t, _ in items]), items))
+        drain(embed_concurrency)
+
+    ppool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with ThreadPoolExecutor(max_workers=embed_concurrency) as epool:
+            for source, content_hash, chunks in _bounded_map(ppool, _prepare, todo, window=2 * workers):
+                if bar is not None:
+                    bar.update(1)
+                st = stat_of[source]
+                entry = manifest.get(source)
+                if entry and entry.get("sha256") == content_hash:
+                    entry.update(mtime=st.st_mtime, size=st.st_size)
+                    stats.unchanged += 1
+                    continue
+                if entry is None:
+                    # Unknown to the manifest: clear anything an older ingest left behind
+                    store.delete_source(source)
+                    stats.added += 1
+                else:
+                    stats.updated += 1
+
+                old_ids = set(entry.get("chunk_ids", [])) if entry else set()
+                new_ids = [cid for cid, _, _ in chunks]
+                fresh = [c for c in chunks if c[0] not in old_ids]
+                pending[source] = _PendingFile(
+                    entry={
+                        "mtime": st.st_mtime,
+                        "size": st.st_size,
+                        "sha256": content_hash,
+                        "chunk_ids": new_ids,
+                    },
+                    stale=sorted(old_ids - set(new_ids)),
+                    remaining=len(fresh),
+                    kept=[c for c in chunks if c[0] in old_ids],
+                )
+                if not fresh:
+                    finish(source)
+                    continue
+                for item in fresh:
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        submit(epool)
+            if batch:
+                submit(epool)
+            drain(0)
+    finally:
+        if ppool is not None:
+            ppool.shutdown(cancel_futures=True)
+        if bar is not None:
+            bar.close()
+        # Keep whatever finished so an interrupted run resumes where it stopped
+        save_manifest(manifest_path, manifest)
+        store.persist()
+
+    if prune is not None:
+        gone += [s for s in manifest if s not in present and _under(s, prune)]
+    for source in gone:
+        entry = manifest.pop(source, None)
+        if entry is None:
+            continue
+        ids = entry.get("chunk_ids", [])
+        store.delete_documents(ids)
+        stats.deleted += 1
+        stats.chunks_deleted += len(ids)
+
+    save_manifest(manifest_path, manifest)
+    store.persist()
+    return stats
 
 
 def main():
     parser = argparse.ArgumentParser(description="Ingest a folder into the local RAG DB")
     parser.add_argument("folder", type=str, help="Path to folder with docs")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes used to read and chunk files (default: CPU count)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="Chunks per embedding request"
+    )
+    parser.add_argument(
+        "--embed-concurrency",
+        type=int,
+        default=4,
+        help="Embedding requests in flight at once",
+    )
+    parser.add_argument(
+        "--chunk-tokens", type=int, default=512, help="Token budget per chunk"
+    )
+    parser.add_argument("--no-progress", action="store_true", help="Disable the progress bar")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
 
     settings = load_settings()
-    store = RAGStore(
-        path=settings.rag_db_path,
-        collection=settings.rag_collection,
-        openai_api_key=settings.openai_api_key,
-        embedding_model=settings.openai_embedding_model,
-    )
+    store = RAGStore.from_settings(settings)
 
     folder = Path(args.folder)
     if not folder.exists():
         raise SystemExit(f"Folder does not exist: {folder}")
-    ingest_folder(folder, store)
-    print(f"Ingested documents from {folder} into {settings.rag_collection} at {settings.rag_db_path}")
+    stats = ingest_folder(
+        folder,
+        store,
+        workers=max(1, args.workers),
+        batch_size=max(1, args.batch_size),
+        embed_concurrency=max(1, args.embed_concurrency),
+        progress=not args.no_progress,
+        chunk_tokens=max(32, args.chunk_tokens),
+    )
+    print(f"Ingested documents from {folder} into {store.collection_name} at {settings.rag_db_path}")
+    print(stats.summary())
+    if store.embedding_cache is not None:
+        st = store.embedding_cache.stats()
+        print(
+            f"Embedding cache: {st['hits']} hits, {st['misses']} misses "
+            f"({st['entries']} entries)"
+        )
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+
+import discord
+
+from ..discord_bot import BUSY_REPLY, QUEUED_REPLY, ReachyMiniClient
+from .bench_chunker import load_questions
+from .fake_openai import FakeOpenAIServer, add_config_arguments, config_from_args
+from .ingest import ingest_folder
+
+
+BOT_ID = 1_000_000_000_000_000_001
+_BUSY_PREFIX = BUSY_REPLY.split("{")[0]
+_QUEUED_PREFIX = QUEUED_REPLY.split("{")[0]
+_ids = itertools.count(2_000_000_000_000_000_000)
+
+
+@dataclass
+class RequestRecord:
+    start: float
+    first_reply: Optional[float] = None
+    # Replies are posted after on_message returns: the last send or edit
+    last_reply: Optional[float] = None
+    end: Optional[float] = None
+    failed: bool = False
+    rejected: bool = False
+    queued: bool = False
+
+
+# Set per mention task so fake channels know whose reply they are sending
+_current: contextvars.ContextVar[Optional[RequestRecord]] = contextvars.ContextVar(
+    "loadtest_request", default=None
+)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+        self.name = f"user{user_id % 10000}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    id = 1
+
+
+class _Sink:
+    """Shared pieces of the fake text channel and thread."""
+
+    client: discord.Client
+    latency: float
+    # Sends and edits allowed per channel in Discord's 5 s window (0: no
+    # limit). Further calls get a 429, which discord.py waits out and retries.
+    limit = 0
+    rate_limited = 0
+    _posts: Deque[float]
+
+    def typing(self):
+        return contextlib.nullcontext()
+
+    async def _rest(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _post(self) -> None:
+        posts = self.__dict__.setdefault("_posts", deque())
+        while self.limit:
+            await self._rest()
+            now = time.monotonic()
+            while posts and now - posts[0] >= 5.0:
+                posts.popleft()
+            if len(posts) < self.limit:
+                posts.append(now)
+                break
+            _Sink.rate_limited += 1
+            await asyncio.sleep(5.0 - (now - posts[0]))
+        await self._rest()
+
+    async def send(self, content: str = "", reference=None, **kwargs) -> "FakeMessage":
+        await self._post()
+        rec = _current.get()
+        if rec is not None:
+            if content.startswith(_QUEUED_PREFIX):
+                rec.queued = True
+            elif content.startswith(_BUSY_PREFIX):
+                rec.rejected = True
+            else:
+                rec.last_reply = time.perf_counter()
+                if rec.first_reply is None:
+                    rec.first_reply = rec.last_reply
+            if content.startswith("Sorry, I hit an error"):
+                rec.failed = True
+        msg = FakeMessage(self.client.user, self, content, latency=self.latency)
+        # The gateway echoes our own messages back, as Discord does
+        self.client.dispatch("message", msg)
+        return msg
+
+
+class FakeTextChannel(_Sink):
+    def __init__(self, client: discord.Client, latency: float):
+        self.client = client
+        self.latency = latency
+        self.id = next(_ids)
+        self.name = "support"
+        self.guild = FakeGuild()
+
+
+class FakeThread(_Sink, discord.Thread):
+    # Passes `isinstance(..., discord.Thread)`; only the attributes the bot
+    # touches are filled in
+    def __init__(self, client: discord.Client, name: str, latency: float):
+        self.client = client
+        self.latency = latency
+        self.id = next(_ids)
+        self.name = name
+        self.guild = FakeGuild()
+        self.owner_id = BOT_ID
+        self.parent_id = 0
+        self.backlog: List[FakeMessage] = []
+
+    async def history(self, limit: Optional[int] = 100, **kwargs):
+        await self._rest()
+        msgs = list(reversed(self.backlog))
+        for m in msgs[:limit] if limit is not None else msgs:
+            yield m
+
+
+class FakeMessage:
+    def __init__(self, author: FakeUser, channel, content: str, mentions=(), latency: float = 0.0):
+        self.id = next(_ids)
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.mentions = list(mentions)
+        self.attachments: list = []
+        self.latency = latency
+        if isinstance(channel, FakeThread):
+            channel.backlog.append(self)
+
+    async def edit(self, content: str = "", **kwargs) -> "FakeMessage":
+        await self.channel._post()
+        rec = _current.get()
+        if rec is not None:
+            rec.last_reply = time.perf_counter()
+        self.content = content
+        return self
+
+    async def create_thread(self, name: str, auto_archive_duration: int = 60) -> FakeThread:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return FakeThread(self.channel.client, name, self.latency)
+
+    async def reply(self, content: str = "", **kwargs) -> "FakeMessage":
+        return await self.channel.send(content, reference=self)
+
+
+class TimedSemaphore:
+    """asyncio.Semaphore that records how long each acquire waited."""
+
+    def __init__(self, sema: asyncio.Semaphore, waits: List[float]):
+        self._sema = sema
+        self.waits = waits
+
+    async def __aenter__(self):
+        t = time.perf_counter()
+        await self._sema.acquire()
+        self.waits.append(time.perf_counter() - t)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._sema.release()
+
+
+async def _loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - t - interval))
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(q: float) -> float:
+        return round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * q))], 2)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(1000 * ordered[-1], 2),
+    }
+
+
+def _stage_summary(client) -> Dict[str, Dict[str, float]]:
+    # Per-request stage totals as recorded by the bot's own tracing
+    hist = client.metrics.histogram("reachy_stage_seconds")
+    out = {}
+    for labels in sorted(hist.label_sets(), key=lambda l: l["stage"]):
+        out[labels["stage"]] = {
+            "count": hist.count(**labels),
+            "p50_ms": round(1000 * (hist.percentile(0.50, **labels) or 0.0), 2),
+            "p95_ms": round(1000 * (hist.percentile(0.95, **labels) or 0.0), 2),
+        }
+    return out
+
+
+def _discord_summary(client, op: str) -> Dict[str, float]:
+    hist = client.metrics.histogram("reachy_discord_seconds")
+    return {
+        "count": hist.count(op=op),
+        "p50_ms": round(1000 * (hist.percentile(0.50, op=op) or 0.0), 2),
+        "p95_ms": round(1000 * (hist.percentile(0.95, op=op) or 0.0), 2),
+    }
+
+
+def _configure_env(args, base_url: str, db_path: str) -> None:
+    # The bot reads everything through load_settings(); explicit env wins
+    # over .env, so a real configuration on disk is left untouched
+    os.environ["discord_token"] = "loadtest"
+    os.environ["OPENAI_API_KEY"] = "sk-loadtest"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["RAG_DB_PATH"] = db_path
+    os.environ["EMBEDDING_BACKEND"] = "openai"
+    os.environ["STREAM_REPLIES"] = "1" if args.stream else "0"
+    os.environ["EMBEDDING_CACHE_SIZE"] = "200000" if args.embedding_cache else "0"
+    os.environ["ANSWER_CACHE_SIZE"] = "512" if args.answer_cache else "0"
+    for flag, var in (
+        (args.rag_concurrency, "RAG_CONCURRENCY"),
+        (args.llm_concurrency, "LLM_CONCURRENCY"),
+        (args.rag_workers, "RAG_WORKERS"),
+        (args.query_workers, "QUERY_WORKERS"),
+        (args.request_concurrency, "REQUEST_CONCURRENCY"),
+    ):
+        if flag is not None:
+            os.environ[var] = str(flag)
+
+
+async def run(args) -> Dict[str, object]:
+    server = FakeOpenAIServer(config_from_args(args))
+    base_url = server.start_in_thread()
+    db_path = tempfile.mkdtemp(prefix="loadtest_db_")
+    _configure_env(args, base_url, db_path)
+    _Sink.limit = args.discord_channel_limit
+    client = ReachyMiniClient()
+    try:
+        # What login() would set up: the bot user and the loop events run on
+        client._connection.user = FakeUser(BOT_ID, bot=True)
+        client.loop = asyncio.get_running_loop()
+        await client.warm_up()
+        t = time.perf_counter()
+        ingest_folder(Path(args.docs), client.rag, workers=1, progress=False)
+        ingest_s = time.perf_counter() - t
+
+        waits: Dict[str, List[float]] = {"rag": [], "llm": []}
+        client._rag_sema = TimedSemaphore(client._rag_sema, waits["rag"])
+        client._llm_sema = TimedSemaphore(client._llm_sema, waits["llm"])
+
+        rng = random.Random(args.seed)
+        questions = [q["question"] for q in load_questions(Path(args.questions))]
+        channel = FakeTextChannel(client, args.discord_latency)
+        threads = []
+        for i in range(args.threads):
+            th = FakeThread(client, f"Reachy Mini: thread {i}", args.discord_latency)
+            # Some prior conversation, fetched over "REST" on the first mention
+            for j in range(args.history):
+                author = client.user if j % 2 else FakeUser(7)
+                FakeMessage(author, th, rng.choice(questions))
+            threads.append(th)
+
+        users = [FakeUser(100 + i) for i in range(args.users)]
+        records: List[RequestRecord] = []
+
+        async def mention(i: int) -> None:
+            author = rng.choice(users)
+            text = f"<@{BOT_ID}> {questions[i % len(questions)]}"
+            if not threads or rng.random() < args.new_thread_ratio:
+                target = channel
+            else:
+                target = rng.choice(threads)
+            msg = FakeMessage(author, target, text, mentions=[client.user], latency=args.discord_latency)
+            rec = RequestRecord(start=time.perf_counter())
+            records.append(rec)
+            _current.set(rec)
+            try:
+                await client.on_message(msg)
+            except Exception:
+                rec.failed = True
+            rec.end = time.perf_counter()
+
+        lag: List[float] = []
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(_loop_lag(lag, stop))
+        t0 = time.perf_counter()
+        tasks = []
+        for i in range(args.mentions):
+            tasks.append(asyncio.create_task(mention(i)))
+            if args.rate > 0:
+                await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+        # Handlers return once the reply is handed off; wait until it is posted
+        await client.outbound.join()
+        wall = time.perf_counter() - t0
+        for r in records:
+            if r.end is not None and r.last_reply is not None:
+                r.end = max(r.end, r.last_reply)
+        stop.set()
+        await ticker
+
+        done = [r for r in records if r.end is not None]
+        rejected = [r for r in done if r.rejected]
+        ok = [r for r in done if not r.failed and not r.rejected]
+        scheduled = client.metrics.counter("reachy_scheduler_total")
+        return {
+            "mentions": args.mentions,
+            "completed": len(ok),
+            "failed": len(done) - len(ok) - len(rejected),
+            "rejected": len(rejected),
+            "queued_notices": sum(r.queued for r in done),
+            "scheduler": {
+                s: scheduled.value(result=s)
+                for s in ("started", "queued", "merged", "duplicate", "full", "rate_limited")
+            },
+            "wall_s": round(wall, 3),
+            "throughput_per_s": round(len(ok) / wall, 2) if wall > 0 else 0.0,
+            "ingest_s": round(ingest_s, 3),
+            "startup_ms": {k: round(1000 * v, 1) for k, v in client.startup.items()},
+            "settings": {
+                "stream_replies": client.settings.stream_replies,
+                "rag_concurrency": client.settings.rag_concurrency,
+                "llm_concurrency": client.settings.llm_concurrency,
+                "rag_workers": client.settings.rag_workers,
+                "query_workers": client.settings.query_workers,
+                "request_concurrency": client.settings.request_concurrency,
+                "rate_per_s": args.rate,
+            },
+            "end_to_end": _summary([r.end - r.start for r in ok]),
+            "first_reply": _summary(
+                [r.first_reply - r.start for r in ok if r.first_reply is not None]
+            ),
+            "queue_wait": {name: _summary(w) for name, w in waits.items()},
+            "stages": _stage_summary(client),
+            "event_loop_lag": _summary(lag),
+            "discord": {
+                **client.outbound.calls,
+                "rate_limited": _Sink.rate_limited,
+                "retried": client.outbound.rate_limited,
+                "failed": client.outbound.failed,
+                "pacing": _discord_summary(client, "pacing"),
+                "delivery": _discord_summary(client, "delivery"),
+            },
+            "openai_client": dict(sorted(client.ai.outcomes.items())),
+            "history_cache": {"hits": client.history.hits, "misses": client.history.misses},
+            "fake_openai": {
+                "chat": server.stats.chat,
+                "chat_streams": server.stats.chat_streams,
+                "embedding_calls": server.stats.embeddings,
+                "embedded_texts": server.stats.embedded_texts,
+                "errors": server.stats.errors,
+                "rate_limited": server.stats.rate_limited,
+                "stalls": server.stats.stalls,
+            },
+        }
+    finally:
+        await client.close_services()
+        server.stop_thread()
+        shutil.rmtree(db_path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive on_message with a burst of synthetic mentions against a fake OpenAI server"
+    )
+    parser.add_argument("--mentions", type=int, default=100, help="Mentions to send")
+    parser.add_argument(
+        "--rate", type=float, default=0.0, help="Mean arrivals per second (0: all at once)"
+    )
+    parser.add_argument("--threads", type=int, default=20, help="Existing threads to mention in")
+    parser.add_argument(
+        "--new-thread-ratio", type=float, default=0.3, help="Fraction of mentions in a channel (new thread)"
+    )
+    parser.add_argument("--history", type=int, default=6, help="Prior messages per existing thread")
+    parser.add_argument("--users", type=int, default=30, help="Distinct authors")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="Seconds per fake Discord REST call")
+    parser.add_argument(
+        "--discord-channel-limit",
+        type=int,
+        default=0,
+        help="Sends and edits per channel per 5 s before the fake Discord answers 429 (0: no limit)",
+    )
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Send whole replies")
+    parser.add_argument("--rag-concurrency", type=int, default=None)
+    parser.add_argument("--llm-concurrency", type=int, default=None)
+    parser.add_argument("--rag-workers", type=int, default=None)
+    parser.add_argument(
+        "--query-workers", type=int, default=None, help="Worker processes; retrieval runs in them with VECTOR_STORE=mmap (0: in-process)"
+    )
+    parser.add_argument("--request-concurrency", type=int, default=None)
+    parser.add_argument("--embedding-cache", action="store_true", help="Keep the embedding cache on")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache on")
+    parser.add_argument("--docs", default="rag_documents", help="Docs ingested into the throwaway DB")
+    parser.add_argument("--questions", default="benchmarks/questions.jsonl")
+    parser.add_argument("--json", dest="json_out", default=None, help="Write results to this file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+
+StageFn = Callable[..., Awaitable[Any]]
+
+
+class StageRunner:
+    """Runs named async stages concurrently, each as soon as the stages it
+    depends on have finished.
+
+    A stage is called with the results of its dependencies, in the order
+    they were listed. If any stage fails, the others are cancelled and the
+    error is raised from `run`.
+    """
+
+    def __init__(self):
+        self._stages: List[Tuple[str, StageFn, Sequence[str]]] = []
+
+    def add(self, name: str, fn: StageFn, after: Sequence[str] = ()) -> "StageRunner":
+        known = {n for n, _, _ in self._stages}
+        missing = [d for d in after if d not in known]
+        if missing:
+            # Dependencies must be added first, which also rules out cycles
+            raise ValueError(f"Stage {name!r} depends on unknown stages {missing}")
+        if name in known:
+            raise ValueError(f"Duplicate stage {name!r}")
+        self._stages.append((name, fn, tuple(after)))
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def call(fn: StageFn, after: Sequence[str]) -> Any:
+            args = [await tasks[d] for d in after]
+            return await fn(*args)
+
+        for name, fn, after in self._stages:
+            tasks[name] = asyncio.ensure_future(call(fn, after))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
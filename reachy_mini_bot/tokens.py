@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to an approximation
+    tiktoken = None
+
+
+# Words, numbers and individual punctuation marks: close to BPE counts for
+# English prose and code without needing the tokenizer files
+_APPROX_RE = re.compile(r"\w{1,8}|[^\w\s]")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The BPE file is downloaded on first use and may be unavailable offline
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(_APPROX_RE.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        return enc.decode(ids[:max_tokens])
+    cut: Optional[int] = None
+    for i, m in enumerate(_APPROX_RE.finditer(text)):
+        if i == max_tokens:
+            cut = m.start()
+            break
+    return text if cut is None else text[:cut]
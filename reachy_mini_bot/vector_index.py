@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+logger = logging.getLogger("reachy-mini.vectors")
+
+VECTOR_DTYPES = ("int8", "float16")
+# Rows converted and scored at a time: small enough that the float32 copy
+# stays in cache, so a query never converts the whole index
+_BLOCK = 256
+
+
+@dataclass
+class _View:
+    # Immutable snapshot that queries read while writers build the next one
+    quant: np.ndarray
+    scales: Optional[np.ndarray]
+    exact: np.ndarray
+    live: np.ndarray
+    row_ids: List[Optional[str]]
+
+
+def _normalize(vectors: Any) -> np.ndarray:
+    v = np.asarray(vectors, dtype=np.float32)
+    if v.ndim == 1:
+        v = v[None, :]
+    return v / np.clip(np.linalg.norm(v, axis=1, keepdims=True), 1e-12, None)
+
+
+def _quantize(v: np.ndarray, dtype: str):
+    if dtype == "int8":
+        # Symmetric per-row scale: row ≈ q * scale
+        scales = np.clip(np.abs(v).max(axis=1), 1e-12, None) / 127.0
+        return np.round(v / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return v.astype(np.float16), None
+
+
+def _map(path: str, dtype: Any, width: int) -> np.ndarray:
+    # Empty files cannot be memory-mapped
+    itemsize = np.dtype(dtype).itemsize * width
+    rows = os.path.getsize(path) // itemsize if os.path.exists(path) else 0
+    if rows == 0:
+        return np.zeros((0, width), dtype=dtype) if width > 1 else np.zeros(0, dtype=dtype)
+    shape = (rows, width) if width > 1 else (rows,)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class MmapVectorIndex:
+    """Chunk vectors in memory-mapped NumPy files, searched by brute force.
+
+    Speaks the subset of Chroma's collection API that `RAGStore` uses
+    (`count`, `get`, `upsert`, `update`, `delete`, `query`), so it can stand
+    in for the `PersistentClient` collection. It is meant for corpora of up
+    to a few hundred thousand chunks.
+
+    Unit-normalized vectors are kept twice: quantized to int8 (with a
+    per-row scale) or float16 for the scan, and as float32 for the optional
+    exact rescoring of the best `rescore_factor * k` candidates. Only the
+    pages a query touches become resident. Files are append-only: an
+    operation log (`log.jsonl`) maps ids to rows and holds documents and
+    metadata, and `compact` rewrites a new generation once rows have been
+    replaced or deleted. Other processes see writes after reopening; a
+    `read_only` index never changes the files, and refuses writes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function: Optional[Any] = None,
+        dtype: str = "int8",
+        rescore: bool = True,
+        rescore_factor: int = 4,
+        read_only: bool = False,
+    ):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r} (expected one of {VECTOR_DTYPES})")
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.read_only = read_only
+        self.embedding_function = embedding_function
+        self.dtype = dtype
+        self.rescore = rescore
+        self.rescore_factor = max(1, rescore_factor)
+        self._lock = threading.RLock()
+        self._open()
+
+    # -- files -------------------------------------------------------------
+
+    def _file(self, name: str, generation: Optional[int] = None) -> str:
+        g = self._generation if generation is None else generation
+        return os.path.join(self.path, f"{name}.{g}")
+
+    def _open(self) -> None:
+        head_path = os.path.join(self.path, "index.json")
+        head: Dict[str, Any] = {}
+        if os.path.exists(head_path):
+            with open(head_path, "r", encoding="utf-8") as f:
+                head = json.load(f)
+        self._generation = int(head.get("generation", 0))
+        self.dim = int(head.get("dim", 0))
+        self._row: Dict[str, int] = {}
+        self._docs: Dict[str, str] = {}
+        self._metas: Dict[str, dict] = {}
+        row_ids: List[Optional[str]] = []
+        log_path = self._file("log.jsonl")
+        self._log_end = 0
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        op = json.loads(line)
+                    except ValueError:
+                        # A write in progress in another process, or torn by a crash
+                        break
+                    self._replay(op, row_ids)
+                    self._log_end += len(line)
+        exact = _map(self._file("exact.f32"), np.float32, self.dim or 1)
+        # Only rows the log refers to; a torn append past it is ignored
+        rows = min(len(row_ids), len(exact))
+        self._trimmed = False
+        row_ids = row_ids[:rows]
+        for doc_id in [i for i, r in self._row.items() if r >= rows]:
+            self._forget(doc_id)
+        stored = head.get("dtype", self.dtype)
+        if rows and stored != self.dtype and self.read_only:
+            # Requantizing is the writer's job; scan the files as they are
+            self.dtype = stored
+        elif rows and stored != self.dtype:
+            # Quantization changed in the settings: requantize from float32
+            self._rewrite(exact[:rows], row_ids)
+            return
+        self._set_view(row_ids, rows)
+
+    def _replay(self, op: dict, row_ids: List[Optional[str]]) -> None:
+        kind = op.get("op")
+        doc_id = op.get("id")
+        if kind == "add":
+            old = self._row.get(doc_id)
+            if old is not None:
+                row_ids[old] = None
+            row = op["row"]
+            row_ids.extend([None] * (row + 1 - len(row_ids)))
+            row_ids[row] = doc_id
+            self._row[doc_id] = row
+            self._docs[doc_id] = op.get("doc") or ""
+            self._metas[doc_id] = op.get("meta") or {}
+        elif kind == "meta" and doc_id in self._row:
+            self._metas[doc_id] = op.get("meta") or {}
+        elif kind == "del" and doc_id in self._row:
+            row_ids[self._row[doc_id]] = None
+            self._forget(doc_id)
+
+    def _forget(self, doc_id: str) -> None:
+        self._row.pop(doc_id, None)
+        self._docs.pop(doc_id, None)
+        self._metas.pop(doc_id, None)
+
+    def _set_view(self, row_ids: List[Optional[str]], rows: int) -> None:
+        width = self.dim or 1
+        quant_dtype = np.int8 if self.dtype == "int8" else np.float16
+        live = np.fromiter((i is not None for i in row_ids), dtype=bool, count=len(row_ids))
+        self._view = _View(
+            quant=_map(self._file("quant"), quant_dtype, width)[:rows],
+            scales=_map(self._file("scales.f32"), np.float32, 1)[:rows] if self.dtype == "int8" else None,
+            exact=_map(self._file("exact.f32"), np.float32, width)[:rows],
+            live=live,
+            row_ids=row_ids,
+        )
+
+    def _write_head(self, generation: int) -> None:
+        head_path = os.path.join(self.path, "index.json")
+        tmp = head_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "dim": self.dim, "dtype": self.dtype}, f)
+        os.replace(tmp, head_path)
+
+    def _trim(self) -> None:
+        # Before the first write, cut what a crashed writer left past the
+        # last complete log line, so new rows and lines land where expected.
+        # Only the writer does this; readers merely ignore the tail.
+        if self.read_only:
+            raise RuntimeError(f"Vector index {self.path} is open read-only")
+        if self._trimmed:
+            return
+        rows = len(self._view.row_ids)
+        quant_size = 1 if self.dtype == "int8" else 2
+        sizes = {
+            "log.jsonl": self._log_end,
+            "exact.f32": rows * 4 * (self.dim or 1),
+            "quant": rows * quant_size * (self.dim or 1),
+            "scales.f32": rows * 4,
+        }
+        for name, size in sizes.items():
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                logger.warning("Dropping a torn write at the end of %s", path)
+                os.truncate(path, size)
+        self._trimmed = True
+
+    def _append(self, name: str, data: np.ndarray) -> None:
+        with open(self._file(name), "ab") as f:
+            f.write(np.ascontiguousarray(data).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _log(self, ops: Iterable[dict]) -> None:
+        with open(self._file("log.jsonl"), "a", encoding="utf-8") as f:
+            for op in ops:
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self, exact: np.ndarray, row_ids: List[Optional[str]]) -> None:
+        # New generation with live rows only, published by replacing index.json
+        keep = [r for r, i in enumerate(row_ids) if i is not None]
+        vectors = np.asarray(exact[keep], dtype=np.float32) if keep else np.zeros((0, self.dim))
+        old = self._generation
+        self._generation = old + 1
+        for name in ("exact.f32", "quant", "scales.f32", "log.jsonl"):
+            path = self._file(name)
+            if os.path.exists(path):
+                os.remove(path)
+        new_ids = [row_ids[r] for r in keep]
+        if keep:
+            quant, scales = _quantize(vectors, self.dtype)
+            self._append("exact.f32", vectors)
+            self._append("quant", quant)
+            if scales is not None:
+                self._append("scales.f32", scales)
+        self._log(
+            {"op": "add", "id": i, "row": r, "doc": self._docs[i], "meta": self._metas[i]}
+            for r, i in enumerate(new_ids)
+        )
+        self._row = {i: r for r, i in enumerate(new_ids)}
+        self._write_head(self._generation)
+        # Readers that mapped the old files keep them until they reopen
+        for name in ("exact.f32", "quant", "scales.f32", "log.jsonl"):
+            path = self._file(name, old)
+            if os.path.exists(path):
+                os.remove(path)
+        self._trimmed = True
+        self._set_view(list(new_ids), len(new_ids))
+
+    def compact(self, min_dead_fraction: float = 0.2) -> bool:
+        """Rewrite without replaced and deleted rows once they are at least
+        `min_dead_fraction` of the files. Returns whether it rewrote."""
+        with self._lock:
+            view = self._view
+            total = len(view.row_ids)
+            dead = total - int(view.live.sum())
+            if self.read_only or not total or dead < max(1, min_dead_fraction * total):
+                return False
+            self._rewrite(view.exact, view.row_ids)
+            logger.info("Compacted vector index %s: %d dead rows dropped", self.path, dead)
+            return True
+
+    # -- Chroma collection API subset ----------------------------------------
+
+    def count(self) -> int:
+        return len(self._row)
+
+    def upsert(
+        self,
+        ids: List[str],
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[dict]] = None,
+        embeddings: Optional[Any] = None,
+    ) -> None:
+        if not ids:
+            return
+        documents = documents or [""] * len(ids)
+        if embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("No embeddings given and no embedding function set")
+            embeddings = self.embedding_function(documents)
+        vectors = _normalize(embeddings)
+        with self._lock:
+            self._trim()
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self._write_head(self._generation)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} != index dimension {self.dim}")
+            view = self._view
+            start = len(view.row_ids)
+            quant, scales = _quantize(vectors, self.dtype)
+            # Vectors first: a log line never points past the vector files
+            self._append("exact.f32", vectors)
+            self._append("quant", quant)
+            if scales is not None:
+                self._append("scales.f32", scales)
+            ops = []
+            row_ids = list(view.row_ids)
+            for n, doc_id in enumerate(ids):
+                meta = (metadatas[n] if metadatas else None) or {}
+                op = {"op": "add", "id": doc_id, "row": start + n, "doc": documents[n], "meta": meta}
+                ops.append(op)
+                self._replay(op, row_ids)
+            self._log(ops)
+            self._set_view(row_ids, len(row_ids))
+
+    def update(self, ids: List[str], metadatas: Optional[List[dict]] = None) -> None:
+        if not ids or not metadatas:
+            return
+        with self._lock:
+            self._trim()
+            ops = []
+            for doc_id, meta in zip(ids, metadatas):
+                if doc_id in self._row:
+                    # Chroma merges updated metadata keys into the existing ones
+                    merged = {**self._metas[doc_id], **(meta or {})}
+                    ops.append({"op": "meta", "id": doc_id, "meta": merged})
+                    self._metas[doc_id] = merged
+            self._log(ops)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None) -> None:
+        with self._lock:
+            targets = [i for i in (ids or []) if i in self._row]
+            if where:
+                targets += [
+                    i
+                    for i, meta in self._metas.items()
+                    if all(meta.get(k) == v for k, v in where.items())
+                ]
+            targets = list(dict.fromkeys(targets))
+            if not targets:
+                return
+            self._trim()
+            row_ids = list(self._view.row_ids)
+            ops = [{"op": "del", "id": i} for i in targets]
+            for op in ops:
+                self._replay(op, row_ids)
+            self._log(ops)
+            self._set_view(row_ids, len(row_ids))
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        include: Sequence[str] = ("documents", "metadatas"),
+    ) -> Dict[str, Any]:
+        with self._lock:
+            view = self._view
+            if ids is None:
+                chosen = [i for i in view.row_ids if i is not None]
+                chosen = chosen[offset : offset + limit if limit is not None else None]
+            else:
+                chosen = [i for i in ids if i in self._row]
+            out: Dict[str, Any] = {"ids": chosen}
+            if "documents" in include:
+                out["documents"] = [self._docs[i] for i in chosen]
+            if "metadatas" in include:
+                out["metadatas"] = [self._metas[i] for i in chosen]
+            rows = [self._row[i] for i in chosen]
+        if "embeddings" in include:
+            out["embeddings"] = np.asarray(view.exact[rows], dtype=np.float32)
+        return out
+
+    def query(
+        self,
+        query_embeddings: Any,
+        n_results: int = 10,
+        include: Sequence[str] = ("documents", "metadatas", "distances"),
+    ) -> Dict[str, Any]:
+        view = self._view
+        out: Dict[str, List[list]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for q in _normalize(query_embeddings):
+            rows, sims = self._search(view, q, n_results)
+            chosen = [view.row_ids[r] for r in rows]
+            with self._lock:
+                # Rows removed since the snapshot are dropped
+                keep = [n for n, i in enumerate(chosen) if i in self._row]
+                out["ids"].append([chosen[n] for n in keep])
+                out["documents"].append([self._docs[chosen[n]] for n in keep])
+                out["metadatas"].append([self._metas[chosen[n]] for n in keep])
+            # Same convention as Chroma's cosine space: distance = 1 - similarity
+            out["distances"].append([float(1.0 - sims[n]) for n in keep])
+        return {k: v for k, v in out.items() if k == "ids" or k in include}
+
+    def _search(self, view: _View, q: np.ndarray, k: int):
+        n = len(view.row_ids)
+        if not n or k <= 0 or not view.live.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if q.shape[0] != view.quant.shape[1]:
+            raise ValueError(f"Query dimension {q.shape[0]} != index dimension {view.quant.shape[1]}")
+        scores = np.empty(n, dtype=np.float32)
+        buf = np.empty((min(n, _BLOCK), q.shape[0]), dtype=np.float32)
+        for start in range(0, n, _BLOCK):
+            quant = view.quant[start : start + _BLOCK]
+            block = buf[: len(quant)]
+            np.copyto(block, quant, casting="unsafe")
+            s = block @ q
+            if view.scales is not None:
+                s *= view.scales[start : start + _BLOCK]
+            scores[start : start + _BLOCK] = s
+        scores[~view.live] = -np.inf
+        live = int(view.live.sum())
+        fetch = min(live, k * self.rescore_factor if self.rescore else k)
+        top = np.argpartition(-scores, fetch - 1)[:fetch] if fetch < n else np.arange(n)
+        top = top[np.isfinite(scores[top])]
+        if self.rescore:
+            rows = np.sort(top)
+            exact = np.asarray(view.exact[rows], dtype=np.float32) @ q
+            order = np.argsort(-exact, kind="stable")[:k]
+            return rows[order], exact[order]
+        order = np.argsort(-scores[top], kind="stable")[:k]
+        return top[order], scores[top][order]
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Set
+
+from .config import Settings
+
+if TYPE_CHECKING:
+    from .rag import RAGStore, RetrievedDoc
+
+
+logger = logging.getLogger("reachy-mini.workers")
+
+# Per-process state of a query worker, set up by `_init_worker`
+_settings: Optional[Settings] = None
+_store: Optional[RAGStore] = None
+_generation = 0
+
+
+def _serves_retrieval(settings: Settings) -> bool:
+    # Only the mmap store opens without writing; Chroma stays in the gateway
+    return settings.vector_store == "mmap"
+
+
+def _init_worker(settings: Settings) -> None:
+    global _settings
+    _settings = settings
+    if _serves_retrieval(settings):
+        _open_store(0)
+
+
+def _open_store(generation: int) -> None:
+    # The mmap index's id table and the BM25 index live in memory per
+    # process and miss writes made by the gateway: reopen from disk
+    global _store, _generation
+    from .rag import RAGStore
+
+    if _store is not None:
+        _store.close()
+    _store = RAGStore.from_settings(_settings, read_only=True)
+    _store.warm()
+    _generation = generation
+
+
+def _query(generation: int, text: str, k: int) -> List[RetrievedDoc]:
+    if generation != _generation:
+        _open_store(generation)
+    return _store.query(text, k)
+
+
+def _pid(hold: float = 0.0) -> int:
+    # Holding the worker a moment sends the other calls of a round elsewhere
+    time.sleep(hold)
+    return os.getpid()
+
+
+class QueryWorkerPool:
+    """Retrieval and other CPU-bound request work in separate processes.
+
+    Attachment parsing always runs here. With the mmap vector store, so does
+    retrieval (query embedding, vector and BM25 search, reranking): each
+    worker opens the store read-only, without writing to the vector files,
+    the BM25 index or the embedding cache, and under `store_lock`, so it
+    never loads files an ingest is halfway through changing. The gateway
+    process owns all writes; `invalidate` after it persisted makes every
+    worker reopen the store on its next query. Chroma cannot be opened
+    without writing, so with it retrieval stays in the gateway.
+
+    Workers are supervised: if one dies, the pool is replaced and the calls
+    that were running on it are retried once on the new pool.
+    """
+
+    def __init__(self, settings: Settings, workers: int):
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.retrieval = _serves_retrieval(settings)
+        self.generation = 0
+        self.restarts = 0
+        # Spawned, not forked: the gateway process already runs threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._ctx,
+            initializer=_init_worker,
+            initargs=(self.settings,),
+        )
+
+    async def start(self) -> None:
+        """Spawn every worker and return once each of them has started (and
+        opened the store, when it serves retrieval)."""
+        if self._pool is None:
+            self._pool = self._new_pool()
+        # Processes are spawned on demand, one per call that finds none idle.
+        # A process that is up may take several calls of a round, so repeat
+        # until every one has answered.
+        pids: Set[int] = set()
+        while len(pids) < self.workers:
+            pids.update(await asyncio.gather(*(self.run(_pid, 0.05) for _ in range(self.workers))))
+        logger.info("Query workers started: %d processes", self.workers)
+
+    def invalidate(self) -> None:
+        # Fits RAGStore.persist_listeners
+        self.generation += 1
+
+    async def query(self, text: str, k: int) -> List[RetrievedDoc]:
+        return await self.run(_query, self.generation, text, k)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run the module-level function `fn(*args)` on a worker."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._pool
+            if pool is None:
+                raise RuntimeError("Query workers are not running")
+            try:
+                return await loop.run_in_executor(pool, fn, *args)
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                self._replace(pool)
+
+    def _replace(self, broken: ProcessPoolExecutor) -> None:
+        # Calls failing on the same broken pool share one replacement
+        if self._pool is not broken:
+            return
+        self.restarts += 1
+        logger.warning("A query worker died; restarting the pool (restart %d)", self.restarts)
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._new_pool()
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from reachy_mini_bot.discord_bot import ReachyMiniClient
+from reachy_mini_bot.scripts.fake_openai import FakeOpenAIServer
+from reachy_mini_bot.scripts.loadtest import BOT_ID, FakeMessage, FakeTextChannel, FakeUser
+
+
+QUESTIONS = [
+    "How do I restart the daemon?",
+    "Why does the head not move after a firmware update?",
+    "The antennas twitch when the app starts, is that normal?",
+]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    # Chat is stubbed per test; the fake server only answers warm-up calls
+    server = FakeOpenAIServer()
+    base_url = server.start_in_thread()
+    for var, value in {
+        "discord_token": "test",
+        "OPENAI_API_KEY": "sk-test",
+        "OPENAI_BASE_URL": base_url,
+        "RAG_DB_PATH": str(tmp_path / "db"),
+        "EMBEDDING_BACKEND": "hash",
+        "STREAM_REPLIES": "0",
+        "ANSWER_CACHE_SIZE": "0",
+        "LLM_CONCURRENCY": str(len(QUESTIONS)),
+        "REQUEST_CONCURRENCY": str(len(QUESTIONS)),
+    }.items():
+        monkeypatch.setenv(var, value)
+    yield
+    server.stop_thread()
+
+
+def test_concurrent_mentions_overlap_a_slow_llm(env):
+    in_flight = 0
+    peak = 0
+
+    async def slow_chat(messages, temperature=0.2, max_tokens=None) -> str:
+        # A fake LLM that takes one second per call
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(1)
+        in_flight -= 1
+        return "Restart the daemon."
+
+    async def run() -> float:
+        client = ReachyMiniClient()
+        try:
+            # What login() would set up: the bot user and the loop events run on
+            client._connection.user = FakeUser(BOT_ID, bot=True)
+            client.loop = asyncio.get_running_loop()
+            await client.warm_up()
+            client.ai.chat = slow_chat
+            channel = FakeTextChannel(client, 0.0)
+            # Separate users and questions, so nothing is rate-limited or merged
+            messages = [
+                FakeMessage(FakeUser(100 + i), channel, f"<@{BOT_ID}> {q}", mentions=[client.user])
+                for i, q in enumerate(QUESTIONS)
+            ]
+            t = time.perf_counter()
+            await asyncio.gather(*(client.on_message(m) for m in messages))
+            await client.outbound.join()
+            elapsed = time.perf_counter() - t
+            requests = client.metrics.counter("reachy_requests_total")
+            assert requests.value(outcome="ok") == len(QUESTIONS)
+            assert client.outbound.calls["send"] == len(QUESTIONS)
+            return elapsed
+        finally:
+            await client.close_services()
+
+    elapsed = asyncio.run(run())
+    # The calls overlap: about one round trip, not one per mention
+    assert peak == len(QUESTIONS)
+    assert 1.0 <= elapsed < 1.8
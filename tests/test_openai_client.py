@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from openai import APIStatusError
+
+from reachy_mini_bot.openai_client import OpenAIClient
+from reachy_mini_bot.scripts.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+
+
+MESSAGES = [{"role": "user", "content": "How do I restart the daemon?"}]
+
+
+@pytest.fixture
+def fake():
+    # Instant, deterministic replies; each test injects its own faults
+    server = FakeOpenAIServer(
+        FakeOpenAIConfig(chat_latency=0.0, jitter=0.0, reply_words=5, word_interval=0.0, seed=0)
+    )
+    server.start_in_thread()
+    yield server
+    server.stop_thread()
+
+
+def _client(server: FakeOpenAIServer, **kwargs) -> OpenAIClient:
+    kwargs.setdefault("max_retries", 0)
+    return OpenAIClient("sk-test", "primary", base_url=server.base_url, **kwargs)
+
+
+async def _chat(client: OpenAIClient, heal=None, after: float = 0.0):
+    # `heal` clears the injected fault `after` seconds into the call
+    if heal is not None:
+        asyncio.get_running_loop().call_later(after, heal)
+    t = time.perf_counter()
+    try:
+        return await client.chat(MESSAGES), time.perf_counter() - t
+    finally:
+        await client.close()
+
+
+def test_retry_after_is_honoured(fake):
+    fake.config.rate_limit_rate = 1.0
+    client = _client(fake, max_retries=2)
+    reply, elapsed = asyncio.run(
+        _chat(client, lambda: setattr(fake.config, "rate_limit_rate", 0.0), after=0.3)
+    )
+    assert reply
+    # The fake sends Retry-After: 1; jittered backoff would retry within 0.5s
+    assert elapsed >= 1.0
+    assert client.responses == {429: 1, 200: 1}
+    assert client.outcomes == {"retry": 1, "ok": 1}
+
+
+def test_hedge_wins_past_a_stall(fake):
+    fake.config.stall_rate = 1.0
+    fake.config.stall_seconds = 3.0
+    client = _client(fake, hedge_after=0.3)
+    # Only the first request stalls; the hedge sent at 0.3s does not
+    reply, elapsed = asyncio.run(
+        _chat(client, lambda: setattr(fake.config, "stall_rate", 0.0), after=0.1)
+    )
+    assert reply
+    assert elapsed < 1.5
+    assert fake.stats.stalls == 1
+    assert client.outcomes == {"hedge": 1, "hedge_won": 1, "ok": 1}
+
+
+def test_breaker_opens_and_fallback_is_used(fake):
+    fake.config.failing_models = ("primary",)
+    client = _client(fake, fallback_model="backup", breaker_threshold=2, breaker_cooldown=60.0)
+
+    async def three() -> list:
+        try:
+            return [await client.chat(MESSAGES) for _ in range(3)]
+        finally:
+            await client.close()
+
+    replies = asyncio.run(three())
+    assert all(replies)
+    # Two 503s open the primary's breaker; the third call skips it entirely
+    assert client.breaker_states() == {"primary": "open", "backup": "closed"}
+    assert client.responses == {503: 2, 200: 3}
+    assert client.outcomes == {"fallback": 3, "circuit_open": 1}
+
+
+def test_outcomes_when_every_model_fails(fake):
+    fake.config.failing_models = ("primary", "backup")
+    client = _client(fake, fallback_model="backup", max_retries=1)
+    with pytest.raises(APIStatusError):
+        asyncio.run(_chat(client))
+    # One retry per model, then the last error is raised
+    assert client.responses == {503: 4}
+    assert client.outcomes == {"retry": 2, "error": 1}
+    assert client.breaker_states() == {"primary": "closed", "backup": "closed"}
+